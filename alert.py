@@ -1,17 +1,18 @@
 import requests
 import credentials
 
-def send_notif(message, chat_id='6774030856'):
+def send_notif(message, chat_id='6774030856', timeout=10):
     # if check_network():
         # chat_id = '6774030856' # Ann chat
         # chat_id = '-4246098511' # allen group chat
         bot_key = credentials.TELEGRAM_BOT_TOKEN
         
-        send_message_url = f'https://api.telegram.org/bot{bot_key}/sendMessage?chat_id={chat_id}&text={message}'
-        res = requests.post(send_message_url)
+        send_message_url = f'https://api.telegram.org/bot{bot_key}/sendMessage'
+        # params are url-encoded by requests, so messages with &, # or + arrive intact
+        res = requests.post(send_message_url, params={'chat_id': chat_id, 'text': message}, timeout=timeout)
 
         if res.ok:
             print('Message sent successfully!')
         else:
             print('message not sent')
-  
\ No newline at end of file
+        return res.ok
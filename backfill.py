@@ -0,0 +1,180 @@
+import argparse
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+import metrics
+import nav_test
+import pm_mapping
+import shares_cache
+import storage
+
+
+# Recompute nav_table for a whole [start, end] range of minutes in one vectorized pass.
+# Every minute in the range follows the same rules as a live nav_test.main() tick:
+# - update_frequency freshness (minute PMs need a row at the tick, hour PMs a row at the tick's hour)
+# - active PMs without fresh data fall back to their latest non-null balance within the lookback
+# - inactive PMs never fall back
+
+TS_DTYPE = 'datetime64[ns, UTC]'
+
+
+def load_balances(start, end, max_lookback_hours=2):
+    """
+    Stream balance_all_consolidated for the range once, including the lookback window before start
+    """
+    balances = storage.get_store().balance_range(start - timedelta(hours=max_lookback_hours), end)
+    if balances.empty:
+        return pd.DataFrame({'timestamp': pd.Series(dtype=TS_DTYPE), 'pm': pd.Series(dtype=object),
+                             'balance': pd.Series(dtype='float64')})
+
+    balances['timestamp'] = pd.to_datetime(balances['timestamp'], utc=True).astype(TS_DTYPE)
+    return balances
+
+
+def select_balances(balances, mapping, ticks, max_lookback_hours=2):
+    """
+    Per tick, per PM balance selection for a range of ticks
+
+    Returns:
+        tuple: (enhanced balance frame with tick, timestamp, pm, balance, is_fallback, is_inactive,
+                per tick report with fallback / missing PM counts)
+    """
+    frame = mapping.frame[['pm', 'update_frequency']]
+    grid = pd.MultiIndex.from_product([ticks, frame['pm']], names=['tick', 'pm']).to_frame(index=False)
+    grid['tick'] = grid['tick'].astype(TS_DTYPE)
+    grid['hour'] = grid['tick'].dt.floor('h')
+    grid = grid.merge(frame, on='pm', how='left')
+
+    # same as live: when several rows share a (pm, timestamp) only one of them is used
+    rows = balances.drop_duplicates(subset=['pm', 'timestamp'], keep='last')
+    at_tick = rows.rename(columns={'timestamp': 'tick', 'balance': 'balance_tick'}).assign(has_tick=True)
+    at_hour = rows.rename(columns={'timestamp': 'hour', 'balance': 'balance_hour'}).assign(has_hour=True)
+    grid = grid.merge(at_tick, on=['tick', 'pm'], how='left').merge(at_hour, on=['hour', 'pm'], how='left')
+
+    # live takes the latest of the rows at curr / curr_hour, then applies the freshness rule to it
+    has_tick = grid['has_tick'].notna().to_numpy()
+    has_hour = grid['has_hour'].notna().to_numpy()
+    grid['timestamp'] = grid['tick'].where(has_tick, grid['hour'].where(has_hour))
+    grid['balance'] = grid['balance_tick'].where(has_tick, grid['balance_hour'])
+    valid = (has_tick | has_hour) & nav_test.is_valid_timestamp_vectorized(
+        grid['update_frequency'], grid['timestamp'], grid['tick'], grid['hour']
+    )
+
+    fresh = grid.loc[valid, ['tick', 'timestamp', 'pm', 'balance']].copy()
+    fresh['is_fallback'] = False
+    fresh['is_inactive'] = fresh['pm'].isin(mapping.inactive_pms)
+
+    # as-of join: latest non-null balance within the lookback for every (tick, active PM) without fresh data
+    missing = grid.loc[~valid & grid['pm'].isin(mapping.active_pms), ['tick', 'pm']].sort_values('tick')
+    non_null = rows[rows['balance'].notna()].rename(columns={'timestamp': 'fallback_timestamp'})
+    # merge_asof needs identical key dtypes, an empty balance frame comes back as object
+    missing['pm'] = missing['pm'].astype(object)
+    non_null = non_null.astype({'pm': object})
+    fallback = pd.merge_asof(
+        missing, non_null.sort_values('fallback_timestamp'),
+        left_on='tick', right_on='fallback_timestamp', by='pm',
+        direction='backward', tolerance=pd.Timedelta(hours=max_lookback_hours)
+    )
+    found = fallback['fallback_timestamp'].notna()
+
+    fallback_rows = fallback.loc[found, ['tick', 'pm', 'balance']].copy()
+    # Update timestamp to the tick for aggregation purposes
+    fallback_rows['timestamp'] = fallback_rows['tick']
+    fallback_rows['is_fallback'] = True
+    fallback_rows['is_inactive'] = False
+
+    report = pd.DataFrame({
+        'using_fallback_data': fallback[found].groupby('tick').size(),
+        'completely_missing': fallback[~found].groupby('tick').size(),
+    }).reindex(ticks.astype(TS_DTYPE)).fillna(0).astype(int).rename_axis('tick').reset_index()
+
+    enhanced = pd.concat([fresh, fallback_rows[fresh.columns]], ignore_index=True)
+    return enhanced, report
+
+
+def compute_range(start, end, mapping=None, shares_history=None, balances=None, max_lookback_hours=2):
+    """
+    Compute the published nav rows for every minute in [start, end]
+
+    Returns:
+        tuple: (nav rows with tick + nav_test.NAV_COLUMNS, per tick report)
+    """
+    if mapping is None:
+        mapping = pm_mapping.get_snapshot()
+    if mapping.empty:
+        raise ValueError("Failed to load PM mapping data from database")
+    if shares_history is None:
+        shares_history = shares_cache.get_shares_history()
+    if balances is None:
+        with metrics.span('load_balances') as m:
+            balances = load_balances(start, end, max_lookback_hours)
+            m['rows'] = len(balances)
+
+    ticks = pd.date_range(start, end, freq='min')
+    with metrics.span('select_balances'):
+        enhanced, report = select_balances(balances, mapping, ticks, max_lookback_hours)
+
+    with metrics.span('rollup') as m:
+        bal_concat = nav_test.aggregate_nodes(enhanced, mapping)
+        m['rows'] = len(bal_concat)
+    with metrics.span('attach_shares'):
+        pm_result_df = nav_test.attach_shares_and_nav(bal_concat, shares_history)
+
+    # hour PM nodes carry their hour timestamp on every tick of that hour - keep one row per
+    # (timestamp, pm), preferring the one computed on the tick the timestamp belongs to
+    in_range = (pm_result_df['timestamp'] >= ticks[0]) & (pm_result_df['timestamp'] <= ticks[-1])
+    pm_result_df = pm_result_df[in_range]
+    pm_result_df = pm_result_df.assign(off_tick=pm_result_df['tick'] != pm_result_df['timestamp'])
+    pm_result_df = pm_result_df.sort_values(['off_tick', 'tick']).drop_duplicates(subset=['timestamp', 'pm'])
+    pm_result_df = pm_result_df.sort_values(['timestamp', 'pm']).drop(columns=['off_tick'])
+
+    return pm_result_df[['tick'] + nav_test.NAV_COLUMNS], report
+
+
+def replace_nav_range(df_db, start, end):
+    """
+    Replace the nav_table rows of the recomputed nodes in [start, end]
+    """
+    # delete + insert in one transaction so a failed write never leaves a hole
+    return storage.get_store().replace_nav_range(df_db, start, end)
+
+
+def print_report(report, n_rows):
+    start, end = report['tick'].iloc[0], report['tick'].iloc[-1]
+    print(f"Computed {n_rows} nav rows for {len(report)} minutes ({start} -> {end})")
+    degraded = report[(report['using_fallback_data'] > 0) | (report['completely_missing'] > 0)]
+    if not degraded.empty:
+        print(f"⚠ {len(degraded)} minutes used fallback data or had missing PMs:")
+        print(degraded.to_string(index=False))
+
+
+def backfill(start, end, write=True, max_lookback_hours=2):
+    start = start.replace(second=0, microsecond=0)
+    end = end.replace(second=0, microsecond=0)
+    if end < start:
+        raise ValueError(f"backfill end {end} is before start {start}")
+
+    pm_result_df, report = compute_range(start, end, max_lookback_hours=max_lookback_hours)
+    df_db = pm_result_df[nav_test.NAV_COLUMNS]
+    print_report(report, len(df_db))
+
+    if write and not df_db.empty and replace_nav_range(df_db, start, end):
+        print('completed')
+    return df_db, report
+
+
+def parse_utc(value):
+    ts = datetime.fromisoformat(value)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.astimezone(timezone.utc)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recompute nav_table for a range of minutes')
+    parser.add_argument('--start', required=True, type=parse_utc, help='first minute, ISO format (UTC if no offset)')
+    parser.add_argument('--end', required=True, type=parse_utc, help='last minute, ISO format (UTC if no offset)')
+    parser.add_argument('--lookback-hours', type=float, default=2, help='fallback lookback window')
+    parser.add_argument('--dry-run', action='store_true', help='compute and report without writing')
+    args = parser.parse_args()
+
+    backfill(args.start, args.end, write=not args.dry_run, max_lookback_hours=args.lookback_hours)
@@ -0,0 +1,247 @@
+import bisect
+import threading
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+import storage
+
+
+# Recent balances of every pm kept in memory by a resident process (nav_daemon), so an active pm
+# missing its current balance is resolved by a binary search instead of a lookback query.
+# The buffer is loaded with one windowed query and then fed the balances each tick reads anyway
+# (latest_balance plus the exact lookups). The database is only read on a cold start, after minutes
+# that were not fed (a gap), or for a lookback reaching before the loaded window.
+# A row inserted late with a timestamp older than one already fed is not seen until the next load.
+
+BUFFER_HOURS = 3  # more than the 2 hour fallback lookback
+SAMPLES_PER_HOUR = 60  # balances are minutely at most
+FEED_INTERVAL = timedelta(minutes=1)  # ticks fed further apart than this leave a gap
+
+
+def _ns(value):
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize('UTC')
+    return ts.as_unit('ns').value
+
+
+class BalanceBuffer:
+    """
+    Per pm ring buffers of (timestamp, balance) samples - one row per pm in two 2D numpy arrays
+
+    A pm's samples are in timestamp order starting at its head slot; once the row is full the
+    oldest sample is overwritten. NULL balances are not kept (the fallback query skips them too).
+    """
+
+    def __init__(self, hours=BUFFER_HOURS, samples_per_hour=SAMPLES_PER_HOUR):
+        self.hours = hours
+        self.capacity = hours * samples_per_hour
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.rows = {}  # pm -> row of the arrays
+        self.ts = np.zeros((0, self.capacity), dtype='int64')  # ns since epoch, UTC
+        self.balance = np.zeros((0, self.capacity))
+        self.head = np.zeros(0, dtype='int64')  # slot of the oldest sample
+        self.size = np.zeros(0, dtype='int64')
+        self.covered_from = None  # every balance row between these two
+        self.covered_to = None  # timestamps has been loaded or fed
+
+    # ── feeding ────────────────────────────────────────────────────────────────
+
+    def load(self, curr):
+        """
+        Cold start: replace the contents with the window [curr - hours, curr] in one query
+
+        Returns:
+            bool: False if the read failed - the buffer stays cold and the next lookup retries
+        """
+        with self.lock:
+            return self._cover(curr)
+
+    def observe(self, rows, through):
+        """
+        Feed balance rows read by the tick `through` (timestamp, pm, balance).
+        The covered range only moves up if the previous tick was fed too.
+        """
+        with self.lock:
+            if self.covered_to is None:
+                return
+            self._insert(rows)
+            if through <= self.covered_to + FEED_INTERVAL:
+                self.covered_to = max(self.covered_to, through)
+
+    def _cover(self, curr):
+        """
+        Make sure every balance up to curr has been seen, reading what is missing
+
+        Returns:
+            bool: False if that read failed - nothing is marked covered then
+        """
+        try:
+            if self.covered_to is None:
+                self._load(curr)
+            elif curr > self.covered_to:
+                self._fill(curr)
+        except storage.StoreReadError as e:
+            print(f'balance buffer not updated, using the fallback query: {e}')
+            return False
+        return True
+
+    def _load(self, curr):
+        # read before resetting, a failed read leaves the buffer as it was
+        start = curr - timedelta(hours=self.hours)
+        rows = storage.get_store().balance_range(start, curr)
+        self.reset()
+        self._insert(rows)
+        self.covered_from, self.covered_to = start, curr
+
+    def _fill(self, curr):
+        """
+        Catch up on minutes that were not fed - the boundary is re-read like shares_cache does
+        """
+        if curr - self.covered_to > timedelta(hours=self.hours):
+            self._load(curr)
+            return
+        self._insert(storage.get_store().balance_range(self.covered_to, curr))
+        self.covered_to = curr
+
+    def _row(self, pm):
+        row = self.rows.get(pm)
+        if row is None:
+            row = self.rows[pm] = len(self.rows)
+            if row == len(self.head):
+                grow = max(16, len(self.head))
+                self.ts = np.vstack([self.ts, np.zeros((grow, self.capacity), dtype='int64')])
+                self.balance = np.vstack([self.balance, np.zeros((grow, self.capacity))])
+                self.head = np.concatenate([self.head, np.zeros(grow, dtype='int64')])
+                self.size = np.concatenate([self.size, np.zeros(grow, dtype='int64')])
+        return row
+
+    def _insert(self, rows):
+        if rows.empty:
+            return
+        rows = rows.dropna(subset=['balance'])
+        ts = pd.DatetimeIndex(pd.to_datetime(rows['timestamp'], utc=True)).as_unit('ns').asi8
+        frame = pd.DataFrame({'pm': rows['pm'].to_numpy(), 'ts': ts, 'balance': rows['balance'].to_numpy(dtype='float64')})
+        frame = frame.drop_duplicates(subset=['pm', 'ts'], keep='last').sort_values(['pm', 'ts'], kind='stable')
+
+        for pm, samples in frame.groupby('pm', sort=False):
+            row = self._row(pm)
+            ts, balance = samples['ts'].to_numpy(), samples['balance'].to_numpy()
+            size = self.size[row]
+            last = self.ts[row, (self.head[row] + size - 1) % self.capacity] if size else None
+            if last is None or ts[0] > last:
+                self._append(row, ts, balance)
+            elif ts[0] == last:
+                # the newest sample fed again (latest_balance unchanged since the last tick)
+                self.balance[row, (self.head[row] + size - 1) % self.capacity] = balance[0]
+                self._append(row, ts[1:], balance[1:])
+            else:
+                self._merge(row, ts, balance)
+
+    def _append(self, row, ts, balance):
+        n = len(ts)
+        if not n:
+            return
+        if n >= self.capacity:
+            self.ts[row], self.balance[row] = ts[-self.capacity:], balance[-self.capacity:]
+            self.head[row], self.size[row] = 0, self.capacity
+            return
+        slots = (self.head[row] + self.size[row] + np.arange(n)) % self.capacity
+        self.ts[row, slots], self.balance[row, slots] = ts, balance
+        overflow = max(0, self.size[row] + n - self.capacity)
+        self.head[row] = (self.head[row] + overflow) % self.capacity
+        self.size[row] = min(self.capacity, self.size[row] + n)
+
+    def _merge(self, row, ts, balance):
+        """
+        Out of order samples (a gap fill re-reading older rows): rebuild the row in timestamp order
+        """
+        slots = (self.head[row] + np.arange(self.size[row])) % self.capacity
+        ts = np.concatenate([self.ts[row, slots], ts])
+        balance = np.concatenate([self.balance[row, slots], balance])
+        order = np.argsort(ts, kind='stable')
+        ts, balance = ts[order], balance[order]
+        keep = np.append(ts[1:] != ts[:-1], True)  # a fed sample replaces a held one with the same timestamp
+        self.head[row], self.size[row] = 0, 0
+        self._append(row, ts[keep], balance[keep])
+
+    # ── lookups ────────────────────────────────────────────────────────────────
+
+    def _search(self, row, t):
+        """
+        Slot of the latest sample at or before t (binary search over the ring), None if there is none
+        """
+        head, size, ts = self.head[row], self.size[row], self.ts[row]
+        i = bisect.bisect_right(range(size), t, key=lambda k: ts[(head + k) % self.capacity])
+        return (head + i - 1) % self.capacity if i else None
+
+    def fallback_balances(self, pms, curr_timestamp, max_lookback_hours=2):
+        """
+        Same rows as store.fallback_balances: the latest non NULL balance per pm within
+        [curr_timestamp - max_lookback_hours, curr_timestamp], pms without one are absent
+        """
+        lookback_start = curr_timestamp - timedelta(hours=max_lookback_hours)
+        with self.lock:
+            covered = self._cover(curr_timestamp) and lookback_start >= self.covered_from
+            if covered:
+                found, unresolved = self._resolve(pms, curr_timestamp, lookback_start)
+        if not covered:
+            # part of the lookback was never seen (cold start or gap that could not be read, or
+            # before the loaded window) - ask the database
+            return storage.get_store().fallback_balances(pms, curr_timestamp, max_lookback_hours)
+
+        result = pd.DataFrame(found, columns=['timestamp', 'pm', 'balance'])
+        result['timestamp'] = pd.to_datetime(result['timestamp'].astype('int64'), utc=True)
+        if unresolved:
+            queried = storage.get_store().fallback_balances(unresolved, curr_timestamp, max_lookback_hours)
+            result = pd.concat([result, queried], ignore_index=True)
+        return result
+
+    def _resolve(self, pms, curr_timestamp, lookback_start):
+        """
+        Returns:
+            tuple: ([(timestamp ns, pm, balance)] found in memory, pms whose answer may have been overwritten)
+        """
+        t, start = _ns(curr_timestamp), _ns(lookback_start)
+        found, unresolved = [], []
+        for pm in sorted(pms):
+            row = self.rows.get(pm)
+            if row is None:
+                continue
+            slot = self._search(row, t)
+            if slot is None:
+                if self.size[row] == self.capacity:
+                    # older samples were overwritten, the answer may be one of them
+                    unresolved.append(pm)
+            elif self.ts[row, slot] >= start:
+                found.append((self.ts[row, slot], pm, self.balance[row, slot]))
+        return found, unresolved
+
+
+_buffer = None
+
+
+def enable(curr, hours=BUFFER_HOURS):
+    """
+    Create and load the process-wide buffer - fallback lookups are served from it from then on
+    """
+    global _buffer
+    buffer = BalanceBuffer(hours)
+    buffer.load(curr)
+    _buffer = buffer
+    return buffer
+
+
+def disable():
+    global _buffer
+    _buffer = None
+
+
+def get_buffer():
+    """
+    The process-wide buffer, None unless enable() was called
+    """
+    return _buffer
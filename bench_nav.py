@@ -0,0 +1,277 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+import numpy as np
+import pandas as pd
+import backfill
+import db_utils
+import nav_test
+import pm_mapping
+import publish_rules
+import rollup
+import shares_cache
+
+
+# Benchmark for the NAV pipeline on synthetic data.
+# Generates pm_mapping / shares_table / balance_all_consolidated in memory, runs every stage
+# of a tick (and a backfill range) against them and appends the timings to BENCH_RESULTS_PATH,
+# so a run can be compared with the previous run of the same shape:
+#
+#   python bench_nav.py --pms 10,100,1000,5000 --fallback-rate 0.05
+#
+# The database is replaced by the in-memory frames - query time is not measured here,
+# only the Python side of each stage.
+
+BENCH_RESULTS_PATH = 'bench_results.jsonl'
+
+# a stage is flagged when it got this much slower than the previous comparable run
+REGRESSION_RATIO = 1.25
+REGRESSION_MIN_SECONDS = 0.001
+
+# fund names follow the real ones first so the gross aliases are exercised
+FUND_NAMES = ['sp1', 'sp2', 'sp2-classa', 'sp2-classb', 'sp3']
+
+
+def generate(n_pms, fanout=8, history_hours=3, fallback_rate=0.05, hour_share=0.5, inactive_rate=0.05,
+             curr=None, seed=0):
+    """
+    Synthetic inputs for one tick
+
+    Args:
+        n_pms: number of sub-accounts
+        fanout: children per node - pm -> pm_group -> group -> fund, so a smaller fanout
+                means more nodes per level
+        history_hours: hours of balance history before the tick
+        fallback_rate: share of active PMs whose row for the tick is missing (they fall back)
+        hour_share: share of PMs with update_frequency 'hour'
+
+    Returns:
+        dict: mapping, shares, balances frames and curr
+    """
+    rng = np.random.default_rng(seed)
+    if curr is None:
+        curr = datetime(2026, 1, 5, 10, 35, tzinfo=timezone.utc)
+    curr_hour = curr.replace(minute=0)
+
+    pms = [f'pm-{i:05d}' for i in range(n_pms)]
+    pm_group_idx = np.arange(n_pms) // fanout
+    group_idx = pm_group_idx // fanout
+    fund_idx = group_idx // fanout
+    funds = [FUND_NAMES[i] if i < len(FUND_NAMES) else f'sp{i}' for i in range(fund_idx.max() + 1)]
+    mapping = pd.DataFrame({
+        'pm': pms,
+        'pm_group': [f'{funds[f]}-pg{g}' for f, g in zip(fund_idx, pm_group_idx)],
+        'group': [f'{funds[f]}-g{g}' for f, g in zip(fund_idx, group_idx)],
+        'fund': [funds[f] for f in fund_idx],
+        'active': rng.random(n_pms) >= inactive_rate,
+        'if_btc': False,
+        'update_frequency': np.where(rng.random(n_pms) < hour_share, 'hour', 'minute'),
+    })
+
+    # minute PMs report every minute, hour PMs on the hour
+    start = curr - timedelta(hours=history_hours)
+    minutes = pd.date_range(start, curr, freq='min')
+    hours = minutes[minutes.minute == 0]
+    is_hour = (mapping['update_frequency'] == 'hour').to_numpy()
+    parts = []
+    for stamps, members in ((minutes, mapping.loc[~is_hour, 'pm']), (hours, mapping.loc[is_hour, 'pm'])):
+        grid = pd.MultiIndex.from_product([stamps, members], names=['timestamp', 'pm']).to_frame(index=False)
+        parts.append(grid)
+    balances = pd.concat(parts, ignore_index=True)
+    balances['timestamp'] = balances['timestamp'].astype(backfill.TS_DTYPE)  # as load_balances returns it
+    balances['balance'] = rng.uniform(1e5, 1e7, len(balances)).round(2)
+
+    # fallback PMs lose the row the tick would use
+    late = mapping.loc[mapping['active'] & (rng.random(n_pms) < fallback_rate), ['pm', 'update_frequency']]
+    due = np.where(late['update_frequency'] == 'hour', curr_hour, curr)
+    dropped = pd.MultiIndex.from_arrays([pd.DatetimeIndex(due), late['pm']])
+    balances = balances[~pd.MultiIndex.from_frame(balances[['timestamp', 'pm']]).isin(dropped)]
+
+    nodes = pd.concat([mapping['pm'], mapping['pm_group'], mapping['group'], mapping['fund']]).unique()
+    nodes = np.concatenate([nodes, [alias for alias, source in rollup.GROSS_ALIASES if source in funds]])
+    share_days = pd.date_range(start.replace(hour=0, minute=0) - timedelta(days=29), start, freq='D')
+    shares = pd.MultiIndex.from_product([share_days, nodes], names=['timestamp', 'pm']).to_frame(index=False)
+    shares['shares'] = rng.uniform(1e4, 1e6, len(shares)).round(4)
+
+    return {'mapping': mapping, 'shares': shares, 'balances': balances.reset_index(drop=True), 'curr': curr}
+
+
+class InMemoryBalances:
+    """
+    Stand-in for the balance_all_consolidated queries the tick issues
+    """
+
+    def __init__(self, balances):
+        self.balances = balances.sort_values(['pm', 'timestamp']).reset_index(drop=True)
+
+    def at(self, curr, curr_hour):
+        ts = self.balances['timestamp']
+        return self.balances[(ts == curr) | (ts == curr_hour)].sort_values('timestamp').reset_index(drop=True)
+
+    def fallback_batch(self, pms, curr_timestamp, max_lookback_hours=2):
+        """
+        Same result as nav_test.FALLBACK_BATCH_QUERY
+        """
+        lookback_start = curr_timestamp - timedelta(hours=max_lookback_hours)
+        b = self.balances
+        window = b[b['pm'].isin(pms) & (b['timestamp'] >= lookback_start) & (b['timestamp'] <= curr_timestamp)
+                   & b['balance'].notna()]
+        return window.drop_duplicates(subset=['pm'], keep='last')[['timestamp', 'pm', 'balance']].reset_index(drop=True)
+
+
+def timed(fn, repeat):
+    """
+    Median wall time of `repeat` calls and the last result (pipeline prints are swallowed)
+    """
+    seconds, result = [], None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = fn()
+            seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds), result
+
+
+def run_case(data, repeat=5, range_minutes=60):
+    """
+    Time every stage of one tick plus a backfill over the last range_minutes
+
+    Returns:
+        tuple: (stage -> median seconds, row counts)
+    """
+    curr = data['curr']
+    curr_hour = curr.replace(minute=0)
+    mapping = pm_mapping.build_snapshot(data['mapping'])
+    rules = publish_rules.default_rules()
+    store = InMemoryBalances(data['balances'])
+    stages = {}
+
+    stages['balance_query_inmemory'], balance = timed(lambda: store.at(curr, curr_hour), repeat)
+    stages['freshness_filter'], fresh = timed(
+        lambda: nav_test.select_fresh_balances(balance, mapping.frame, curr, curr_hour), repeat)
+
+    with mock.patch.object(nav_test, 'get_fallback_balance_data_batch', store.fallback_batch):
+        stages['fallback'], (enhanced, validation_log) = timed(
+            lambda: nav_test.validate_and_enhance_balance_data(fresh, curr, curr_hour, mapping=mapping), repeat)
+    enhanced['tick'] = curr
+
+    stages['shares_index'], shares_history = timed(lambda: shares_cache.build_history(data['shares']), repeat)
+    stages['rollup_compile'], _ = timed(lambda: rollup.RollupEngine(mapping.frame), repeat)
+    rollup.get_engine(mapping)
+    stages['rollup'], bal_concat = timed(lambda: nav_test.aggregate_nodes(enhanced, mapping, rules), repeat)
+    stages['attach_shares'], pm_result_df = timed(
+        lambda: nav_test.attach_shares_and_nav(bal_concat, shares_history), repeat)
+    stages['copy_buffer'], _ = timed(
+        lambda: db_utils._copy_buffer(pm_result_df[nav_test.NAV_COLUMNS], nav_test.NAV_COLUMNS), repeat)
+    stages['tick_total'] = sum(stages.values())
+
+    ticks = pd.date_range(curr - timedelta(minutes=range_minutes - 1), curr, freq='min')
+
+    def backfill_range():
+        selected, _ = backfill.select_balances(data['balances'], mapping, ticks)
+        return nav_test.attach_shares_and_nav(nav_test.aggregate_nodes(selected, mapping, rules), shares_history)
+
+    stages[f'backfill_{range_minutes}min'], range_rows = timed(backfill_range, max(1, repeat // 2))
+
+    rows = {
+        'pms': len(data['mapping']),
+        'nodes': len(rollup.get_engine(mapping).nodes),
+        'balance_history': len(data['balances']),
+        'fallback_pms': len(validation_log['active_pms']['using_fallback_data']),
+        'nav_rows': len(pm_result_df),
+        'backfill_rows': len(range_rows),
+    }
+    return stages, rows
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+
+def load_results(path=BENCH_RESULTS_PATH):
+    try:
+        with open(path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def save_result(record, path=BENCH_RESULTS_PATH):
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+def compare(record, previous):
+    """
+    Print each stage next to the previous comparable run
+
+    Returns:
+        list of stages that regressed
+    """
+    regressed = []
+    prev_stages = previous['stages'] if previous else {}
+    print(f"{'stage':<24}{'seconds':>12}{'previous':>12}{'ratio':>8}")
+    for stage, seconds in record['stages'].items():
+        prev = prev_stages.get(stage)
+        line = f'{stage:<24}{seconds:>12.4f}'
+        if prev:
+            ratio = seconds / prev
+            line += f'{prev:>12.4f}{ratio:>8.2f}'
+            if ratio > REGRESSION_RATIO and seconds - prev > REGRESSION_MIN_SECONDS:
+                line += '  ⚠ regression'
+                regressed.append(stage)
+        print(line)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the NAV pipeline on synthetic data')
+    parser.add_argument('--pms', default='10,100,1000', help='comma separated PM counts')
+    parser.add_argument('--fanout', type=int, default=8, help='children per hierarchy node')
+    parser.add_argument('--history-hours', type=int, default=3)
+    parser.add_argument('--fallback-rate', type=float, default=0.05)
+    parser.add_argument('--hour-share', type=float, default=0.5)
+    parser.add_argument('--range-minutes', type=int, default=60, help='backfill range timed per case')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--results', default=BENCH_RESULTS_PATH)
+    parser.add_argument('--no-save', action='store_true', help='do not append to the results file')
+    args = parser.parse_args()
+
+    history = load_results(args.results)
+    any_regressed = False
+    for n_pms in [int(n) for n in args.pms.split(',')]:
+        params = {'pms': n_pms, 'fanout': args.fanout, 'history_hours': args.history_hours,
+                  'fallback_rate': args.fallback_rate, 'hour_share': args.hour_share,
+                  'range_minutes': args.range_minutes, 'seed': args.seed}
+        data = generate(n_pms, fanout=args.fanout, history_hours=args.history_hours,
+                        fallback_rate=args.fallback_rate, hour_share=args.hour_share, seed=args.seed)
+        stages, rows = run_case(data, repeat=args.repeat, range_minutes=args.range_minutes)
+        record = {'run_at': datetime.now(timezone.utc).isoformat(), 'commit': current_commit(),
+                  'params': params, 'rows': rows, 'stages': stages}
+
+        previous = next((r for r in reversed(history) if r['params'] == params), None)
+        print(f"\n=== {n_pms} PMs, {rows['nodes']} nodes, {rows['balance_history']} balance rows, "
+              f"{rows['fallback_pms']} fallback PMs (previous: {previous['commit'] or previous['run_at'] if previous else 'none'}) ===")
+        any_regressed |= bool(compare(record, previous))
+
+        if not args.no_save:
+            save_result(record, args.results)
+
+    if any_regressed:
+        print(f'\n⚠ some stages are more than {REGRESSION_RATIO}x slower than the previous run')
+
+
+if __name__ == '__main__':
+    main()
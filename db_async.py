@@ -0,0 +1,255 @@
+import asyncio
+import io
+import time
+import asyncpg
+import pandas as pd
+import db_constants
+import db_utils
+import metrics
+
+
+# asyncio counterpart of db_utils on an asyncpg connection pool, for running the NAV pipeline on
+# an event loop. Same call shapes as db_utils: named %(param)s placeholders, DataFrames back,
+# errors printed and returned as an empty frame / False.
+# Reads go through asyncpg's per-connection statement cache, so a query is prepared once per pooled
+# connection (like db_utils.get_prepared) and then costs one round trip. Rows are decoded by asyncpg
+# in C and turned into typed columns in one pass.
+
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = db_utils.POOL_SIZE
+# most statements in flight at once, whatever the number of tasks awaiting them
+MAX_CONCURRENT_QUERIES = db_utils.POOL_SIZE
+COMMAND_TIMEOUT_SECONDS = 30
+
+_pool = None
+_pool_lock = None
+_limit = None
+_attributes = {}  # positional query -> result attributes (column names and types)
+
+
+async def _init_connection(conn):
+    # numeric straight to float (as pd.read_sql does), not one Decimal per value
+    await conn.set_type_codec('numeric', encoder=str, decoder=float, schema='pg_catalog', format='text')
+
+
+async def get_pool():
+    """
+    Return the pool of the running event loop, creating it on first use
+    """
+    global _pool, _pool_lock, _limit
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                init=_init_connection,
+                user=db_constants.DB_USER,
+                password=db_constants.DB_PASSWORD,
+                host=db_constants.DB_HOST,
+                port=int(db_constants.DB_PORT),
+                database=db_constants.DB_NAME,
+                ssl=getattr(db_constants, 'DB_SSLMODE', 'require'),
+                min_size=POOL_MIN_SIZE,
+                max_size=POOL_MAX_SIZE,
+                command_timeout=COMMAND_TIMEOUT_SECONDS,
+                server_settings={'timezone': 'UTC'},
+            )
+            _limit = asyncio.Semaphore(MAX_CONCURRENT_QUERIES)
+    return _pool
+
+
+async def close_pool():
+    """
+    Close every pooled connection - call before the event loop ends
+    """
+    global _pool, _pool_lock, _limit
+    if _pool is not None:
+        await _pool.close()
+    _pool, _pool_lock, _limit = None, None, None
+
+
+def to_positional(query, params=None):
+    """
+    Rewrite named %(param)s placeholders as $n
+
+    Returns:
+        tuple: (query, argument list in $n order)
+    """
+    params = params or {}
+    names = list(dict.fromkeys(db_utils._PARAM_PATTERN.findall(query)))
+    query = db_utils._PARAM_PATTERN.sub(lambda m: f'${names.index(m.group(1)) + 1}', query)
+    return query.strip().rstrip(';'), [params[name] for name in names]
+
+
+def _quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+_FLOAT_TYPES = {'float4', 'float8', 'numeric'}
+
+
+def _frame_from_records(records, attributes):
+    """
+    DataFrame out of a prepared statement's records, typed from its result attributes
+    """
+    columns = [a.name for a in attributes]
+    df = pd.DataFrame.from_records(records, columns=columns) if records else \
+        pd.DataFrame({c: pd.Series(dtype=object) for c in columns})
+    for a in attributes:
+        col, kind = a.name, a.type.name
+        if kind == 'timestamptz':
+            df[col] = pd.to_datetime(df[col], utc=True)
+        elif kind == 'timestamp':
+            df[col] = pd.to_datetime(df[col])
+        elif kind == 'bool' and df[col].notna().all():
+            df[col] = df[col].astype(bool)
+        elif kind in _FLOAT_TYPES:
+            df[col] = df[col].astype('float64')
+    return df
+
+
+async def get_db_table(query, params=None):
+    """
+    Async db_utils.get_db_table: run a SELECT and return it as a DataFrame
+    """
+    start = time.perf_counter()
+    rows = 0
+    positional, args = to_positional(query, params)
+    try:
+        pool = await get_pool()
+        async with _limit, pool.acquire() as conn:
+            attributes = _attributes.get(positional)
+            if attributes is None:
+                # once per query - the column names and types are needed even when no row comes back
+                attributes = _attributes[positional] = (await conn.prepare(positional)).get_attributes()
+            try:
+                records = await conn.fetch(positional, *args)
+            except Exception:
+                # e.g. the table changed under the statement - describe it again next time
+                _attributes.pop(positional, None)
+                raise
+        df = _frame_from_records(records, attributes)
+        rows = len(df)
+        return df
+    except Exception as e:
+        print(f'Error encountered getting sql table with this query {query}: ', e)
+        return pd.DataFrame()
+    finally:
+        metrics.record('get_db_table_async', time.perf_counter() - start, rows=rows)
+
+
+async def execute_query(query, params=None):
+    """
+    Async db_utils.execute_query
+
+    Returns:
+        bool: True if committed
+    """
+    start = time.perf_counter()
+    try:
+        pool = await get_pool()
+        positional, args = to_positional(query, params)
+        async with _limit, pool.acquire() as conn:
+            if args:
+                await conn.execute(positional, *args)
+            else:
+                # simple query protocol, allows several statements in one call
+                await conn.execute(query)
+        return True
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return False
+    finally:
+        metrics.record('execute_query_async', time.perf_counter() - start)
+
+
+async def df_copy_to_table(table_name, df, columns=None, delete_query=None, delete_params=None):
+    """
+    Async db_utils.df_copy_to_table: optional delete, then COPY df in, in one transaction
+
+    Returns:
+        bool: True if committed
+    """
+    if df.empty and delete_query is None:
+        return True
+    columns = list(columns if columns is not None else df.columns)
+    start = time.perf_counter()
+    nbytes = 0
+    try:
+        pool = await get_pool()
+        async with _limit, pool.acquire() as conn, conn.transaction():
+            if delete_query is not None:
+                positional, args = to_positional(delete_query, delete_params)
+                await conn.execute(positional, *args)
+            if not df.empty:
+                data = db_utils._copy_buffer(df, columns).getvalue().encode()
+                nbytes = len(data)
+                await conn.copy_to_table(table_name, source=io.BytesIO(data), columns=columns, format='csv')
+        return True
+    except Exception as e:
+        print(f'Error encountered when copying into {table_name}', e)
+        return False
+    finally:
+        metrics.record('df_copy_to_table_async', time.perf_counter() - start, rows=len(df), bytes=nbytes)
+
+
+async def upsert_df(table_name, df, key_columns, columns=None, update=True, update_flag=None):
+    """
+    Async db_utils.upsert_df: COPY into a temp stage table, then one INSERT ... ON CONFLICT (key_columns)
+
+    Returns:
+        bool: True if committed
+    """
+    if df.empty:
+        return True
+    columns = list(columns if columns is not None else df.columns)
+    # ON CONFLICT cannot touch the same row twice in one statement - last row per key wins
+    df = df.drop_duplicates(subset=key_columns, keep='last')
+
+    stage = f'{table_name}_stage'
+    column_list = ', '.join(map(_quote_ident, columns))
+    if update:
+        action = 'DO UPDATE SET ' + ', '.join(
+            f'{_quote_ident(col)} = EXCLUDED.{_quote_ident(col)}' for col in columns if col not in key_columns)
+        if update_flag:
+            flag = _quote_ident(update_flag)
+            action += f' WHERE {_quote_ident(table_name)}.{flag} AND NOT EXCLUDED.{flag}'
+    else:
+        action = 'DO NOTHING'
+
+    start = time.perf_counter()
+    nbytes = 0
+    try:
+        pool = await get_pool()
+        data = db_utils._copy_buffer(df, columns).getvalue().encode()
+        nbytes = len(data)
+        async with _limit, pool.acquire() as conn, conn.transaction():
+            # the stage table lives as long as the pooled connection and is emptied on every commit
+            await conn.execute(f'CREATE TEMP TABLE IF NOT EXISTS {_quote_ident(stage)} '
+                               f'(LIKE {_quote_ident(table_name)} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS')
+            await conn.copy_to_table(stage, source=io.BytesIO(data), columns=columns, format='csv')
+            await conn.execute(f'INSERT INTO {_quote_ident(table_name)} ({column_list}) '
+                               f'SELECT {column_list} FROM {_quote_ident(stage)} '
+                               f'ON CONFLICT ({", ".join(map(_quote_ident, key_columns))}) {action}')
+        return True
+    except Exception as e:
+        print(f'Error encountered when upserting into {table_name}', e)
+        return False
+    finally:
+        metrics.record('upsert_df_async', time.perf_counter() - start, rows=len(df), bytes=nbytes)
+
+
+async def gather_bounded(awaitables, limit):
+    """
+    asyncio.gather with at most `limit` of the awaitables running at once
+
+    Returns:
+        list of results in the order given (exceptions are returned, not raised)
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(bounded(aw) for aw in awaitables), return_exceptions=True)
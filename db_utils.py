@@ -1,81 +1,404 @@
 # import schedule
+import io
+import os
+import re
+import threading
 import time
 import pandas as pd
 import psycopg2
+import psycopg2.errors
+import psycopg2.extras
 from psycopg2 import sql
 from sqlalchemy import create_engine
 import db_constants
 import alert
+import metrics
 
 connection_string = f'postgresql+psycopg2://{db_constants.DB_USER}:{db_constants.DB_PASSWORD}@{db_constants.DB_HOST}:{db_constants.DB_PORT}/{db_constants.DB_NAME}'
-# engine = create_engine(connection_string)
 
-def execute_query(query):
-    conn = psycopg2.connect(dbname=db_constants.DB_NAME, user=db_constants.DB_USER, password=db_constants.DB_PASSWORD, host=db_constants.DB_HOST, port='5432', sslmode='require')
+# Pool settings for the process-wide engine
+POOL_SIZE = 5
+POOL_MAX_OVERFLOW = 5
+POOL_RECYCLE_SECONDS = 30 * 60  # recycle before the server / load balancer drops idle connections
+POOL_TIMEOUT_SECONDS = 30
+
+_engine = None
+_engine_lock = threading.Lock()  # tick inputs are fetched from several threads at once
+
+
+def get_engine():
+    """
+    Return the process-wide pooled engine, creating it on first use.
+    Every helper in this module borrows connections from it so a tick only pays
+    for the TCP+TLS handshake once per pooled connection instead of once per query.
+    """
+    global _engine
+    engine = _engine
+    if engine is not None:
+        return engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine(
+                connection_string,
+                pool_size=POOL_SIZE,
+                max_overflow=POOL_MAX_OVERFLOW,
+                pool_recycle=POOL_RECYCLE_SECONDS,
+                pool_timeout=POOL_TIMEOUT_SECONDS,
+                pool_pre_ping=True,
+                connect_args={'sslmode': getattr(db_constants, 'DB_SSLMODE', 'require')},
+            )
+        return _engine
+
+
+def dispose_engine():
+    """
+    Close every pooled connection, e.g. on shutdown or after a fork
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+
+
+def execute_query(query, params=None):
+    conn = get_engine().raw_connection()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor)
     print(cursor)
     print(query)
 
     try:
         # Execute the SQL query
-        cursor.execute(query)
-        conn.commit()
+        with metrics.db_call('execute_query') as m:
+            cursor.execute(query, params)
+            conn.commit()
+            m['rows'] = max(cursor.rowcount, 0)
         cursor.close()
-        conn.close()
     except psycopg2.DatabaseError as e:
         # Rollback the transaction in case of an error
         # alert.send_notif(message='【DB Error】\nIn Fund Balance Data >> update_db >> execute_query\n'+str(e), chat_id='-4675914050') # api error group
         conn.rollback()
         print(f"An error occurred: {e}")
+    finally:
+        # hands the connection back to the pool
+        conn.close()
 
 
 def update_balance_data(df, source):
-    engine = create_engine(connection_string)
     delete_query = f'DELETE FROM fund_balance_data WHERE source in ({source});'
-    execute_query(delete_query)
 
-    try:
-        df.to_sql('fund_balance_data', engine, if_exists='append', index=False)
+    # delete + COPY on one pooled connection in one transaction
+    if df_copy_to_table('fund_balance_data', df, delete_query=delete_query):
         print(f"Updated balances for {source}")
+    else:
+        # alert.send_notif(message='【DB Error】\nIn Fund Balance Data >> update_db >> update_balance_data', chat_id='-4675914050') # api error group
+        print(f'Error encountered when updating fund_balance_data for {source}')
+
+
+def _copy_buffer(df, columns):
+    """
+    Serialize df as CSV for COPY: fixed column order, ISO timestamps with offset,
+    NULL for missing values, booleans as true/false and floats at full precision
+    """
+    out = df[columns].copy()
+    for col in columns:
+        if pd.api.types.is_bool_dtype(out[col]):
+            out[col] = out[col].map({True: 'true', False: 'false'})
+        elif isinstance(out[col].dtype, pd.DatetimeTZDtype) or pd.api.types.is_datetime64_any_dtype(out[col]):
+            out[col] = out[col].dt.strftime('%Y-%m-%d %H:%M:%S.%f%z')
+
+    buf = io.StringIO()
+    out.to_csv(buf, index=False, header=False, na_rep='')
+    buf.seek(0)
+    return buf
+
+
+def df_copy_to_table(table_name, df, columns=None, delete_query=None, delete_params=None):
+    """
+    Bulk append df to an existing table with COPY ... FROM STDIN on a pooled connection
+
+    Args:
+        columns: column order to write (defaults to df.columns)
+        delete_query: optional statement run first in the same transaction (replace semantics)
+
+    Returns:
+        bool: True if committed
+    """
+    if df.empty and delete_query is None:
+        return True
+    columns = list(columns if columns is not None else df.columns)
+    copy_stmt = sql.SQL('COPY {} ({}) FROM STDIN WITH (FORMAT csv)').format(
+        sql.Identifier(table_name), sql.SQL(', ').join(map(sql.Identifier, columns))
+    )
+
+    conn = get_engine().raw_connection()
+    try:
+        with metrics.db_call('df_copy_to_table') as m:
+            cursor = conn.cursor()
+            if delete_query is not None:
+                cursor.execute(delete_query, delete_params)
+            if not df.empty:
+                buf = _copy_buffer(df, columns)
+                m['rows'], m['bytes'] = len(df), len(buf.getvalue())
+                cursor.copy_expert(copy_stmt.as_string(cursor), buf)
+            conn.commit()
+        cursor.close()
+        return True
     except Exception as e:
-        # alert.send_notif(message='【DB Error】\nIn Fund Balance Data >> update_db >> update_balance_data\n'+str(e), chat_id='-4675914050') # api error group
-        print(f'Error encountered when updating fund_balance_data for {source}', e)
-    
-    engine.dispose()
+        conn.rollback()
+        print(f'Error encountered when copying into {table_name}', e)
+        return False
+    finally:
+        conn.close()
+
 
-def get_db_table(query):
-    engine = create_engine(connection_string)
+def get_db_table(query, params=None, raise_errors=False):
+    """
+    Errors come back as an empty frame after printing them, or are re-raised with raise_errors
+    """
     try:
-        df = pd.read_sql(query, engine)
-        engine.dispose()
+        with metrics.db_call('get_db_table') as m:
+            df = pd.read_sql(query, get_engine(), params=params)
+            m['rows'], m['bytes'] = len(df), metrics.frame_bytes(df)
         return df
     except Exception as e:
         # alert.send_notif(message='【DB Error】\nIn Fund Balance Data >> update_db >> get_db_table\n'+str(e), chat_id='-4675914050') # api error group
         print(f'Error encountered getting sql table with this query {query}: ', e)
-        engine.dispose()
+        if raise_errors:
+            raise
         return pd.DataFrame()
-    
+
+
+def iter_db_table(query, params=None, chunksize=50000, raise_errors=False):
+    """
+    Stream a large result set in chunks through a server-side cursor
+
+    Errors end the stream early after printing them, or are re-raised with raise_errors
+    (for callers that must tell a failed read from a short one).
+    """
+    # time spent inside the generator only, recorded once the stream ends
+    parent, seconds, rows, nbytes = metrics.current_stage(), 0.0, 0, 0
+    start = time.perf_counter()
+    try:
+        with get_engine().connect().execution_options(stream_results=True) as conn:
+            for chunk in pd.read_sql(query, conn, params=params, chunksize=chunksize):
+                seconds += time.perf_counter() - start
+                rows, nbytes = rows + len(chunk), nbytes + metrics.frame_bytes(chunk)
+                yield chunk
+                start = time.perf_counter()
+    except Exception as e:
+        print(f'Error encountered streaming sql table with this query {query}: ', e)
+        if raise_errors:
+            raise
+    finally:
+        seconds += time.perf_counter() - start
+        metrics.record('iter_db_table', seconds, parent=parent, rows=rows, bytes=nbytes)
+
+
+# Server-side prepared statements for the fixed set of queries every tick runs.
+# Each statement is PREPAREd once per pooled connection (tracked in the connection's .info,
+# which SQLAlchemy clears whenever the DBAPI connection is closed or recycled) and EXECUTEd
+# with typed parameters afterwards, so Postgres plans it once instead of 1,440 times a day.
+# Set NAV_PREPARED_STATEMENTS=0 when connecting through a transaction-pooling pgbouncer.
+USE_PREPARED_STATEMENTS = os.environ.get('NAV_PREPARED_STATEMENTS', '1') != '0'
+
+_PARAM_PATTERN = re.compile(r'%\((\w+)\)s')
+_TIMESTAMP_OIDS = {1114: False, 1184: True}  # timestamp, timestamptz -> utc
+_statements = {}  # name -> (query, PREPARE text, parameter names in $n order)
+
+
+def register_statement(name, query, param_types=None):
+    """
+    Declare query as a prepared statement
+
+    Args:
+        name: statement name, unique per process
+        query: SQL with named %(param)s placeholders, same as get_db_table
+        param_types: {param: postgres type}, e.g. {'curr': 'timestamptz', 'pms': 'text[]'} -
+            every placeholder needs one so timestamps and arrays are bound with their real types
+    """
+    param_types = param_types or {}
+    names = list(dict.fromkeys(_PARAM_PATTERN.findall(query)))
+    missing = [p for p in names if p not in param_types]
+    if missing:
+        raise ValueError(f'No type given for parameter(s) {missing} of prepared statement {name}')
+    body = _PARAM_PATTERN.sub(lambda m: f'${names.index(m.group(1)) + 1}', query).strip().rstrip(';')
+    types = f" ({', '.join(param_types[p] for p in names)})" if names else ''
+    _statements[name] = (query, f'PREPARE {name}{types} AS {body}', names)
+
+
+def _frame_from_cursor(cursor):
+    columns = [col.name for col in cursor.description]
+    # coerce_float like pd.read_sql, so numeric columns come back as floats rather than Decimals
+    df = pd.DataFrame.from_records(cursor.fetchall(), columns=columns, coerce_float=True)
+    for col in cursor.description:
+        if col.type_code in _TIMESTAMP_OIDS:
+            df[col.name] = pd.to_datetime(df[col.name], utc=_TIMESTAMP_OIDS[col.type_code])
+    return df
+
+
+def get_prepared(name, params=None):
+    """
+    get_db_table() for a statement declared with register_statement()
+
+    Returns:
+        DataFrame - empty on error, same contract as get_db_table
+    """
+    query, prepare_stmt, names = _statements[name]
+    if not USE_PREPARED_STATEMENTS:
+        return get_db_table(query, params=params)
+    params = params or {}
+
+    conn = get_engine().raw_connection()
+    try:
+        with metrics.db_call('get_prepared') as m:
+            m['statement'] = name
+            cursor = conn.cursor()
+            prepared = conn.info.setdefault('prepared_statements', set())
+            if name not in prepared:
+                try:
+                    cursor.execute(prepare_stmt)
+                except psycopg2.errors.DuplicatePreparedStatement:
+                    # prepared on this session by an earlier connection checkout we lost track of
+                    conn.rollback()
+                prepared.add(name)
+            if names:
+                cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(names))})", [params[p] for p in names])
+            else:
+                cursor.execute(f'EXECUTE {name}')
+            df = _frame_from_cursor(cursor)
+            conn.commit()
+            m['rows'], m['bytes'] = len(df), metrics.frame_bytes(df)
+        cursor.close()
+        return df
+    except Exception as e:
+        conn.rollback()
+        print(f'Error encountered executing prepared statement {name}: ', e)
+        return pd.DataFrame()
+    finally:
+        conn.close()
+
+
+def upsert_df(table_name, df, key_columns, columns=None, update=True, update_flag=None):
+    """
+    Idempotent write: stage df in a temp table with COPY, then merge it into table_name with
+    one INSERT ... ON CONFLICT (key_columns) statement. Needs a unique index on key_columns
+    (see migrations.py).
+
+    Args:
+        update: True  -> DO UPDATE (re-runs overwrite the stored row)
+                False -> DO NOTHING (only fill rows that are not there yet)
+        update_flag: boolean column - with update, only stored rows that have it set are
+                     overwritten, and only by rows that do not (e.g. real data replacing a fallback row)
+
+    Returns:
+        bool: True if committed
+    """
+    if df.empty:
+        return True
+    columns = list(columns if columns is not None else df.columns)
+    # ON CONFLICT cannot touch the same row twice in one statement - last row per key wins
+    df = df.drop_duplicates(subset=key_columns, keep='last')
+
+    stage = sql.Identifier(f'{table_name}_stage')
+    column_list = sql.SQL(', ').join(map(sql.Identifier, columns))
+    if update:
+        assignments = sql.SQL(', ').join(
+            sql.SQL('{0} = EXCLUDED.{0}').format(sql.Identifier(col)) for col in columns if col not in key_columns
+        )
+        on_conflict = sql.SQL('DO UPDATE SET {}').format(assignments)
+        if update_flag:
+            on_conflict += sql.SQL(' WHERE {table}.{flag} AND NOT EXCLUDED.{flag}').format(
+                table=sql.Identifier(table_name), flag=sql.Identifier(update_flag))
+    else:
+        on_conflict = sql.SQL('DO NOTHING')
+
+    create_stmt = sql.SQL('CREATE TEMP TABLE IF NOT EXISTS {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS').format(
+        stage, sql.Identifier(table_name)
+    )
+    copy_stmt = sql.SQL('COPY {} ({}) FROM STDIN WITH (FORMAT csv)').format(stage, column_list)
+    merge_stmt = sql.SQL('INSERT INTO {table} ({cols}) SELECT {cols} FROM {stage} ON CONFLICT ({keys}) {action}').format(
+        table=sql.Identifier(table_name), cols=column_list, stage=stage,
+        keys=sql.SQL(', ').join(map(sql.Identifier, key_columns)), action=on_conflict
+    )
+
+    conn = get_engine().raw_connection()
+    try:
+        with metrics.db_call('upsert_df') as m:
+            cursor = conn.cursor()
+            # the stage table lives as long as the pooled connection and is emptied on every commit
+            cursor.execute(create_stmt)
+            buf = _copy_buffer(df, columns)
+            m['rows'], m['bytes'] = len(df), len(buf.getvalue())
+            cursor.copy_expert(copy_stmt.as_string(cursor), buf)
+            cursor.execute(merge_stmt)
+            conn.commit()
+        cursor.close()
+        return True
+    except Exception as e:
+        conn.rollback()
+        print(f'Error encountered when upserting into {table_name}', e)
+        return False
+    finally:
+        conn.close()
+
+
+LATEST_BALANCE_QUERY = 'SELECT pm, timestamp, balance FROM latest_balance;'
+
+# full resync from balance_all_consolidated, e.g. after deletes or if the triggers were off
+LATEST_BALANCE_REFRESH = '''
+    DELETE FROM latest_balance lb
+    WHERE NOT EXISTS (SELECT 1 FROM balance_all_consolidated b WHERE b.pm = lb.pm);
+    INSERT INTO latest_balance (pm, timestamp, balance)
+    SELECT DISTINCT ON (pm) pm, timestamp, balance
+    FROM balance_all_consolidated
+    ORDER BY pm, timestamp DESC
+    ON CONFLICT (pm) DO UPDATE
+        SET timestamp = EXCLUDED.timestamp, balance = EXCLUDED.balance;
+'''
+
+register_statement('latest_balance', LATEST_BALANCE_QUERY)
+
+
+def get_latest_balances():
+    """
+    Latest balance row per pm from the trigger maintained latest_balance table (see migrations.py)
+
+    Returns:
+        DataFrame with pm, timestamp, balance - empty if the table is missing or empty
+    """
+    latest = get_prepared('latest_balance')
+    if not latest.empty:
+        latest['timestamp'] = pd.to_datetime(latest['timestamp'], utc=True)
+    return latest
+
+
+def refresh_latest_balance():
+    """
+    Rebuild latest_balance from the full history in one transaction
+    """
+    execute_query(LATEST_BALANCE_REFRESH)
+
 
 def df_to_table(table_name, df):
-    engine = create_engine(connection_string)
     if df.empty:
         return
     try:
-        df.to_sql(table_name, engine, if_exists='append', index=False)
+        with metrics.db_call('df_to_table') as m:
+            m['rows'] = len(df)
+            df.to_sql(table_name, get_engine(), if_exists='append', index=False)
     except Exception as e:
         # alert.send_notif(message='【DB Error】\nIn Fund Balance Data >> update_db >> df_to_table\n'+str(e), chat_id='-4675914050') # api error group
         print(f'Error encountered when updating {table_name}', e)
-    
-    engine.dispose()
+
 
 def df_replace_table(table_name, df):
-    engine = create_engine(connection_string)
     if df.empty:
         return
     try:
-        df.to_sql(table_name, engine, if_exists='replace', index=False)
+        with metrics.db_call('df_replace_table') as m:
+            m['rows'] = len(df)
+            df.to_sql(table_name, get_engine(), if_exists='replace', index=False)
     except Exception as e:
         # alert.send_notif(message='【DB Error】\n'+str(e), chat_id='-4675914050') # api error group
         print(f'Error encountered when updating {table_name}', e)
-    
-    engine.dispose()
\ No newline at end of file
@@ -1,13 +1,26 @@
+import sys
 import nav_calc
 import nav_test
 from datetime import datetime, timezone
 import time
 
+if '--daemon' in sys.argv:
+    # resident mode: wake on every minute boundary instead of being started by cron
+    import nav_daemon
+    nav_daemon.run()
+    sys.exit(0)
+
 start = time.time()
 print("starting at：", datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S %Z"))
 # nav_calc.main()
 
-nav_test.main()
+# --sql-rollup: let the database do the freshness filter and node sums (compare with the default pandas path)
+# --sharded: split the mapping by fund and compute the funds concurrently
+if '--sharded' in sys.argv:
+    import nav_shards
+    nav_shards.main()
+else:
+    nav_test.main(rollup_mode='sql' if '--sql-rollup' in sys.argv else None)
 end = time.time()
 
 print('time taken: ', end-start)
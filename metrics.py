@@ -0,0 +1,247 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Lightweight per-stage timing for the NAV tick.
+# - span(name): times one stage (nested spans record their parent stage)
+# - tick(name, curr): collects every span of one run and appends it to METRICS_PATH as one JSON line.
+#   The tick in progress is held in a context variable: spans on other threads only belong to it if
+#   the thread runs in its context (bind()), a background thread's spans belong to no tick.
+# - running totals per stage / db call, served in Prometheus text format by serve() in daemon mode
+
+# one JSON line per tick, set NAV_METRICS_PATH='' to disable
+METRICS_PATH = os.environ.get('NAV_METRICS_PATH', 'nav_metrics.jsonl')
+METRICS_PORT = int(os.environ.get('NAV_METRICS_PORT', '0'))  # 0 = no endpoint
+
+_lock = threading.Lock()
+_local = threading.local()
+# [record of the tick in progress], emptied when the tick ends so late spans of its threads are dropped
+_current = contextvars.ContextVar('nav_metrics_tick', default=None)
+_totals = {}  # (kind, name, parent stage) -> {'calls', 'seconds', 'last_seconds', 'rows', 'bytes'}
+_ticks = {}  # (name, ok) -> count
+_last_tick = {}  # name -> seconds
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def current_stage():
+    stack = _stack()
+    return stack[-1] if stack else None
+
+
+def _record(kind, name, seconds, fields):
+    entry = {'kind': kind, 'name': name, 'parent': fields.pop('parent', None), 'seconds': round(seconds, 6)}
+    entry.update(fields)
+    holder = _current.get()
+    with _lock:
+        if holder:
+            holder[0]['spans'].append(entry)
+        totals = _totals.setdefault((kind, name, entry['parent']),
+                                    {'calls': 0, 'seconds': 0.0, 'last_seconds': 0.0, 'rows': 0, 'bytes': 0})
+        totals['calls'] += 1
+        totals['seconds'] += seconds
+        totals['last_seconds'] = seconds
+        totals['rows'] += int(fields.get('rows') or 0)
+        totals['bytes'] += int(fields.get('bytes') or 0)
+
+
+@contextmanager
+def span(name, kind='stage', parent=None):
+    """
+    Time the enclosed block as stage `name`
+
+    Yields a dict - set 'rows' / 'bytes' (or any other JSON-able field) on it to record them with the span.
+    parent overrides the enclosing stage, for spans run on another thread on behalf of it.
+    """
+    fields = {'parent': parent if parent is not None else current_stage()}
+    stack = _stack()
+    stack.append(name)
+    start = time.perf_counter()
+    try:
+        yield fields
+    except Exception as e:
+        fields['error'] = type(e).__name__
+        raise
+    finally:
+        stack.pop()
+        _record(kind, name, time.perf_counter() - start, fields)
+
+
+def record(name, seconds, kind='db', parent=None, **fields):
+    """
+    Record an already measured span, for code that cannot wrap itself in span() (e.g. generators)
+    """
+    _record(kind, name, seconds, dict(fields, parent=parent))
+
+
+def bind(fn):
+    """
+    fn to be run on another thread on behalf of the current tick - its spans are recorded with it.
+    Bind once per submitted call, a context cannot run on two threads at once.
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def db_call(op):
+    """
+    span() for a db_utils call, attributed to the stage it runs in
+    """
+    return span(op, kind='db')
+
+
+def frame_bytes(df):
+    """
+    In-memory size of a fetched DataFrame, used as bytes fetched
+    """
+    try:
+        return int(df.memory_usage(index=False, deep=True).sum())
+    except Exception:
+        return 0
+
+
+@contextmanager
+def tick(name, curr=None):
+    """
+    Collect every span recorded while the block runs and write them out as one JSON line.
+    A tick opened inside another tick is just a span of the outer one.
+
+    Yields a dict - set 'ok' on it to record whether the run succeeded, other keys are written as is.
+    """
+    if _current.get():
+        with span(name) as fields:
+            yield fields
+        return
+
+    holder = [{'tick': name, 'curr': curr.isoformat() if curr is not None else None,
+               'started_at': datetime.now(timezone.utc).isoformat(), 'spans': []}]
+    token = _current.set(holder)
+    fields = {}
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        seconds = time.perf_counter() - start
+        _current.reset(token)
+        with _lock:
+            record = holder.pop()
+            ok = bool(fields.get('ok', False))
+            _ticks[(name, ok)] = _ticks.get((name, ok), 0) + 1
+            _last_tick[name] = seconds
+        record.update((k, v) for k, v in fields.items() if k != 'ok')
+        record['seconds'] = round(seconds, 6)
+        record['ok'] = ok
+        _write_line(record)
+
+
+def _write_line(record):
+    if not METRICS_PATH:
+        return
+    try:
+        with open(METRICS_PATH, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+    except Exception as e:
+        print(f'Error writing metrics to {METRICS_PATH}: {e}')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items() if v is not None) + '}'
+
+
+def render_prometheus():
+    """
+    Running totals in the Prometheus text exposition format
+    """
+    with _lock:
+        totals = {k: dict(v) for k, v in _totals.items()}
+        ticks = dict(_ticks)
+        last_tick = dict(_last_tick)
+
+    lines = []
+
+    def family(metric, kind, help_text, samples):
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        lines.extend(f'{metric}{labels} {value}' for labels, value in samples)
+
+    def by_kind(kind):
+        return sorted(((k, v) for k, v in totals.items() if k[0] == kind), key=lambda kv: (kv[0][1], kv[0][2] or ''))
+
+    stages, db = by_kind('stage'), by_kind('db')
+
+    family('nav_ticks_total', 'counter', 'NAV runs by outcome',
+           [(_labels(tick=name, ok=str(ok).lower()), n) for (name, ok), n in sorted(ticks.items())])
+    family('nav_tick_last_seconds', 'gauge', 'Duration of the last NAV run',
+           [(_labels(tick=name), f'{s:.6f}') for name, s in sorted(last_tick.items())])
+    family('nav_stage_seconds_total', 'counter', 'Time spent per pipeline stage',
+           [(_labels(stage=name, parent=parent), f"{v['seconds']:.6f}") for (_, name, parent), v in stages])
+    family('nav_stage_calls_total', 'counter', 'Pipeline stage executions',
+           [(_labels(stage=name, parent=parent), v['calls']) for (_, name, parent), v in stages])
+    family('nav_stage_last_seconds', 'gauge', 'Duration of the last execution of a stage',
+           [(_labels(stage=name, parent=parent), f"{v['last_seconds']:.6f}") for (_, name, parent), v in stages])
+    family('nav_db_seconds_total', 'counter', 'Time spent in db_utils calls',
+           [(_labels(op=name, stage=stage), f"{v['seconds']:.6f}") for (_, name, stage), v in db])
+    family('nav_db_calls_total', 'counter', 'db_utils calls',
+           [(_labels(op=name, stage=stage), v['calls']) for (_, name, stage), v in db])
+    family('nav_db_rows_total', 'counter', 'Rows fetched or written by db_utils calls',
+           [(_labels(op=name, stage=stage), v['rows']) for (_, name, stage), v in db])
+    family('nav_db_bytes_total', 'counter', 'Bytes fetched or written by db_utils calls',
+           [(_labels(op=name, stage=stage), v['bytes']) for (_, name, stage), v in db])
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=METRICS_PORT, host='0.0.0.0'):
+    """
+    Serve /metrics on a background thread (daemon mode only)
+
+    Returns:
+        the server, or None if port is 0
+    """
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    print(f'metrics endpoint on http://{host}:{server.server_address[1]}/metrics')
+    return server
+
+
+def reset():
+    """
+    Drop running totals (tests)
+    """
+    with _lock:
+        _totals.clear()
+        _ticks.clear()
+        _last_tick.clear()
+    _current.set(None)
@@ -0,0 +1,114 @@
+import db_utils
+import publish_rules
+
+
+# One-off schema changes needed by the NAV pipeline. Every step is idempotent,
+# run `python migrations.py` once per database before deploying the code that needs it.
+
+NAV_TABLE_DEDUPE = '''
+    DELETE FROM nav_table a
+    USING nav_table b
+    WHERE a.timestamp = b.timestamp
+        AND a.pm = b.pm
+        AND a.ctid < b.ctid;
+'''
+
+NAV_TABLE_UNIQUE_INDEX = '''
+    CREATE UNIQUE INDEX IF NOT EXISTS nav_table_timestamp_pm_key
+    ON nav_table (timestamp, pm);
+'''
+
+
+def ensure_nav_table_unique_index():
+    """
+    Unique (timestamp, pm) index on nav_table - required by the upsert write mode.
+    Existing duplicates are removed first, keeping the most recently written row.
+    Takes a write lock on nav_table while the index builds.
+    """
+    db_utils.execute_query(NAV_TABLE_DEDUPE)
+    db_utils.execute_query(NAV_TABLE_UNIQUE_INDEX)
+
+
+PUBLISH_RULES_TABLE = '''
+    CREATE TABLE IF NOT EXISTS publish_rules (
+        node text PRIMARY KEY,
+        cadence text NOT NULL DEFAULT 'minute' CHECK (cadence IN ('minute', 'hour')),
+        enabled boolean NOT NULL DEFAULT true
+    );
+'''
+
+PUBLISH_RULES_SEED = '''
+    INSERT INTO publish_rules (node, cadence, enabled)
+    SELECT * FROM unnest(%(nodes)s::text[], %(cadences)s::text[], %(enabled)s::boolean[])
+    ON CONFLICT (node) DO NOTHING;
+'''
+
+
+def ensure_publish_rules_table():
+    """
+    publish_rules table, seeded with the rules that used to be hard-coded (existing rows are kept)
+    """
+    nodes, cadences, enabled = zip(*publish_rules.DEFAULT_PUBLISH_RULES)
+    db_utils.execute_query(PUBLISH_RULES_TABLE)
+    db_utils.execute_query(PUBLISH_RULES_SEED, {'nodes': list(nodes), 'cadences': list(cadences), 'enabled': list(enabled)})
+
+
+# latest row per pm, kept current by statement level triggers on balance_all_consolidated
+LATEST_BALANCE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS latest_balance (
+        pm text PRIMARY KEY,
+        timestamp timestamptz NOT NULL,
+        balance double precision
+    );
+'''
+
+LATEST_BALANCE_TRIGGER_FUNCTION = '''
+    CREATE OR REPLACE FUNCTION latest_balance_upsert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO latest_balance (pm, timestamp, balance)
+        SELECT DISTINCT ON (pm) pm, timestamp, balance
+        FROM new_rows
+        ORDER BY pm, timestamp DESC
+        ON CONFLICT (pm) DO UPDATE
+            SET timestamp = EXCLUDED.timestamp, balance = EXCLUDED.balance
+            WHERE latest_balance.timestamp <= EXCLUDED.timestamp;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+'''
+
+# transition tables allow a single event per trigger - one for INSERT, one for UPDATE
+LATEST_BALANCE_TRIGGERS = '''
+    DROP TRIGGER IF EXISTS latest_balance_on_insert ON balance_all_consolidated;
+    CREATE TRIGGER latest_balance_on_insert
+        AFTER INSERT ON balance_all_consolidated
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION latest_balance_upsert();
+    DROP TRIGGER IF EXISTS latest_balance_on_update ON balance_all_consolidated;
+    CREATE TRIGGER latest_balance_on_update
+        AFTER UPDATE ON balance_all_consolidated
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION latest_balance_upsert();
+'''
+
+
+def ensure_latest_balance_table():
+    """
+    latest_balance table + triggers, filled once from the full history.
+    Deletes on balance_all_consolidated are not tracked - db_utils.refresh_latest_balance() resyncs.
+    """
+    db_utils.execute_query(LATEST_BALANCE_TABLE)
+    db_utils.execute_query(LATEST_BALANCE_TRIGGER_FUNCTION)
+    db_utils.execute_query(LATEST_BALANCE_TRIGGERS)
+    db_utils.refresh_latest_balance()
+
+
+def main():
+    ensure_nav_table_unique_index()
+    ensure_publish_rules_table()
+    ensure_latest_balance_table()
+    print('migrations completed')
+
+
+if __name__ == '__main__':
+    main()
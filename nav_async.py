@@ -0,0 +1,217 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+import db_async
+import db_utils
+import metrics
+import nav_test
+import pm_mapping
+import publish_rules
+import shares_cache
+import storage
+
+
+# nav_test.process_minute on an asyncio event loop, reading and writing through db_async (asyncpg).
+# The tick's database reads are awaited together instead of parking a thread each, and several
+# minutes (a catch-up after downtime) run on one loop with bounded concurrency.
+# Only the I/O is async - freshness filter, fallback bookkeeping, rollup and shares are the same
+# nav_test functions the synchronous tick uses. Postgres only (the queries are storage.PostgresStore's).
+
+# minutes computed at once by run_ticks
+TICK_CONCURRENCY = int(os.environ.get('NAV_ASYNC_TICKS', '4'))
+INPUT_DEADLINE_SECONDS = nav_test.INPUT_DEADLINE_SECONDS
+
+
+async def _timed(name, awaitable, curr):
+    """
+    Await one stage and record it - span() keeps its stack per thread, which interleaved
+    coroutines on one loop would corrupt
+    """
+    start = time.perf_counter()
+    fields = {'tick': curr.isoformat()}
+    try:
+        result = await awaitable
+        if isinstance(result, pd.DataFrame):
+            fields['rows'] = len(result)
+        return result
+    except Exception as e:
+        fields['error'] = type(e).__name__
+        raise
+    finally:
+        metrics.record(name, time.perf_counter() - start, kind='stage', **fields)
+
+
+async def latest_balances():
+    return await db_async.get_db_table(db_utils.LATEST_BALANCE_QUERY)
+
+
+async def balances_at(curr, curr_hour, pms=None):
+    if pms is None:
+        return await db_async.get_db_table(storage.BALANCE_AT_QUERY, {'curr': curr, 'curr_hour': curr_hour})
+    params = {'curr': curr, 'curr_hour': curr_hour, 'pms': sorted(pms)}
+    return await db_async.get_db_table(storage.BALANCE_AT_PMS_QUERY, params)
+
+
+async def fallback_balances(pms, curr_timestamp, max_lookback_hours=2):
+    """
+    Async nav_test.get_fallback_balance_data_batch
+    """
+    if not pms:
+        return pd.DataFrame(columns=['timestamp', 'pm', 'balance'])
+    params = {'pms': sorted(pms), 'lookback_start': curr_timestamp - timedelta(hours=max_lookback_hours),
+              'curr_timestamp': curr_timestamp}
+    return await db_async.get_db_table(storage.FALLBACK_BATCH_QUERY, params)
+
+
+async def load_tick_balances(curr, curr_hour, grouping_df, latest):
+    """
+    Async nav_test.load_tick_balances for the latest_balance source
+    """
+    if latest.empty:
+        print('latest_balance empty or missing (run migrations.py) - scanning balance_all_consolidated')
+        return await balances_at(curr, curr_hour)
+    balance, lookup_pms = nav_test.split_latest_balances(latest, grouping_df, curr, curr_hour)
+    if lookup_pms:
+        exact = await balances_at(curr, curr_hour, pms=lookup_pms)
+        balance = pd.concat([balance, exact], ignore_index=True)
+    return balance.reset_index(drop=True)
+
+
+class _AsyncNavStore:
+    """
+    The nav_table writes of storage.PostgresStore on db_async
+    """
+
+    async def upsert_nav(self, df, update=True, fallback_only=False):
+        return await db_async.upsert_df('nav_table', df, storage.NAV_KEY_COLUMNS, update=update,
+                                        update_flag='is_fallback' if fallback_only else None)
+
+    async def append_nav(self, df):
+        return await db_async.df_copy_to_table('nav_table', df)
+
+
+async def write_nav_rows(pm_result_df, mode=None):
+    """
+    Async nav_test.write_nav_rows - the same nav_test.nav_write_steps, awaited
+    """
+    store = _AsyncNavStore()
+    steps = nav_test.nav_write_steps(pm_result_df, mode)
+    result = None
+    while True:
+        try:
+            method, rows, kwargs = steps.send(result)
+        except StopIteration as done:
+            return done.value
+        result = await getattr(store, method)(rows, **kwargs)
+
+
+async def load_inputs():
+    """
+    Shares history, mapping snapshot and publish rules, shared by every minute of a run
+
+    The caches keep their synchronous refresh logic and run on a worker thread, they are
+    usually answered from memory.
+    """
+    shares_history, mapping, rules = await asyncio.gather(
+        asyncio.to_thread(shares_cache.get_shares_history),
+        asyncio.to_thread(pm_mapping.get_snapshot),
+        asyncio.to_thread(publish_rules.get_rules),
+    )
+    if mapping.empty:
+        raise ValueError("Failed to load PM mapping data from database")
+    return shares_history, mapping, rules
+
+
+async def process_minute(curr, shares_history, mapping, rules):
+    """
+    One minute of nav_test.process_minute (pandas rollup, latest_balance source) with async I/O
+
+    Returns:
+        tuple: (nav rows, validation log, written)
+    """
+    curr_hour = curr.replace(minute=0, second=0, microsecond=0)
+    grouping_df = mapping.frame
+
+    latest = await _timed('balance_query', latest_balances(), curr)
+    balance = await _timed('balance_lookup', load_tick_balances(curr, curr_hour, grouping_df, latest), curr)
+    balance['timestamp'] = pd.to_datetime(balance['timestamp'])
+    balance = nav_test.select_fresh_balances(balance, grouping_df, curr, curr_hour)
+
+    missing_active_pms = mapping.active_pms - set(balance['pm'])
+    fallback_batch = await _timed('fallback', fallback_balances(missing_active_pms, curr), curr)
+    balance_enhanced, validation_log = nav_test.validate_and_enhance_balance_data(
+        balance, curr, curr_hour, mapping=mapping, fallback_batch=fallback_batch)
+    balance_enhanced['tick'] = curr
+
+    bal_concat = nav_test.aggregate_nodes(balance_enhanced, mapping, rules)
+    pm_result_df = nav_test.attach_shares_and_nav(bal_concat, shares_history)
+    written = await _timed('write', write_nav_rows(pm_result_df), curr)
+    return pm_result_df, validation_log, bool(written)
+
+
+async def run_ticks(currs, concurrency=TICK_CONCURRENCY):
+    """
+    Compute the given minutes on the running loop, at most `concurrency` at once
+
+    Returns:
+        dict: {curr: (nav rows, validation log, written) or the exception the minute raised}
+    """
+    currs = list(currs)
+    shares_history, mapping, rules = await asyncio.wait_for(load_inputs(), INPUT_DEADLINE_SECONDS)
+    results = await db_async.gather_bounded(
+        (process_minute(curr, shares_history, mapping, rules) for curr in currs), concurrency)
+    return dict(zip(currs, results))
+
+
+async def _main(currs, concurrency):
+    try:
+        return await run_ticks(currs, concurrency)
+    finally:
+        await db_async.close_pool()
+
+
+def main(curr=None, currs=None, concurrency=TICK_CONCURRENCY):
+    """
+    nav_test.main() on an event loop - one minute (curr, default the last one) or several (currs)
+
+    Returns:
+        bool: True if every minute wrote its rows
+    """
+    if currs is None:
+        if curr is None:
+            curr = datetime.now(timezone.utc).replace(second=0, microsecond=0) - timedelta(minutes=1)
+        currs = [curr]
+
+    with metrics.tick('nav_tick_async', currs[0]) as run:
+        run['ok'] = False
+        run['minutes'] = len(currs)
+        try:
+            results = asyncio.run(_main(currs, concurrency))
+        except Exception as e:
+            print(f"Error in async main: {e}")
+            return False
+
+        failed = []
+        for minute, result in results.items():
+            if isinstance(result, Exception):
+                print(f"Error computing {minute}: {result}")
+                failed.append(minute)
+                continue
+            pm_result_df, validation_log, written = result
+            print(f'Final pm_result_df for {minute}:')
+            with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+                print(pm_result_df.to_string())
+            nav_test.report_validation(validation_log)
+            print("=" * 35)
+            if not written:
+                failed.append(minute)
+
+        run['ok'] = not failed
+        run['failed_minutes'] = [minute.isoformat() for minute in failed]
+    return run['ok']
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,8 @@ import json
 from datetime import datetime, timedelta, timezone
 import db_utils
 import pandas as pd
-import credentials
+import publish_rules
+import pm_mapping
 import time
 
 def main():
@@ -19,17 +20,18 @@ def main():
         latest_shares = shares.sort_values(by='timestamp', ascending=False).drop_duplicates(subset='pm')
         print(latest_shares)
 
-        grouping_df = pd.DataFrame(credentials.PM_DATA)
+        # same cached pm_mapping snapshot as nav_test instead of credentials.PM_DATA
+        grouping_df = pm_mapping.get_snapshot().frame
         print(grouping_df)
 
-        query = f'''SELECT 
+        query = '''SELECT 
             timestamp, 
             pm, 
             balance AS balance 
         FROM 
             balance_all_consolidated
         WHERE 
-            timestamp = '{curr_hour}' OR timestamp = '{curr}'
+            timestamp = %(curr_hour)s OR timestamp = %(curr)s
         ORDER BY 
             timestamp;'''
 
@@ -38,7 +40,7 @@ def main():
         #     OR 
         #     (pm NOT IN ('hermeneutic', 'defiance', 'northrock') AND timestamp = '{curr}')
 
-        balance = db_utils.get_db_table(query=query)
+        balance = db_utils.get_db_table(query=query, params={'curr': curr, 'curr_hour': curr_hour})
         balance['timestamp'] = pd.to_datetime(balance['timestamp'])
         balance = balance.loc[balance.groupby('pm')['timestamp'].idxmax()]
         print(balance)
@@ -89,14 +91,13 @@ def main():
         # sp1-disc, sp1-disc-deribitmaster not yet ready - they are dropped for now
         pm_result_df.dropna(inplace=True)
         # pm_result_df = pm_result_df[pm_result_df['pm'] not in ['sp1-fof-hermeneutic', 'sp1-fof', 'sp1-cash-cash', 'sp1-cash']]
-        if curr.minute != 0:
-            print('not including herm, fof if not hour 00')
-            pm_result_df = pm_result_df[~pm_result_df['pm'].isin(['sp1-fof-tangoecho', 'sp1-fof-hermeneutic', 'sp1-fof', 'sp1-cash-cash', 'sp1-cash','sp1-fof-northrock', 'sp1-fof-defiance', 'sp2-cash-cash', 'sp2-cash', 'sp3-cash-cash', 'sp3-cash', 'sp2-classb-cash-cash','sp2-classb-cash'])]
-        
-        pm_result_df = pm_result_df[pm_result_df['pm'] != 'sp1-sma-robinfunding']
+        # publish / exclusion rules come from the publish_rules table
+        excluded = publish_rules.get_rules().excluded_nodes(curr)
+        if excluded:
+            print(f'not published this minute (publish_rules): {sorted(excluded)}')
+        pm_result_df = pm_result_df[~pm_result_df['pm'].isin(excluded)]
 
         print('pm_result_df')
-        pm_result_df = pm_result_df[~pm_result_df['pm'].isin(['sp2', 'sp2-gross', 'sp2-sma', 'sp2-sma-romeo'])] 
 
         print(pm_result_df)
 
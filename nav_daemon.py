@@ -0,0 +1,141 @@
+import time
+from datetime import datetime, timedelta, timezone
+import backfill
+import balance_buffer
+import metrics
+import nav_test
+import storage
+
+
+# Per minute NAV daemon - stays resident so imports, DB engines and cached
+# reference data are reused between ticks instead of paying for them every cron run
+
+TICK_SECONDS = 60
+
+# longest gap of missed minutes recomputed automatically - anything older needs backfill.py
+MAX_CATCHUP_MINUTES = 120
+
+# keep the previous tick's per PM balances and node sums, re-emit only the nodes that changed
+INCREMENTAL_ROLLUP = True
+
+# keep the last few hours of balances in memory, fallback lookups no longer query the database
+BALANCE_BUFFER = True
+
+
+def next_boundary(now):
+    """
+    Return the next whole-minute boundary strictly after `now`
+    """
+    return now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+
+
+def load_high_water_mark():
+    """
+    Last minute already written to nav_table (None if the table is empty or unreachable)
+    """
+    last = storage.get_store().last_nav_timestamp()
+    return None if last is None else last.to_pydatetime()
+
+
+def catch_up(start, end):
+    """
+    Compute and write every minute in [start, end] as one batch:
+    one balance query, vectorized per-minute aggregation, one bulk upsert
+    """
+    print(f'catching up {int((end - start).total_seconds() // 60) + 1} minute(s): {start} -> {end}')
+    with metrics.tick('catch_up', end) as run:
+        run['minutes'] = int((end - start).total_seconds() // 60) + 1
+        try:
+            pm_result_df, report = backfill.compute_range(start, end)
+            backfill.print_report(report, len(pm_result_df))
+            with metrics.span('write') as m:
+                run['ok'] = bool(nav_test.write_nav_rows(pm_result_df))
+                m['rows'] = len(pm_result_df)
+        except Exception as e:
+            print(f"Error in catch up: {e}")
+            run['ok'] = False
+    return run['ok']
+
+
+def run_tick(boundary, high_water_mark=None, max_catchup_minutes=MAX_CATCHUP_MINUTES):
+    """
+    Run the NAV tick for the minute that just closed at `boundary`, plus any minutes
+    missed since `high_water_mark`
+
+    Returns:
+        tuple: (seconds the tick took, new high water mark)
+    """
+    start = time.monotonic()
+    curr = boundary - timedelta(minutes=1)
+
+    if high_water_mark is not None and high_water_mark >= curr:
+        print(f'{curr} already written - skipping')
+        return time.monotonic() - start, high_water_mark
+
+    first_missing = curr if high_water_mark is None else high_water_mark + timedelta(minutes=1)
+    earliest = curr - timedelta(minutes=max_catchup_minutes - 1)
+    if first_missing < earliest:
+        print(f'⚠ {first_missing} -> {earliest - timedelta(minutes=1)} is beyond the catch-up limit, run backfill.py for it')
+        first_missing = earliest
+
+    if first_missing == curr:
+        ok = nav_test.main(curr=curr, incremental=INCREMENTAL_ROLLUP)
+    else:
+        ok = catch_up(first_missing, curr)
+
+    return time.monotonic() - start, (curr if ok else high_water_mark)
+
+
+def run(max_ticks=None, max_catchup_minutes=MAX_CATCHUP_MINUTES, metrics_port=metrics.METRICS_PORT):
+    """
+    Wake on every minute boundary and run the NAV pipeline
+
+    Reports for every tick:
+    - drift: how late after the boundary the tick actually started
+    - overrun: how far the tick ran past its 60 second budget
+
+    A tick that overruns never overlaps the next one - boundaries that passed
+    while it was running are skipped and picked up by the next tick's catch-up.
+
+    Args:
+        max_ticks: stop after this many ticks (None = run forever)
+        max_catchup_minutes: most missed minutes recomputed in one catch-up batch
+        metrics_port: serve Prometheus metrics on this port (0 = off)
+    """
+    metrics.serve(metrics_port)
+    ticks = 0
+    high_water_mark = load_high_water_mark()
+    print('last written minute:', high_water_mark)
+    if BALANCE_BUFFER:
+        balance_buffer.enable(datetime.now(timezone.utc))
+    boundary = next_boundary(datetime.now(timezone.utc))
+
+    while max_ticks is None or ticks < max_ticks:
+        wait = (boundary - datetime.now(timezone.utc)).total_seconds()
+        if wait > 0:
+            time.sleep(wait)
+
+        drift = (datetime.now(timezone.utc) - boundary).total_seconds()
+        print("tick at：", boundary.strftime("%Y-%m-%d %H:%M:%S %Z"), f"(drift {drift:.3f}s)")
+
+        try:
+            elapsed, high_water_mark = run_tick(boundary, high_water_mark, max_catchup_minutes)
+        except Exception as e:
+            # nav_test.main already catches pipeline errors, this only guards the loop itself
+            print(f"Error in daemon tick: {e}")
+            elapsed = (datetime.now(timezone.utc) - boundary).total_seconds() - drift
+
+        overrun = max(0.0, drift + elapsed - TICK_SECONDS)
+        print(f'time taken: {elapsed:.3f}s, overrun: {overrun:.3f}s')
+
+        ticks += 1
+        following = next_boundary(datetime.now(timezone.utc))
+        skipped = int((following - boundary).total_seconds() // TICK_SECONDS) - 1
+        if skipped > 0:
+            print(f'⚠ tick overran - skipped {skipped} minute(s)')
+        boundary = following
+        print()
+
+
+if __name__ == '__main__':
+    run()
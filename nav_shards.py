@@ -0,0 +1,251 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+import metrics
+import nav_test
+import pm_mapping
+import publish_rules
+import shares_cache
+import storage
+
+
+# Per fund sharded NAV tick. pm_mapping is split into shards of whole funds and every shard runs
+# its own fallback, rollup and write on a worker thread, so a fund with slow fallback queries or a
+# large sub-account set no longer delays the NAV of the others. The tick's balances are read once
+# and handed to every shard.
+# Shards share the pooled engine (db_utils.POOL_SIZE bounds how many hit the database at once).
+
+SHARD_WORKERS = int(os.environ.get('NAV_SHARD_WORKERS', '4'))
+# a shard still running this long after it started is reported as timed out and not waited for
+SHARD_DEADLINE_SECONDS = float(os.environ.get('NAV_SHARD_DEADLINE_SECONDS', '30'))
+# nothing is waited for past this point of the tick, queued shards included
+TICK_DEADLINE_SECONDS = 55
+
+
+def fund_shards(frame):
+    """
+    Split a pm_mapping frame into shards of whole funds
+
+    Funds that share a pm, pm_group or group end up in the same shard, so every node is
+    computed by exactly one shard. Rows without a fund go with whatever they share a node with.
+
+    Returns:
+        list of (shard name, mapping rows), largest shard first
+    """
+    parent = {}
+
+    def find(key):
+        parent.setdefault(key, key)
+        while parent[key] != key:
+            parent[key] = parent[parent[key]]
+            key = parent[key]
+        return key
+
+    row_keys = []
+    for row in frame[['pm', 'pm_group', 'group', 'fund']].itertuples(index=False):
+        keys = [(column, value) for column, value in zip(('pm', 'pm_group', 'group', 'fund'), row) if pd.notna(value)]
+        for key in keys[1:]:
+            parent[find(key)] = find(keys[0])
+        row_keys.append(find(keys[0]) if keys else None)
+
+    roots = pd.Series([find(key) if key is not None else None for key in row_keys], index=frame.index)
+    shards = []
+    for _, rows in frame.groupby(roots.map(str), sort=False):
+        funds = sorted(rows['fund'].dropna().unique())
+        shards.append(('+'.join(funds) if funds else rows['pm'].iloc[0], rows))
+    return sorted(shards, key=lambda shard: (-len(shard[1]), shard[0]))
+
+
+_sharded = (None, None)  # (full snapshot, [(name, shard snapshot)])
+
+
+def get_shards(mapping):
+    """
+    Shard snapshots of a pm_mapping snapshot, split once per snapshot so each shard keeps
+    its compiled rollup engine between ticks
+    """
+    global _sharded
+    snapshot, shards = _sharded
+    if snapshot is not mapping:
+        shards = [(name, pm_mapping.build_snapshot(rows, fingerprint=(mapping.fingerprint, name)))
+                  for name, rows in fund_shards(mapping.frame)]
+        _sharded = (mapping, shards)
+    return shards
+
+
+def read_tick_balances(curr, curr_hour):
+    """
+    The tick's balance read shared by every shard: latest_balance rows, or the balance scan
+    (see nav_test.NAV_BALANCE_SOURCE)
+    """
+    store = storage.get_store()
+    if nav_test.NAV_BALANCE_SOURCE == 'latest_balance':
+        return store.latest_balances()
+    return store.balances_at(curr, curr_hour)
+
+
+def shard_balances(curr, curr_hour, shard, tick_balances=None):
+    """
+    Candidate balance rows of one shard, out of read_tick_balances() (read here if not given)
+    """
+    if tick_balances is not None and nav_test.NAV_BALANCE_SOURCE != 'latest_balance':
+        return tick_balances[tick_balances['pm'].isin(shard.all_pms)].reset_index(drop=True)
+    return nav_test.load_tick_balances(curr, curr_hour, shard.frame, pms=shard.all_pms, latest=tick_balances)
+
+
+def process_shard(curr, shard, shares_history, rules, tick_balances=None):
+    """
+    Freshness filter, fallback, rollup, shares and write for one shard of the mapping
+
+    Args:
+        tick_balances: read_tick_balances() of the tick, shared by the shards (read by the shard if None)
+
+    Returns:
+        tuple: (nav rows, validation log, written)
+    """
+    curr_hour = curr.replace(minute=0, second=0, microsecond=0)
+    balance = shard_balances(curr, curr_hour, shard, tick_balances)
+    balance['timestamp'] = pd.to_datetime(balance['timestamp'])
+    balance = nav_test.select_fresh_balances(balance, shard.frame, curr, curr_hour)
+
+    balance_enhanced, validation_log = nav_test.validate_and_enhance_balance_data(balance, curr, curr_hour, mapping=shard)
+    balance_enhanced['tick'] = curr
+    bal_concat = nav_test.aggregate_nodes(balance_enhanced, shard, rules)
+    pm_result_df = nav_test.attach_shares_and_nav(bal_concat, shares_history)
+    written = nav_test.write_nav_rows(pm_result_df)
+    return pm_result_df, validation_log, bool(written)
+
+
+def merge_validation_logs(logs, curr):
+    """
+    One validation log (same layout as validate_and_enhance_balance_data's) out of the shards' logs
+    """
+    merged = {
+        'timestamp': curr,
+        'active_pms': {'expected_count': 0, 'with_current_data': [], 'using_fallback_data': [], 'completely_missing': []},
+        'inactive_pms': {'expected_count': 0, 'with_current_data': [], 'missing_data': []},
+        'summary': {'total_expected_pms': 0, 'total_with_data': 0},
+    }
+    for log in logs:
+        for section in ('active_pms', 'inactive_pms', 'summary'):
+            for key, value in log[section].items():
+                merged[section][key] += value
+    return merged
+
+
+def run_shards(curr, shards, shares_history, rules, workers=SHARD_WORKERS, deadline_seconds=SHARD_DEADLINE_SECONDS,
+               tick_deadline_seconds=TICK_DEADLINE_SECONDS, tick_balances=None):
+    """
+    Run every shard on a thread pool and collect what finished in time
+
+    Each shard gets deadline_seconds from the moment a worker picks it up, and nothing is waited for
+    past tick_deadline_seconds. Threads cannot be stopped - a timed out shard keeps running in the
+    background and its (idempotent) write may still land, but the tick is reported as not ok.
+
+    Returns:
+        tuple: (nav rows of the finished shards, their validation logs, per shard report)
+    """
+    started = {}
+    parent = metrics.current_stage()
+
+    def task(name, shard):
+        started[name] = time.monotonic()
+        with metrics.span('shard', parent=parent) as m:
+            m['shard'] = name
+            return process_shard(curr, shard, shares_history, rules, tick_balances)
+
+    tick_deadline = time.monotonic() + tick_deadline_seconds
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='nav-shard')
+    futures = {executor.submit(metrics.bind(task), name, shard): name for name, shard in shards}
+    pending = set(futures)
+    frames, logs, report = [], [], {}
+
+    while pending:
+        now = time.monotonic()
+        expiries = [started[futures[f]] + deadline_seconds for f in pending if futures[f] in started]
+        timeout = max(0.0, min(expiries + [tick_deadline]) - now)
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            name = futures[future]
+            seconds = round(time.monotonic() - started.get(name, now), 3)
+            try:
+                pm_result_df, validation_log, written = future.result()
+            except Exception as e:
+                print(f"Error in shard {name}: {e}")
+                report[name] = {'status': 'error', 'error': str(e), 'seconds': seconds}
+                continue
+            frames.append(pm_result_df)
+            logs.append(validation_log)
+            report[name] = {'status': 'ok' if written else 'write_failed', 'rows': len(pm_result_df), 'seconds': seconds}
+
+        now = time.monotonic()
+        for future in list(pending):
+            name = futures[future]
+            if now >= tick_deadline or (name in started and now - started[name] >= deadline_seconds):
+                pending.discard(future)
+                future.cancel()
+                report[name] = {'status': 'timed_out' if name in started else 'not_started',
+                                'seconds': round(now - started[name], 3) if name in started else 0.0}
+
+    executor.shutdown(wait=False, cancel_futures=True)
+    pm_result_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=nav_test.NAV_COLUMNS)
+    return pm_result_df, logs, report
+
+
+def print_shard_report(report):
+    print("\n=== SHARD REPORT ===")
+    for name, entry in sorted(report.items(), key=lambda item: -item[1]['seconds']):
+        rows = f", {entry['rows']} rows" if 'rows' in entry else ''
+        print(f"  {name}: {entry['status']} in {entry['seconds']:.3f}s{rows}")
+
+
+def main(curr=None, workers=SHARD_WORKERS, deadline_seconds=SHARD_DEADLINE_SECONDS):
+    """
+    nav_test.main() with the mapping split by fund and the shards run concurrently
+
+    Returns:
+        bool: True if every shard finished and wrote its rows
+    """
+    if curr is None:
+        curr = datetime.now(timezone.utc).replace(second=0, microsecond=0) - timedelta(minutes=1)
+    curr_hour = curr.replace(minute=0, second=0, microsecond=0)
+
+    with metrics.tick('nav_tick_sharded', curr) as run:
+        run['ok'] = False
+        try:
+            with metrics.span('inputs'):
+                inputs = nav_test.fetch_concurrently(
+                    {'shares': shares_cache.get_shares_history, 'mapping': pm_mapping.get_snapshot,
+                     'balance_query': lambda: read_tick_balances(curr, curr_hour)})
+            shares_history, mapping, tick_balances = inputs['shares'], inputs['mapping'], inputs['balance_query']
+            if mapping.empty:
+                raise ValueError("Failed to load PM mapping data from database")
+            rules = publish_rules.get_rules()
+            shards = get_shards(mapping)
+            run['shards'] = len(shards)
+
+            with metrics.span('shards'):
+                pm_result_df, logs, report = run_shards(curr, shards, shares_history, rules, workers, deadline_seconds,
+                                                        tick_balances=tick_balances)
+
+            print('Final pm_result_df with fallback and inactive indicators:')
+            with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+                print(pm_result_df.to_string())
+            print_shard_report(report)
+
+            with metrics.span('alert'):
+                nav_test.report_validation(merge_validation_logs(logs, curr))
+            print("=" * 35)
+
+            run['ok'] = all(entry['status'] == 'ok' for entry in report.values())
+            run['failed_shards'] = sorted(name for name, entry in report.items() if entry['status'] != 'ok')
+        except Exception as e:
+            print(f"Error in sharded main: {e}")
+    return run['ok']
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,19 @@
 import json
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta, timezone
-import db_utils
+import balance_buffer
+import metrics
+import numpy as np
 import pandas as pd
 import credentials
 import time
+import notifier
+import pm_mapping
+import publish_rules
+import rollup
 import sheet_utils
-import telegram
+import shares_cache
+import storage
 
 
 def is_valid_timestamp(row, curr, curr_hour):
@@ -16,34 +24,117 @@ def is_valid_timestamp(row, curr, curr_hour):
     return True  # 未知頻率保守處理
 
 
+def is_valid_timestamp_vectorized(update_frequency, timestamp, curr, curr_hour):
+    """
+    Columnar version of is_valid_timestamp - same rules applied to whole arrays
+
+    Args:
+        update_frequency: Series of 'minute' / 'hour' / anything else
+        timestamp: Series of balance timestamps (aligned with update_frequency)
+        curr, curr_hour: scalars, or Series aligned with timestamp (one tick per row, used by backfill)
+
+    Returns:
+        numpy bool array
+    """
+    update_frequency = pd.Series(update_frequency).to_numpy()
+    timestamp = pd.Series(timestamp)
+    is_minute = update_frequency == 'minute'
+    is_hour = update_frequency == 'hour'
+    return np.where(
+        is_minute, (timestamp == curr).to_numpy(),
+        np.where(is_hour, (timestamp == curr_hour).to_numpy(), True)  # 未知頻率保守處理
+    )
+
+
+def compute_nav(balance, shares):
+    """
+    nav = balance / shares, 0 where shares is missing or 0 (vectorized)
+    """
+    balance = np.asarray(balance, dtype='float64')
+    shares = np.asarray(shares, dtype='float64')
+    nav = np.zeros(len(balance))
+    has_shares = ~np.isnan(shares) & (shares != 0)
+    np.divide(balance, shares, out=nav, where=has_shares)
+    return nav
+
+
+def select_fresh_balances(balance, grouping_df, curr, curr_hour):
+    """
+    Latest of the rows at curr / curr_hour per pm, dropped if stale for the pm's update_frequency
+    """
+    balance = balance.loc[balance.groupby('pm')['timestamp'].idxmax()]
+    balance = pd.merge(balance, grouping_df[['pm', 'update_frequency']], on='pm', how='left')
+    valid_mask = is_valid_timestamp_vectorized(balance['update_frequency'], balance['timestamp'], curr, curr_hour)
+    return balance[valid_mask].drop(columns=['update_frequency'])
+
+
+def split_latest_balances(latest, grouping_df, curr, curr_hour):
+    """
+    Use the latest row per pm (latest_balance) in place of the curr / curr_hour scan
+
+    - latest at curr or curr_hour: that row is the latest of the two, use it as is
+    - latest before curr_hour, or a minute pm with latest before curr: nothing fresh
+    - latest between curr_hour and curr for hour / unknown frequency pms, or after curr
+      (table already ahead of the tick, e.g. catch-up): not decidable, exact lookup
+
+    Returns:
+        tuple: (candidate rows for select_fresh_balances, pms needing an exact lookup)
+    """
+    ts = latest['timestamp']
+    frequency = latest['pm'].map(dict(zip(grouping_df['pm'], grouping_df['update_frequency'])))
+    at_tick = (ts == curr) | (ts == curr_hour)
+    undecided = ((ts > curr_hour) & (ts < curr) & (frequency != 'minute')) | (ts > curr)
+    return latest.loc[at_tick, ['timestamp', 'pm', 'balance']], set(latest.loc[undecided, 'pm'])
+
+
+def load_tick_balances(curr, curr_hour, grouping_df, source=None, pms=None, latest=None):
+    """
+    Candidate balance rows of the tick, read from latest_balance (O(#PMs)) with exact lookups
+    only for undecidable pms, or by scanning balance_all_consolidated at curr / curr_hour
+
+    Args:
+        pms: only return rows of these pms (one shard of the mapping) - all pms if None
+        latest: latest_balance rows when already read (see fetch_concurrently)
+    """
+    store = storage.get_store()
+    if (source or NAV_BALANCE_SOURCE) == 'latest_balance':
+        if latest is None:
+            latest = store.latest_balances()
+        if not latest.empty:
+            # a shard with none of its pms in latest_balance just has no rows there, no scan
+            if pms is not None:
+                latest = latest[latest['pm'].isin(pms)]
+            balance, lookup_pms = split_latest_balances(latest, grouping_df, curr, curr_hour)
+            if lookup_pms:
+                exact = store.balances_at(curr, curr_hour, pms=lookup_pms)
+                balance = pd.concat([balance, exact], ignore_index=True)
+            return balance.reset_index(drop=True)
+        print('latest_balance empty or missing (run migrations.py) - scanning balance_all_consolidated')
+    return store.balances_at(curr, curr_hour, pms=pms)
+
+
+def get_fallback_balance_data_batch(pms, curr_timestamp, max_lookback_hours=2):
+    """
+    Get the most recent valid balance data for every PM in `pms` within the lookback period
+    in a single query (one row per PM that has data, PMs without data are absent)
+    """
+    if not pms:
+        return pd.DataFrame(columns=['timestamp', 'pm', 'balance'])
+    buffer = balance_buffer.get_buffer()
+    if buffer is not None:
+        # resident process: answered from the recent balances kept in memory
+        return buffer.fallback_balances(pms, curr_timestamp, max_lookback_hours)
+    return storage.get_store().fallback_balances(pms, curr_timestamp, max_lookback_hours)
+
+
 def get_fallback_balance_data(pm, curr_timestamp, max_lookback_hours=2):
     """
     Get the most recent valid balance data for a PM within the lookback period
     """
-    lookback_start = curr_timestamp - timedelta(hours=max_lookback_hours)
-    
-    query = f'''
-        SELECT 
-            timestamp, 
-            pm, 
-            balance 
-        FROM 
-            balance_all_consolidated
-        WHERE 
-            pm = '{pm}' 
-            AND timestamp >= '{lookback_start}'
-            AND timestamp <= '{curr_timestamp}'
-            AND balance IS NOT NULL
-        ORDER BY 
-            timestamp DESC
-        LIMIT 1;
-    '''
-    
-    fallback_data = db_utils.get_db_table(query=query)
-    return fallback_data
+    return get_fallback_balance_data_batch([pm], curr_timestamp, max_lookback_hours)
 
 
-def validate_and_enhance_balance_data(balance_df, curr_timestamp, curr_hour):
+def validate_and_enhance_balance_data(balance_df, curr_timestamp, curr_hour, mapping=None, fallback_batch=None):
     """
     Validate balance data and handle missing PMs based on their active status
     - Inactive PMs: Use current data if available, but NO fallback if missing
@@ -53,23 +144,23 @@ def validate_and_enhance_balance_data(balance_df, curr_timestamp, curr_hour):
         balance_df: DataFrame with current balance data (already filtered by is_valid_timestamp)
         curr_timestamp: Current timestamp for validation
         curr_hour: Current hour timestamp for validation
+        mapping: pm_mapping.MappingSnapshot shared with the rest of the tick (loaded if not given)
+        fallback_batch: fallback rows of the missing active PMs when already read (see nav_async)
     
     Returns:
         tuple: (enhanced_balance_df, validation_log)
     """
-    # Get PM mapping data from database
-    pm_mapping_query = 'SELECT pm, pm_group, "group", fund, active, if_btc FROM pm_mapping;'
-    pm_mapping_df = db_utils.get_db_table(pm_mapping_query)
-    # print('pm_mapping_df')
-    # print(pm_mapping_df)
+    # Get PM mapping snapshot (cached, same one main() uses)
+    if mapping is None:
+        mapping = pm_mapping.get_snapshot()
     
-    if pm_mapping_df.empty:
+    if mapping.empty:
         raise ValueError("Failed to load PM mapping data from database")
     
-    # Create sets of PMs based on their active status
-    active_pms = set(pm_mapping_df[pm_mapping_df['active'] == True]['pm'].values)
-    inactive_pms = set(pm_mapping_df[pm_mapping_df['active'] == False]['pm'].values)
-    all_expected_pms = active_pms | inactive_pms
+    # Active / inactive sets are pre-built on the snapshot
+    active_pms = mapping.active_pms
+    inactive_pms = mapping.inactive_pms
+    all_expected_pms = mapping.all_pms
     
     # Get PMs that actually have current data
     actual_pms = set(balance_df['pm'].unique())
@@ -97,31 +188,38 @@ def validate_and_enhance_balance_data(balance_df, curr_timestamp, curr_hour):
     # Handle missing active PMs - try fallback data
     missing_active_pms = active_pms - actual_pms
     fallback_data_list = []
+    fallback_by_pm = {}
     
-    for missing_pm in missing_active_pms:
-        print(f"Active PM missing data: {missing_pm}, attempting fallback...")
-        
-        fallback_data = get_fallback_balance_data(missing_pm, curr_timestamp)
+    if missing_active_pms:
+        print(f"Active PMs missing data: {sorted(missing_active_pms)}, attempting fallback...")
+        # one set-based lookup for every missing PM instead of one query per PM
+        if fallback_batch is None:
+            fallback_batch = get_fallback_balance_data_batch(missing_active_pms, curr_timestamp)
+        fallback_by_pm = {row.pm: row for row in fallback_batch.itertuples(index=False)}
+    
+    for missing_pm in sorted(missing_active_pms):
+        fallback_row = fallback_by_pm.get(missing_pm)
         
-        if not fallback_data.empty:
-            fallback_data['timestamp'] = pd.to_datetime(fallback_data['timestamp'])
-            original_timestamp = fallback_data.iloc[0]['timestamp']
-            # Update timestamp to current for aggregation purposes
-            fallback_data['timestamp'] = curr_timestamp
-            fallback_data['is_fallback'] = True
-            fallback_data['is_inactive'] = False
-            fallback_data_list.append(fallback_data)
-            
+        if fallback_row is not None:
+            original_timestamp = fallback_row.timestamp
             validation_log['active_pms']['using_fallback_data'].append({
                 'pm': missing_pm,
                 'fallback_timestamp': original_timestamp,
-                'balance': fallback_data.iloc[0]['balance']
+                'balance': fallback_row.balance
             })
             print(f"Using fallback data for {missing_pm} from {original_timestamp}")
         else:
             validation_log['active_pms']['completely_missing'].append(missing_pm)
             print(f"No fallback data found for active PM {missing_pm}")
     
+    if validation_log['active_pms']['using_fallback_data']:
+        fallback_data = fallback_batch[['timestamp', 'pm', 'balance']].copy()
+        # Update timestamp to current for aggregation purposes
+        fallback_data['timestamp'] = curr_timestamp
+        fallback_data['is_fallback'] = True
+        fallback_data['is_inactive'] = False
+        fallback_data_list.append(fallback_data)
+    
     # Handle missing inactive PMs - just log them
     # for inactive_pm in validation_log['inactive_pms']['missing_data']:
         # print(f"PM {inactive_pm} is inactive and missing data - skipping (no fallback)")
@@ -139,46 +237,310 @@ def validate_and_enhance_balance_data(balance_df, curr_timestamp, curr_hour):
     return enhanced_balance, validation_log
 
 
-def main():
-    try:
-        # ----- for per minute update last minute's aggregated NAV ----
+NAV_COLUMNS = ['timestamp', 'pm', 'balance', 'shares', 'nav', 'is_fallback']
+NAV_WRITE_MODE = 'upsert'  # or 'append'
+NAV_BALANCE_SOURCE = 'latest_balance'  # or 'scan' - where the pandas path reads the tick's balances
+NAV_ROLLUP_MODE = 'pandas'  # or 'sql' - freshness filter and node sums pushed into one database query
+
+def aggregate_nodes(balance_enhanced, mapping, rules=None):
+    """
+    Roll per-PM balances up to pm_group, group and fund level (plus the gross aliases)
+    with the rollup engine compiled from the mapping snapshot
+
+    balance_enhanced carries a `tick` column (the minute being computed) so the same
+    rollup serves a single live minute or a whole backfill range:
+    - pm_group / group rows are keyed by (tick, timestamp, node)
+    - fund rows are keyed by (tick, fund) and take the max timestamp
+
+    Nodes the publish rules exclude for a tick (hourly-only nodes off the hour, disabled nodes)
+    are masked out of the rollup and never computed.
+
+    Returns:
+        DataFrame with tick, timestamp, pm, balance, is_fallback, is_inactive
+    """
+    engine = rollup.get_engine(mapping)
+    if rules is None:
+        rules = publish_rules.get_rules()
+
+    on_hour = (balance_enhanced['tick'].dt.minute == 0).to_numpy()
+    results = []
+    for hour_tick in (True, False):
+        ticks = balance_enhanced[on_hour == hour_tick]
+        if not ticks.empty:
+            results.append(engine.rollup(ticks, node_mask=rules.node_mask(mapping, on_hour=hour_tick)))
+    if not results:
+        return engine.rollup(balance_enhanced)
+    return pd.concat(results, ignore_index=True)
+
+
+_incremental = rollup.IncrementalRollup()
+
+
+def aggregate_nodes_incremental(balance_enhanced, mapping, curr, rules=None):
+    """
+    aggregate_nodes() for consecutive live ticks (daemon mode): only the nodes whose PMs changed since
+    the previous tick are recomputed and returned - the rows of every other node would be the same as
+    the ones already written. On the hour (and on the first tick, after a gap, or on a mapping or
+    publish rule change) every node is rebuilt and returned, which also bounds float drift.
+
+    Returns:
+        DataFrame with tick, timestamp, pm, balance, is_fallback, is_inactive
+    """
+    engine = rollup.get_engine(mapping)
+    if rules is None:
+        rules = publish_rules.get_rules()
+    on_hour = curr.minute == 0
+    return _incremental.update(balance_enhanced, curr, engine, node_mask=rules.node_mask(mapping, on_hour=on_hour),
+                               full=on_hour)
+
+
+def merge_fallback_into_sql_rollup(node_rows, fallback_rows, mapping, curr, rules=None):
+    """
+    Finish a database rollup (store.nav_rollup) for the tick `curr`: add the gross aliases,
+    patch the fallback balances into every node on their path and drop unpublished nodes
+
+    Returns:
+        DataFrame with tick, timestamp, pm, balance, is_fallback, is_inactive (same as aggregate_nodes)
+    """
+    if rules is None:
+        rules = publish_rules.get_rules()
+
+    nodes = node_rows[node_rows['level'] != 'pm'].rename(columns={'node': 'pm'})
+    nodes = nodes.assign(tick=curr, is_fallback=False)
+    parts = [rollup.add_aliases(nodes)]
+    if not fallback_rows.empty:
+        parts.append(rollup.get_engine(mapping).rollup(fallback_rows, with_level=True))
+
+    bal_concat = rollup.combine_node_rows(parts)
+    return bal_concat[~bal_concat['pm'].isin(rules.excluded_nodes(curr))].reset_index(drop=True)
+
+
+def attach_shares_and_nav(bal_concat, shares_history):
+    """
+    Join the shares in effect at each row's timestamp onto the aggregated nodes and compute nav,
+    dropping nodes without shares
+
+    Args:
+        shares_history: shares_cache.build_history() index, see shares_cache.get_shares_history()
+    """
+    pm_result_df = bal_concat.assign(shares=shares_cache.shares_as_of(bal_concat, shares_history))
+    pm_result_df['nav'] = compute_nav(pm_result_df['balance'], pm_result_df['shares'])
+    pm_result_df.dropna(inplace=True)
+    return pm_result_df
+
+
+def nav_write_steps(pm_result_df, mode=None):
+    """
+    The rules of write_nav_rows as a generator of store calls, shared with nav_async.write_nav_rows
+
+    - 'upsert' (default): idempotent on (timestamp, pm), so retried / overlapping / recomputed
+      ticks never duplicate rows. Rows stamped before their tick (hour PM nodes) are a partial
+      rollup of that timestamp: they fill gaps, and replace a stored row only if it was computed
+      from fallback balances and they were not (late hourly data corrects it).
+    - 'append': plain COPY, used automatically if the unique index is missing
+
+    Yields (store method name, rows, kwargs) - send back what the call returned.
+    The generator's return value is the result of the write.
+    """
+    mode = mode or NAV_WRITE_MODE
+    df_db = pm_result_df[NAV_COLUMNS]
+    if mode == 'append':
+        return (yield 'append_nav', df_db, {})
+
+    on_tick = (pm_result_df['timestamp'] == pm_result_df['tick']).to_numpy()
+    if not (yield 'upsert_nav', df_db[on_tick], {}):
+        print('nav_table upsert failed (unique index missing? run migrations.py) - appending instead')
+        return (yield 'append_nav', df_db, {})
+    return (yield 'upsert_nav', df_db[~on_tick], {'fallback_only': True})
+
+
+def write_nav_rows(pm_result_df, mode=None):
+    """
+    Write finished nav rows to nav_table (see nav_write_steps)
+    """
+    store = storage.get_store()
+    steps = nav_write_steps(pm_result_df, mode)
+    result = None
+    while True:
+        try:
+            method, rows, kwargs = steps.send(result)
+        except StopIteration as done:
+            return done.value
+        result = getattr(store, method)(rows, **kwargs)
+
+
+# shares, mapping and the balance read do not depend on each other - they run at once on the pooled engine
+INPUT_DEADLINE_SECONDS = 20
+_input_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix='nav-input')
+
+
+def fetch_concurrently(calls, deadline_seconds=INPUT_DEADLINE_SECONDS):
+    """
+    Run independent reads at once, each one timed as its own stage under the calling stage
+
+    Args:
+        calls: {stage name: callable without arguments}
+        deadline_seconds: shared deadline for all of them
+
+    Returns:
+        dict: {stage name: result}
+
+    Raises:
+        TimeoutError if they are not all back within deadline_seconds, else the first error raised by a call
+    """
+    parent = metrics.current_stage()
+
+    def timed(name, call):
+        with metrics.span(name, parent=parent) as m:
+            result = call()
+            if isinstance(result, pd.DataFrame):
+                m['rows'] = len(result)
+            return result
+
+    futures = {name: _input_pool.submit(metrics.bind(timed), name, call) for name, call in calls.items()}
+    _, not_done = wait(futures.values(), timeout=deadline_seconds)
+    if not_done:
+        for future in not_done:
+            future.cancel()
+        late = sorted(name for name, future in futures.items() if future in not_done)
+        raise TimeoutError(f"tick inputs not back within {deadline_seconds}s: {late}")
+    return {name: future.result() for name, future in futures.items()}
+
+
+def report_validation(validation_log):
+    """
+    Print the data validation report of a tick and queue one alert for fallback / missing active PMs
+    """
+    active_info = validation_log['active_pms']
+    inactive_info = validation_log['inactive_pms']
+    
+    alert_sections = []
+    
+    print("\n=== DATA VALIDATION REPORT ===")
+    
+    print(f"ACTIVE PMs ({active_info['expected_count']} expected):")
+    print(f"  ✓ With current data: {len(active_info['with_current_data'])} PMs")
+    if active_info['with_current_data']:
+        print(f"    {active_info['with_current_data']}")
+        
+    if active_info['using_fallback_data']:
+        print(f"  ⚠ Using fallback data: {len(active_info['using_fallback_data'])} PMs")
+        
+        fallback_msg = f"⚠️ NAV AGGREGATION ALERT ⚠️\n\n"
+        fallback_msg += f"{len(active_info['using_fallback_data'])} active PMs using fallback data:\n"
+        for fallback_info in active_info['using_fallback_data']:
+            fallback_msg += f"• {fallback_info['pm']}: from {fallback_info['fallback_timestamp']}\n"
+            print(f"    - {fallback_info['pm']}: from {fallback_info['fallback_timestamp']}")
+        fallback_msg += f"\n⚠️ Check data pipeline immediately!"
+        
+        alert_sections.append(fallback_msg)
+            
+    if active_info['completely_missing']:
+        print(f"  ❌ Completely missing: {len(active_info['completely_missing'])} PMs")
+        print(f"    {active_info['completely_missing']}")
+        
+        missing_msg = f"🚨 CRITICAL NAV AGGREGATION ALERT 🚨\n\n"
+        missing_msg += f"{len(active_info['completely_missing'])} active PMs have NO DATA:\n"
+        for pm in active_info['completely_missing']:
+            missing_msg += f"• {pm}\n"
+        missing_msg += f"\n🚨 URGENT: These PMs have no current or fallback data!"
+        
+        alert_sections.append(missing_msg)
+    
+    if alert_sections:
+        # one message per tick, repeats for the same PM set are suppressed by the dispatcher
+        alert_key = ('nav-data-alert',
+                     frozenset(info['pm'] for info in active_info['using_fallback_data']),
+                     frozenset(active_info['completely_missing']))
+        with metrics.span('alert'):
+            notifier.send("\n\n".join(alert_sections), dedup_key=alert_key)
+    
+    if inactive_info['with_current_data']:
+        print(f"  ✓ With current data: {len(inactive_info['with_current_data'])} PMs")
+        print(f"    {inactive_info['with_current_data']}")
+    
+    total_processed = (len(active_info['with_current_data']) + 
+                       len(active_info['using_fallback_data']) + 
+                       len(inactive_info['with_current_data']))
+    
+    print(f"\nSUMMARY:")
+    print(f"  Total PMs processed: {total_processed}/{validation_log['summary']['total_expected_pms']}")
+    print(f"  Data quality: {'✓ GOOD' if not active_info['completely_missing'] else '⚠ NEEDS ATTENTION'}")
+    
+    if active_info['using_fallback_data']:
+        print(f"\n🔔 ALERT: {len(active_info['using_fallback_data'])} active PMs using fallback data - check data pipeline")
+    
+    if active_info['completely_missing']:
+        print(f"\n🚨 CRITICAL: {len(active_info['completely_missing'])} active PMs have no data available")
+
+
+def main(curr=None, rollup_mode=None, incremental=False):
+    # ----- for per minute update last minute's aggregated NAV ----
+    # curr can be passed in by the daemon so a late wake-up still computes the minute it was scheduled for
+    # incremental: only re-emit nodes whose inputs changed since the previous tick (daemon mode, pandas rollup)
+    if curr is None:
         curr = datetime.now(timezone.utc).replace(second=0, microsecond=0) - timedelta(minutes=1)
+
+    # per stage timings of this tick go out as one JSON line (see metrics.py)
+    with metrics.tick('nav_tick', curr) as run:
+        run['ok'] = process_minute(curr, rollup_mode, incremental)
+    if incremental and not run['ok']:
+        # the skipped nodes are only safe to skip if the previous tick's rows were written
+        _incremental.reset()
+    return run['ok']
+
+
+def process_minute(curr, rollup_mode=None, incremental=False):
+    rollup_mode = rollup_mode or NAV_ROLLUP_MODE
+    try:
         curr_hour = curr.replace(minute=0, second=0, microsecond=0)
         prev_hour = curr_hour - timedelta(hours=1)
 
-        query = 'select * from shares_table;'
-        shares = db_utils.get_db_table(query=query)
-        shares['timestamp'] = pd.to_datetime(shares['timestamp'])
-        latest_shares = shares.sort_values(by='timestamp', ascending=False).drop_duplicates(subset='pm')
-
-        pm_mapping_query = 'SELECT pm, pm_group, "group", fund, active, if_btc, update_frequency FROM pm_mapping;'
-        grouping_df = db_utils.get_db_table(pm_mapping_query)
-
-        query = f'''SELECT 
-            timestamp, 
-            pm, 
-            balance AS balance 
-        FROM 
-            balance_all_consolidated
-        WHERE 
-            timestamp = '{curr_hour}' OR timestamp = '{curr}'
-        ORDER BY 
-            timestamp;'''
-
-        balance = db_utils.get_db_table(query=query)
-        balance['timestamp'] = pd.to_datetime(balance['timestamp'])
-        balance = balance.loc[balance.groupby('pm')['timestamp'].idxmax()]
-
-        # ===== Filter out stale data based on update_frequency =====
-        balance = pd.merge(balance, grouping_df[['pm', 'update_frequency']], on='pm', how='left')
-        valid_mask = balance.apply(lambda row: is_valid_timestamp(row, curr, curr_hour), axis=1)
-        balance = balance[valid_mask].drop(columns=['update_frequency'])
-        # ===== End filter =====
+        # shares history (kept warm in memory and topped up incrementally), mapping snapshot and the
+        # tick's balance read are independent - issued together with one shared deadline
+        store = storage.get_store()
+        inputs = {'shares': shares_cache.get_shares_history, 'mapping': pm_mapping.get_snapshot}
+        if rollup_mode == 'sql':
+            # freshness filter and node sums done by the database, per PM only which ones had fresh data
+            inputs['sql_rollup'] = lambda: store.nav_rollup(curr, curr_hour)
+        elif NAV_BALANCE_SOURCE == 'latest_balance':
+            inputs['balance_query'] = store.latest_balances
+        else:
+            inputs['balance_query'] = lambda: store.balances_at(curr, curr_hour)
+        with metrics.span('inputs'):
+            inputs = fetch_concurrently(inputs)
+
+        shares_history, mapping = inputs['shares'], inputs['mapping']
+        grouping_df = mapping.frame
+
+        if rollup_mode == 'sql':
+            node_rows = inputs['sql_rollup']
+            balance = node_rows.loc[node_rows['level'] == 'pm', ['timestamp', 'node', 'balance']].rename(columns={'node': 'pm'})
+        else:
+            balance = inputs['balance_query']
+            if NAV_BALANCE_SOURCE == 'latest_balance':
+                # exact lookups for the pms latest_balance cannot decide (needs the mapping)
+                latest = balance
+                with metrics.span('balance_lookup') as m:
+                    balance = load_tick_balances(curr, curr_hour, grouping_df, latest=latest)
+                    m['rows'] = len(balance)
+                buffer = balance_buffer.get_buffer()
+                if buffer is not None and not latest.empty:
+                    # every balance this tick has seen, so its fallback lookups stay in memory
+                    buffer.observe(pd.concat([latest, balance], ignore_index=True), curr)
+            balance['timestamp'] = pd.to_datetime(balance['timestamp'])
+
+            # ===== Filter out stale data based on update_frequency =====
+            with metrics.span('freshness_filter'):
+                balance = select_fresh_balances(balance, grouping_df, curr, curr_hour)
+            # ===== End filter =====
 
         # ===== NEW VALIDATION AND FALLBACK LOGIC =====
-        balance_enhanced, validation_log = validate_and_enhance_balance_data(
-            balance, curr, curr_hour
-        )
+        with metrics.span('fallback') as m:
+            balance_enhanced, validation_log = validate_and_enhance_balance_data(
+                balance, curr, curr_hour, mapping=mapping
+            )
+            m['rows'] = len(validation_log['active_pms']['using_fallback_data'])
         
         # print("\nValidation Log:")
         # print(json.dumps(validation_log, indent=2, default=str))
@@ -189,144 +551,51 @@ def main():
         
         # ===== END VALIDATION LOGIC =====
 
-        balance_merged = pd.merge(balance_enhanced, grouping_df, on='pm', how='left')
+        balance_enhanced['tick'] = curr
 
         # Add fallback and inactive indicators to final results
-        pm_grouped = balance_merged.groupby(by=['timestamp', 'pm_group']).agg({
-            'balance': 'sum',
-            'is_fallback': 'any',
-            'is_inactive': 'any'
-        }).reset_index()
-        pm_grouped.rename(columns={'pm_group': 'pm'}, inplace=True)
-
-        group_grouped = balance_merged.groupby(by=['timestamp', 'group']).agg({
-            'balance': 'sum',
-            'is_fallback': 'any',
-            'is_inactive': 'any'
-        }).reset_index()
-        group_grouped.rename(columns={'group': 'pm'}, inplace=True)
-
-        fund_grouped = balance_merged.groupby(by=['fund']).agg({
-            'balance': 'sum',
-            'timestamp': 'max',
-            'is_fallback': 'any',
-            'is_inactive': 'any'
-        }).reset_index()
-        fund_grouped.rename(columns={'fund': 'pm'}, inplace=True)
-        
-        # Handle duplicated rows for gross calculations
-        duplicated_rows = fund_grouped[fund_grouped['pm'] == 'sp1'].copy()
-        duplicated_rows['pm'] = 'sp1-gross'
-
-        duplicated_rows_2 = fund_grouped[fund_grouped['pm'] == 'sp2'].copy()
-        duplicated_rows_2['pm'] = 'sp2-gross'
-
-        duplicated_rows_3 = fund_grouped[fund_grouped['pm'] == 'sp2-classb'].copy()
-        duplicated_rows_3['pm'] = 'sp2-classb-gross'
-
-        duplicated_rows_4 = fund_grouped[fund_grouped['pm'] == 'sp3'].copy()
-        duplicated_rows_4['pm'] = 'sp3-gross'
-
-        duplicated_rows_5 = fund_grouped[fund_grouped['pm'] == 'sp2-classa'].copy()
-        duplicated_rows_5['pm'] = 'sp2-classa-gross'
-
-        fund_grouped = pd.concat([fund_grouped, duplicated_rows, duplicated_rows_2, duplicated_rows_3, duplicated_rows_4, duplicated_rows_5])
-
-        bal_concat = pd.concat([pm_grouped, group_grouped, fund_grouped])
-
-        pm_result_df = pd.merge(bal_concat, latest_shares[['pm', 'shares']], on='pm', how='left')
-        pm_result_df['nav'] = pm_result_df.apply(
-            lambda row: 0 if pd.isna(row['shares']) or row['shares'] == 0 else row['balance'] / row['shares'],
-            axis=1
-        )
-        
-        pm_result_df.dropna(inplace=True)
-        
-        if curr.minute != 0:
-            print('not including herm, fof if not hour 00')
-            pm_result_df = pm_result_df[~pm_result_df['pm'].isin(['sp1-fof-tangoecho', 'sp1-fof-hermeneutic', 'sp1-fof', 'sp1-cash-cash', 'sp1-cash', 'sp1-fof-northrock', 'sp1-fof-defiance', 'sp2-cash-cash', 'sp2-cash', 'sp3-cash-cash', 'sp3-cash', 'sp2-classb-cash-cash', 'sp2-classb-cash'])]
+        with metrics.span('rollup') as m:
+            if rollup_mode == 'sql':
+                fallback_rows = balance_enhanced[balance_enhanced['is_fallback']]
+                bal_concat = merge_fallback_into_sql_rollup(node_rows, fallback_rows, mapping, curr)
+            elif incremental:
+                bal_concat = aggregate_nodes_incremental(balance_enhanced, mapping, curr)
+                m['changed_pms'], m['full'] = _incremental.last_changed, _incremental.last_full
+            else:
+                bal_concat = aggregate_nodes(balance_enhanced, mapping)
+            m['rows'] = len(bal_concat)
+
+        with metrics.span('attach_shares'):
+            pm_result_df = attach_shares_and_nav(bal_concat, shares_history)
         
-        pm_result_df = pm_result_df[pm_result_df['pm'] != 'sp1-sma-robinfunding']
-        pm_result_df = pm_result_df[~pm_result_df['pm'].isin(['sp2', 'sp2-gross', 'sp2-sma', 'sp2-sma-romeo'])]
+        excluded = publish_rules.get_rules().excluded_nodes(curr)
+        if excluded:
+            print(f'not published this minute (publish_rules): {sorted(excluded)}')
 
         print('Final pm_result_df with fallback and inactive indicators:')
-        with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+        with metrics.span('print_result'), pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
             print(pm_result_df.to_string())
         # print(pm_result_df)
 
         # Save results
-        df_db = pm_result_df.copy()
-        df_db = df_db[['timestamp', 'pm', 'balance', 'shares', 'nav', 'is_fallback']]
-        db_utils.df_to_table(table_name='nav_table', df=df_db)
+        with metrics.span('write') as m:
+            written = write_nav_rows(pm_result_df)
+            m['rows'] = len(pm_result_df)
 
         # URL = 'https://docs.google.com/spreadsheets/d/1RDA5hceXI4KOqAWJgdu8E_Rp0VueWfkCQEZemtcYUqY/edit?gid=0#gid=0'
         # sheet_name = 'fallback-test'
-        # sheet_utils.set_dataframe(df=df_db, sheet_name=sheet_name, url=URL)
+        # sheet_utils.set_dataframe(df=pm_result_df[NAV_COLUMNS], sheet_name=sheet_name, url=URL)
 
         # ===== ENHANCED REPORTING =====
-        active_info = validation_log['active_pms']
-        inactive_info = validation_log['inactive_pms']
-        
-        print("\n=== DATA VALIDATION REPORT ===")
-        
-        print(f"ACTIVE PMs ({active_info['expected_count']} expected):")
-        print(f"  ✓ With current data: {len(active_info['with_current_data'])} PMs")
-        if active_info['with_current_data']:
-            print(f"    {active_info['with_current_data']}")
-            
-        if active_info['using_fallback_data']:
-            print(f"  ⚠ Using fallback data: {len(active_info['using_fallback_data'])} PMs")
-            
-            fallback_msg = f"⚠️ NAV AGGREGATION ALERT ⚠️\n\n"
-            fallback_msg += f"{len(active_info['using_fallback_data'])} active PMs using fallback data:\n"
-            for fallback_info in active_info['using_fallback_data']:
-                fallback_msg += f"• {fallback_info['pm']}: from {fallback_info['fallback_timestamp']}\n"
-                print(f"    - {fallback_info['pm']}: from {fallback_info['fallback_timestamp']}")
-            fallback_msg += f"\n⚠️ Check data pipeline immediately!"
-            
-            try:
-                telegram.send_notif(fallback_msg)
-            except Exception as e:
-                print(f"Failed to send fallback telegram notification: {e}")
-                
-        if active_info['completely_missing']:
-            print(f"  ❌ Completely missing: {len(active_info['completely_missing'])} PMs")
-            print(f"    {active_info['completely_missing']}")
-            
-            missing_msg = f"🚨 CRITICAL NAV AGGREGATION ALERT 🚨\n\n"
-            missing_msg += f"{len(active_info['completely_missing'])} active PMs have NO DATA:\n"
-            for pm in active_info['completely_missing']:
-                missing_msg += f"• {pm}\n"
-            missing_msg += f"\n🚨 URGENT: These PMs have no current or fallback data!"
-            
-            try:
-                telegram.send_notif(missing_msg)
-            except Exception as e:
-                print(f"Failed to send missing data telegram notification: {e}")
-        
-        if inactive_info['with_current_data']:
-            print(f"  ✓ With current data: {len(inactive_info['with_current_data'])} PMs")
-            print(f"    {inactive_info['with_current_data']}")
-        
-        total_processed = (len(active_info['with_current_data']) + 
-                           len(active_info['using_fallback_data']) + 
-                           len(inactive_info['with_current_data']))
-        
-        print(f"\nSUMMARY:")
-        print(f"  Total PMs processed: {total_processed}/{validation_log['summary']['total_expected_pms']}")
-        print(f"  Data quality: {'✓ GOOD' if not active_info['completely_missing'] else '⚠ NEEDS ATTENTION'}")
-        
-        if active_info['using_fallback_data']:
-            print(f"\n🔔 ALERT: {len(active_info['using_fallback_data'])} active PMs using fallback data - check data pipeline")
-        
-        if active_info['completely_missing']:
-            print(f"\n🚨 CRITICAL: {len(active_info['completely_missing'])} active PMs have no data available")
+        report_validation(validation_log)
         
         print("=" * 35)
         print("completed")
+        return bool(written)
 
     except Exception as e:
         print(f"Error in main: {e}")
+        return False
 
 
 if __name__ == '__main__':
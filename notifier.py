@@ -0,0 +1,138 @@
+import atexit
+import queue
+import threading
+import time
+import metrics
+
+
+# Non-blocking alert dispatcher - the NAV tick only enqueues, a background worker
+# does the HTTP calls with a timeout, rate limits them and drops repeats of the
+# same alert inside the dedup window.
+
+QUEUE_SIZE = 100
+DEDUP_WINDOW_SECONDS = 15 * 60
+MIN_SEND_INTERVAL_SECONDS = 1.0  # telegram allows about one message per second per chat
+SEND_TIMEOUT_SECONDS = 10
+FLUSH_ON_EXIT_SECONDS = 15
+
+
+def telegram_transport(message, chat_id=None):
+    """
+    Default transport: telegram.send_notif with a request timeout
+    """
+    import telegram
+    if chat_id is None:
+        return telegram.send_notif(message, timeout=SEND_TIMEOUT_SECONDS)
+    return telegram.send_notif(message, chat_id=chat_id, timeout=SEND_TIMEOUT_SECONDS)
+
+
+class AlertDispatcher:
+    """
+    Bounded alert queue drained by one background worker thread
+
+    Args:
+        transport: callable(message, chat_id) doing the actual send, returning False (or raising)
+            if the alert did not go out - swap in a stub for tests
+        maxsize: queue bound, alerts submitted while it is full are dropped (and printed)
+        dedup_window_seconds: an alert with the same dedup_key is suppressed inside this window
+        min_interval_seconds: minimum gap between two sends
+    """
+
+    def __init__(self, transport=telegram_transport, maxsize=QUEUE_SIZE,
+                 dedup_window_seconds=DEDUP_WINDOW_SECONDS, min_interval_seconds=MIN_SEND_INTERVAL_SECONDS):
+        self.transport = transport
+        self.dedup_window_seconds = dedup_window_seconds
+        self.min_interval_seconds = min_interval_seconds
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.last_sent = {}  # dedup_key -> monotonic time it was last accepted (dropped again if the send fails)
+        self.lock = threading.Lock()
+        self.worker = None
+
+    def submit(self, message, chat_id=None, dedup_key=None):
+        """
+        Enqueue an alert without blocking
+
+        Returns:
+            bool: False if it was suppressed as a repeat or the queue was full
+        """
+        now = time.monotonic()
+        if dedup_key is not None:
+            with self.lock:
+                last = self.last_sent.get(dedup_key)
+                if last is not None and now - last < self.dedup_window_seconds:
+                    print('alert suppressed (same alert already sent within the dedup window)')
+                    return False
+                self.last_sent[dedup_key] = now
+
+        self._ensure_worker()
+        try:
+            self.queue.put_nowait((message, chat_id, dedup_key))
+            return True
+        except queue.Full:
+            print('alert queue full - dropping alert')
+            self._forget(dedup_key)
+            return False
+
+    def _forget(self, dedup_key):
+        """
+        The alert never went out - let the next identical one through
+        """
+        if dedup_key is not None:
+            with self.lock:
+                self.last_sent.pop(dedup_key, None)
+
+    def flush(self, timeout=None):
+        """
+        Wait until every queued alert has been handled (or timeout seconds passed)
+
+        Returns:
+            bool: True if the queue drained
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _ensure_worker(self):
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+                self.worker.start()
+
+    def _run(self):
+        last_send = 0.0
+        while True:
+            message, chat_id, dedup_key = self.queue.get()
+            try:
+                wait = self.min_interval_seconds - (time.monotonic() - last_send)
+                if wait > 0:
+                    time.sleep(wait)
+                last_send = time.monotonic()
+                with metrics.span('alert_send'):
+                    sent = self.transport(message, chat_id)
+                if sent is False:
+                    print("Failed to send alert: transport reported it as not sent")
+                    self._forget(dedup_key)
+            except Exception as e:
+                print(f"Failed to send alert: {e}")
+                self._forget(dedup_key)
+            finally:
+                self.queue.task_done()
+
+
+_dispatcher = AlertDispatcher()
+# one-shot runs exit right after the tick - give queued alerts a chance to go out
+atexit.register(lambda: _dispatcher.flush(timeout=FLUSH_ON_EXIT_SECONDS))
+
+
+def send(message, chat_id=None, dedup_key=None):
+    """
+    Queue an alert on the process-wide dispatcher
+    """
+    return _dispatcher.submit(message, chat_id=chat_id, dedup_key=dedup_key)
+
+
+def flush(timeout=None):
+    return _dispatcher.flush(timeout=timeout)
@@ -0,0 +1,110 @@
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+import pandas as pd
+import storage
+
+
+# One cached pm_mapping snapshot shared by every stage of the NAV tick.
+# The table is reloaded only when its fingerprint changes, and the fingerprint
+# itself is only checked once the snapshot is older than REVALIDATE_SECONDS.
+
+REVALIDATE_SECONDS = 60
+
+@dataclass(frozen=True)
+class MappingSnapshot:
+    """
+    Immutable, pre-indexed view of pm_mapping
+
+    frame is shared between stages - treat it as read-only.
+    """
+    frame: pd.DataFrame
+    fingerprint: tuple
+    active_pms: frozenset
+    inactive_pms: frozenset
+    update_frequency: MappingProxyType  # pm -> 'minute' / 'hour'
+    pm_groups: frozenset
+    groups: frozenset
+    funds: frozenset
+    loaded_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def empty(self):
+        return self.frame.empty
+
+    @property
+    def all_pms(self):
+        return self.active_pms | self.inactive_pms
+
+
+def build_snapshot(frame, fingerprint=None):
+    """
+    Index a pm_mapping frame into a MappingSnapshot
+    """
+    frame = frame.reset_index(drop=True)
+    if frame.empty:
+        return MappingSnapshot(frame, fingerprint, frozenset(), frozenset(), MappingProxyType({}),
+                               frozenset(), frozenset(), frozenset())
+
+    return MappingSnapshot(
+        frame=frame,
+        fingerprint=fingerprint,
+        active_pms=frozenset(frame.loc[frame['active'] == True, 'pm']),
+        inactive_pms=frozenset(frame.loc[frame['active'] == False, 'pm']),
+        update_frequency=MappingProxyType(dict(zip(frame['pm'], frame['update_frequency']))),
+        pm_groups=frozenset(frame['pm_group'].dropna()),
+        groups=frozenset(frame['group'].dropna()),
+        funds=frozenset(frame['fund'].dropna()),
+    )
+
+
+def get_fingerprint():
+    return storage.get_store().pm_mapping_fingerprint()
+
+
+class MappingProvider:
+    """
+    Loads pm_mapping once and hands out the same snapshot until the table changes
+    """
+
+    def __init__(self, revalidate_seconds=REVALIDATE_SECONDS):
+        self.revalidate_seconds = revalidate_seconds
+        self.snapshot = None
+        self.checked_at = None
+
+    def get_snapshot(self):
+        now = time.monotonic()
+        if self.snapshot is not None and self.checked_at is not None and now - self.checked_at < self.revalidate_seconds:
+            return self.snapshot
+
+        fingerprint = get_fingerprint()
+        self.checked_at = now
+        if self.snapshot is not None and fingerprint is not None and fingerprint == self.snapshot.fingerprint:
+            return self.snapshot
+
+        frame = storage.get_store().pm_mapping()
+        if frame.empty:
+            if self.snapshot is not None:
+                # keep serving the last good mapping rather than dropping every pm for a tick
+                print('pm_mapping reload returned no rows - keeping previous snapshot')
+                return self.snapshot
+            # never cache an empty mapping, the next call retries the load
+            self.checked_at = None
+            return build_snapshot(frame, fingerprint)
+
+        self.snapshot = build_snapshot(frame, fingerprint)
+        return self.snapshot
+
+    def invalidate(self):
+        self.snapshot = None
+        self.checked_at = None
+
+
+_provider = MappingProvider()
+
+
+def get_snapshot():
+    """
+    Current pm_mapping snapshot from the process-wide provider
+    """
+    return _provider.get_snapshot()
@@ -0,0 +1,129 @@
+import threading
+import time
+import pandas as pd
+import rollup
+import storage
+
+
+# Which aggregate nodes get published, stored in the publish_rules table:
+#   node     - pm / pm_group / group / fund / alias name
+#   cadence  - 'minute' (every tick) or 'hour' (only on minute 00)
+#   enabled  - false = never published
+# Nodes without a rule are published every minute (an empty table publishes everything). Rules are
+# compiled into a boolean mask over the rollup engine's node codes, so excluded nodes are never
+# aggregated at all.
+
+REVALIDATE_SECONDS = 60
+MAX_MASKS = 2 * rollup.MAX_COMPILED_ENGINES  # one per compiled engine and kind of tick
+
+# seed for the table (migrations.py) and fallback when it cannot be read (not when it is empty)
+DEFAULT_PUBLISH_RULES = [
+    # herm, fof and cash nodes are only published on the hour
+    ('sp1-fof-tangoecho', 'hour', True),
+    ('sp1-fof-hermeneutic', 'hour', True),
+    ('sp1-fof', 'hour', True),
+    ('sp1-cash-cash', 'hour', True),
+    ('sp1-cash', 'hour', True),
+    ('sp1-fof-northrock', 'hour', True),
+    ('sp1-fof-defiance', 'hour', True),
+    ('sp2-cash-cash', 'hour', True),
+    ('sp2-cash', 'hour', True),
+    ('sp3-cash-cash', 'hour', True),
+    ('sp3-cash', 'hour', True),
+    ('sp2-classb-cash-cash', 'hour', True),
+    ('sp2-classb-cash', 'hour', True),
+    # never published
+    ('sp1-sma-robinfunding', 'minute', False),
+    ('sp2', 'minute', False),
+    ('sp2-gross', 'minute', False),
+    ('sp2-sma', 'minute', False),
+    ('sp2-sma-romeo', 'minute', False),
+]
+
+
+class PublishRules:
+    """
+    Compiled publish rules
+
+    Attributes:
+        hourly_only: nodes only published on minute 00
+        disabled: nodes never published
+    """
+
+    def __init__(self, rules_frame):
+        enabled = rules_frame['enabled'].astype(bool)
+        self.disabled = frozenset(rules_frame.loc[~enabled, 'node'])
+        self.hourly_only = frozenset(rules_frame.loc[enabled & (rules_frame['cadence'] == 'hour'), 'node'])
+        self._masks = {}  # (mapping fingerprint, on_hour) -> (engine, mask), oldest first
+        self._masks_lock = threading.Lock()
+
+    def excluded_nodes(self, curr):
+        """
+        Set of node names not published for the tick `curr`
+        """
+        if curr.minute != 0:
+            return self.disabled | self.hourly_only
+        return self.disabled
+
+    def node_mask(self, mapping, on_hour):
+        """
+        Bool array over the nodes of the mapping's rollup engine - True for nodes published on
+        this kind of tick. Compiled once per (mapping fingerprint, on_hour).
+        """
+        engine = rollup.get_engine(mapping)
+        key = (mapping.fingerprint if mapping.fingerprint is not None else id(mapping), on_hour)
+        with self._masks_lock:
+            cached = self._masks.get(key)
+        if cached is None or cached[0] is not engine:
+            excluded = self.disabled if on_hour else self.disabled | self.hourly_only
+            mask = ~engine.nodes['pm'].isin(excluded).to_numpy()
+            mask.setflags(write=False)
+            cached = (engine, mask)
+            with self._masks_lock:
+                self._masks.pop(key, None)
+                self._masks[key] = cached
+                while len(self._masks) > MAX_MASKS:
+                    del self._masks[next(iter(self._masks))]
+        return cached[1]
+
+
+def default_rules():
+    return PublishRules(pd.DataFrame(DEFAULT_PUBLISH_RULES, columns=['node', 'cadence', 'enabled']))
+
+
+class RulesProvider:
+    """
+    Loads publish_rules at most once every revalidate_seconds
+    """
+
+    def __init__(self, revalidate_seconds=REVALIDATE_SECONDS):
+        self.revalidate_seconds = revalidate_seconds
+        self.rules = None
+        self.loaded_at = None
+
+    def get_rules(self):
+        now = time.monotonic()
+        if self.rules is not None and now - self.loaded_at < self.revalidate_seconds:
+            return self.rules
+
+        try:
+            frame = storage.get_store().publish_rules()
+        except storage.StoreReadError as e:
+            # keep the last rules read, the defaults only until the table has been read once
+            if self.rules is None:
+                print(f'publish_rules unavailable ({e}) - using built-in defaults')
+                self.rules = default_rules()
+        else:
+            self.rules = PublishRules(frame)
+        self.loaded_at = now
+        return self.rules
+
+
+_provider = RulesProvider()
+
+
+def get_rules():
+    """
+    Current publish rules from the process-wide provider
+    """
+    return _provider.get_rules()
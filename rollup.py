@@ -0,0 +1,409 @@
+import threading
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+# Hierarchy rollup compiled from pm_mapping into a sparse PM -> node incidence matrix.
+# Every aggregate node (pm_group, group, fund and the gross aliases) is one row of the
+# matrix, so all of them come out of a single sparse product per batch of timestamps.
+
+# (pm_mapping column, keyed by timestamp) - levels keyed by timestamp get one row per
+# (tick, timestamp, node), the others one row per (tick, node) carrying the max timestamp
+LEVELS = [
+    ('pm_group', True),
+    ('group', True),
+    ('fund', False),
+]
+
+# fund level nodes also published under a gross alias (alias, source node)
+GROSS_ALIASES = [
+    ('sp1-gross', 'sp1'),
+    ('sp2-gross', 'sp2'),
+    ('sp2-classb-gross', 'sp2-classb'),
+    ('sp3-gross', 'sp3'),
+    ('sp2-classa-gross', 'sp2-classa'),
+]
+
+LEVEL_ORDER = [c for c, _ in LEVELS] + ['alias']
+
+# blocks stacked side by side in the value matrix, summed together by one product
+_BALANCE, _FALLBACK, _INACTIVE, _PRESENT = range(4)
+
+
+class RollupEngine:
+    """
+    pm_mapping compiled into an integer-coded incidence matrix
+
+    Attributes:
+        pms: pm names, column order of the incidence matrix
+        nodes: DataFrame (one row per matrix row) with node name, level and by_timestamp
+        incidence: CSR matrix (nodes x pms) of 0/1
+    """
+
+    def __init__(self, mapping_frame, levels=LEVELS, aliases=GROSS_ALIASES):
+        self.pms = pd.Index(mapping_frame['pm'].drop_duplicates())
+        pm_codes = self.pms.get_indexer(mapping_frame['pm'])
+
+        names, level_names, by_timestamp, row_index, col_index = [], [], [], [], []
+        for column, keyed in levels:
+            valid = mapping_frame[column].notna().to_numpy()
+            codes, uniques = pd.factorize(mapping_frame.loc[valid, column])
+            row_index.append(codes + len(names))
+            col_index.append(pm_codes[valid])
+            names.extend(uniques)
+            level_names.extend([column] * len(uniques))
+            by_timestamp.extend([keyed] * len(uniques))
+
+        rows = np.concatenate(row_index) if row_index else np.array([], dtype=int)
+        cols = np.concatenate(col_index) if col_index else np.array([], dtype=int)
+
+        # an alias is a copy of its source node's row
+        for alias, source in aliases:
+            matches = [i for i, name in enumerate(names) if name == source and level_names[i] == 'fund']
+            if not matches:
+                continue
+            members = cols[rows == matches[0]]
+            rows = np.concatenate([rows, np.full(len(members), len(names))])
+            cols = np.concatenate([cols, members])
+            names.append(alias)
+            level_names.append('alias')
+            by_timestamp.append(False)
+
+        self.nodes = pd.DataFrame({'pm': names, 'level': level_names, 'by_timestamp': by_timestamp})
+        self.incidence = sp.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(len(names), len(self.pms))
+        )
+        # a pm listed twice under the same node still counts once
+        self.incidence.data[:] = 1.0
+
+    def rollup(self, balance_df, node_mask=None, with_level=False):
+        """
+        Aggregate per-PM balances into every node
+
+        Args:
+            balance_df: tick, timestamp, pm, balance, is_fallback, is_inactive (one row per PM per tick)
+            node_mask: optional bool array over self.nodes - False rows are never computed
+            with_level: also return the level column (pm_group / group / fund / alias)
+
+        Returns:
+            DataFrame with tick, timestamp, pm, balance, is_fallback, is_inactive
+        """
+        incidence = self.incidence
+        node_index = np.arange(len(self.nodes))
+        if node_mask is not None:
+            node_index = node_index[np.asarray(node_mask, dtype=bool)]
+            incidence = incidence[node_index]
+
+        pm_codes = self.pms.get_indexer(balance_df['pm'])
+        known = pm_codes >= 0
+        df = balance_df[known]
+        pm_codes = pm_codes[known]
+
+        # one matrix column per distinct (tick, timestamp)
+        col_codes, columns = pd.factorize(pd.MultiIndex.from_arrays([df['tick'], df['timestamp']]))
+        n_cols = len(columns)
+        if n_cols == 0 or len(node_index) == 0:
+            return _empty_result(with_level)
+
+        blocks = [
+            df['balance'].fillna(0).to_numpy(dtype='float64'),
+            df['is_fallback'].to_numpy(dtype='float64'),
+            df['is_inactive'].to_numpy(dtype='float64'),
+            np.ones(len(df)),
+        ]
+        values = sp.csr_matrix(
+            (np.concatenate(blocks), (np.tile(pm_codes, 4), np.concatenate([col_codes + k * n_cols for k in range(4)]))),
+            shape=(len(self.pms), 4 * n_cols)
+        )
+
+        # the one product: every node x every column, balance sum and flag counts together
+        result = (incidence @ values).tocsr()
+
+        present = result[:, _PRESENT * n_cols:(_PRESENT + 1) * n_cols].tocoo()
+        node_rows, col = present.row, present.col
+
+        def block(k):
+            return np.asarray(result[node_rows, col + k * n_cols]).ravel()
+
+        nodes = self.nodes.iloc[node_index[node_rows]].reset_index(drop=True)
+        out = pd.DataFrame({
+            'tick': columns.get_level_values(0)[col],
+            'timestamp': columns.get_level_values(1)[col],
+            'pm': nodes['pm'].to_numpy(),
+            'level': nodes['level'].to_numpy(),
+            'by_timestamp': nodes['by_timestamp'].to_numpy(),
+            'balance': block(_BALANCE),
+            'is_fallback': block(_FALLBACK),
+            'is_inactive': block(_INACTIVE),
+        })
+
+        keyed = out[out['by_timestamp']]
+        per_tick = out[~out['by_timestamp']].groupby(['level', 'tick', 'pm'], sort=False).agg({
+            'balance': 'sum',
+            'timestamp': 'max',
+            'is_fallback': 'sum',
+            'is_inactive': 'sum'
+        }).reset_index()
+
+        out = pd.concat([keyed, per_tick], ignore_index=True)
+        out['is_fallback'] = out['is_fallback'] > 0
+        out['is_inactive'] = out['is_inactive'] > 0
+        return _finish(out, with_level)
+
+
+class IncrementalRollup:
+    """
+    Rollup of consecutive live ticks that only recomputes what changed (daemon mode)
+
+    Keeps the previous tick's row per PM and the sums per (node, timestamp). A tick compares
+    the new per-PM rows with the previous ones, applies the difference of the changed PMs to
+    every node on their path (pm_group -> group -> fund -> gross alias) and emits only those
+    nodes - every other node would come out exactly as on the previous tick.
+
+    update() rebuilds from scratch and emits every node on the first tick, after a gap,
+    when the engine changes or the node mask publishes more nodes, when asked to (full=True)
+    or when more than full_rebuild_share of the PMs changed.
+    """
+
+    def __init__(self, full_rebuild_share=0.5):
+        self.full_rebuild_share = full_rebuild_share
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the previous tick, the next update() is a full rebuild
+        """
+        self.engine = None
+        self.tick = None
+        self.node_mask = None
+        self.state = None  # per PM arrays over engine.pms: present, timestamp (int ns), balance, is_fallback, is_inactive
+        self.sums = None  # per node: {timestamp (int ns): [balance, fallback count, inactive count, present count]}
+        self.last_changed = 0
+        self.last_full = True
+
+    def update(self, balance_df, tick, engine, node_mask=None, full=False):
+        """
+        Apply one live tick
+
+        Args:
+            balance_df: timestamp, pm, balance, is_fallback, is_inactive (one row per PM) for `tick`
+            tick: the minute being computed
+            engine: RollupEngine of the current mapping snapshot
+            node_mask: optional bool array over engine.nodes - False rows are never emitted
+            full: rebuild and emit every node regardless of what changed
+
+        Returns:
+            DataFrame with tick, timestamp, pm, balance, is_fallback, is_inactive - the changed nodes only
+            unless this was a full rebuild
+        """
+        tick = pd.Timestamp(tick)
+        if balance_df['pm'].duplicated().any():
+            # state is one row per PM - leave the odd tick to the stateless rollup
+            self.reset()
+            return engine.rollup(balance_df.assign(tick=tick), node_mask=node_mask)
+
+        mask = np.ones(len(engine.nodes), dtype=bool) if node_mask is None else np.asarray(node_mask, dtype=bool)
+        state = self._pm_state(balance_df, engine)
+        # a node the mask stops excluding has no rows yet, one it starts excluding is simply not emitted
+        full = (full or engine is not self.engine or self.tick is None or tick != self.tick + pd.Timedelta(minutes=1)
+                or (mask & ~self.node_mask).any())
+        if not full:
+            changed = np.flatnonzero(self._changed(state))
+            full = len(changed) > self.full_rebuild_share * len(engine.pms)
+
+        if full:
+            self.engine = engine
+            self._rebuild(state)
+            self.last_changed = len(engine.pms)
+            dirty = {node: set(sums) for node, sums in enumerate(self.sums)}
+        else:
+            self.last_changed = len(changed)
+            dirty = self._apply(state, changed)
+
+        self.tick, self.node_mask, self.state, self.last_full = tick, mask, state, full
+        return self._emit(dirty, tick, mask)
+
+    @staticmethod
+    def _pm_state(balance_df, engine):
+        codes = engine.pms.get_indexer(balance_df['pm'])
+        known = codes >= 0
+        codes, df = codes[known], balance_df[known]
+        n = len(engine.pms)
+        state = {
+            'present': np.zeros(n, dtype=bool),
+            'timestamp': np.zeros(n, dtype='int64'),
+            'balance': np.zeros(n),
+            'is_fallback': np.zeros(n, dtype=bool),
+            'is_inactive': np.zeros(n, dtype=bool),
+        }
+        state['present'][codes] = True
+        state['timestamp'][codes] = pd.DatetimeIndex(pd.to_datetime(df['timestamp'], utc=True)).as_unit('ns').asi8
+        state['balance'][codes] = df['balance'].fillna(0).to_numpy(dtype='float64')
+        state['is_fallback'][codes] = df['is_fallback'].to_numpy(dtype=bool)
+        state['is_inactive'][codes] = df['is_inactive'].to_numpy(dtype=bool)
+        return state
+
+    def _changed(self, state):
+        old = self.state
+        same = (state['timestamp'] == old['timestamp']) & (state['balance'] == old['balance'])
+        same &= (state['is_fallback'] == old['is_fallback']) & (state['is_inactive'] == old['is_inactive'])
+        return (state['present'] != old['present']) | (state['present'] & ~same)
+
+    @staticmethod
+    def _contribution(state, pm):
+        return np.array([state['balance'][pm], state['is_fallback'][pm], state['is_inactive'][pm], 1.0])
+
+    def _rebuild(self, state):
+        pairs = self.engine.incidence.tocoo()
+        keep = state['present'][pairs.col]
+        node, pm = pairs.row[keep], pairs.col[keep]
+        grouped = pd.DataFrame({
+            'node': node,
+            'timestamp': state['timestamp'][pm],
+            'balance': state['balance'][pm],
+            'is_fallback': state['is_fallback'][pm].astype('float64'),
+            'is_inactive': state['is_inactive'][pm].astype('float64'),
+            'present': np.ones(len(pm)),
+        }).groupby(['node', 'timestamp'], sort=False).sum()
+
+        self.sums = [{} for _ in range(len(self.engine.nodes))]
+        for (n, ts), values in zip(grouped.index, grouped.to_numpy()):
+            self.sums[n][ts] = values
+
+    def _apply(self, state, changed):
+        paths = self.engine.incidence.tocsc()
+        old = self.state
+        dirty = {}
+        for pm in changed:
+            for node in paths.indices[paths.indptr[pm]:paths.indptr[pm + 1]]:
+                touched = dirty.setdefault(node, set())
+                if old['present'][pm]:
+                    self._add(node, old['timestamp'][pm], -self._contribution(old, pm))
+                    touched.add(old['timestamp'][pm])
+                if state['present'][pm]:
+                    self._add(node, state['timestamp'][pm], self._contribution(state, pm))
+                    touched.add(state['timestamp'][pm])
+        return dirty
+
+    def _add(self, node, ts, values):
+        sums = self.sums[node]
+        total = sums.get(ts, 0.0) + values
+        if total[_PRESENT] > 0:
+            sums[ts] = total
+        else:
+            # last PM left this (node, timestamp) - drop it rather than keep a rounding residue
+            sums.pop(ts, None)
+
+    def _emit(self, dirty, tick, mask):
+        by_timestamp = self.engine.nodes['by_timestamp'].to_numpy()
+        nodes, timestamps, values = [], [], []
+        for node in sorted(dirty):
+            sums = self.sums[node]
+            if not mask[node] or not sums:
+                continue
+            if by_timestamp[node]:
+                for ts in sorted(dirty[node]):
+                    if ts in sums:
+                        nodes.append(node)
+                        timestamps.append(ts)
+                        values.append(sums[ts])
+            else:
+                nodes.append(node)
+                timestamps.append(max(sums))
+                values.append(np.sum(list(sums.values()), axis=0))
+        if not nodes:
+            return _empty_result()
+
+        values = np.array(values).reshape(-1, 4)
+        emitted = self.engine.nodes.iloc[nodes]
+        out = pd.DataFrame({
+            'tick': tick,
+            'timestamp': pd.to_datetime(np.array(timestamps, dtype='int64'), utc=True),
+            'pm': emitted['pm'].to_numpy(),
+            'level': emitted['level'].to_numpy(),
+            'balance': values[:, _BALANCE],
+            'is_fallback': values[:, _FALLBACK] > 0,
+            'is_inactive': values[:, _INACTIVE] > 0,
+        })
+        return _finish(out)
+
+
+def _finish(out, with_level=False):
+    """
+    Sort node rows by level, tick, timestamp, node and keep the output columns
+    """
+    out = out.assign(level=pd.Categorical(out['level'], categories=LEVEL_ORDER, ordered=True))
+    out = out.sort_values(['level', 'tick', 'timestamp', 'pm'], kind='stable')
+    columns = ['tick', 'timestamp', 'pm', 'balance', 'is_fallback', 'is_inactive']
+    if with_level:
+        out = out.assign(level=out['level'].astype(object))
+        columns = ['level'] + columns
+    return out[columns].reset_index(drop=True)
+
+
+def add_aliases(node_rows, aliases=GROSS_ALIASES):
+    """
+    Append the gross alias copies of the fund level rows (node_rows carries a level column)
+    """
+    sources = dict((source, alias) for alias, source in aliases)
+    funds = node_rows[(node_rows['level'] == 'fund') & node_rows['pm'].isin(sources)]
+    alias_rows = funds.assign(pm=funds['pm'].map(sources), level='alias')
+    return pd.concat([node_rows, alias_rows], ignore_index=True)
+
+
+def combine_node_rows(parts):
+    """
+    Sum partial rollups of the same ticks (e.g. database sums + fallback sums) node by node,
+    with the same keys as RollupEngine.rollup. Every part carries a level column.
+
+    Returns:
+        DataFrame with tick, timestamp, pm, balance, is_fallback, is_inactive
+    """
+    out = pd.concat(parts, ignore_index=True)
+    if out.empty:
+        return _empty_result()
+    out['level'] = out['level'].astype(object)
+    flags = {'balance': 'sum', 'is_fallback': 'any', 'is_inactive': 'any'}
+    by_timestamp = out['level'].isin([c for c, keyed in LEVELS if keyed])
+    keyed = out[by_timestamp].groupby(['level', 'tick', 'timestamp', 'pm'], sort=False).agg(flags).reset_index()
+    per_tick = out[~by_timestamp].groupby(['level', 'tick', 'pm'], sort=False).agg(
+        dict(flags, timestamp='max')).reset_index()
+    return _finish(pd.concat([keyed, per_tick], ignore_index=True))
+
+
+def _empty_result(with_level=False):
+    columns = {} if not with_level else {'level': pd.Series(dtype=object)}
+    return pd.DataFrame({
+        **columns,
+        'tick': pd.Series(dtype='datetime64[ns, UTC]'),
+        'timestamp': pd.Series(dtype='datetime64[ns, UTC]'),
+        'pm': pd.Series(dtype=object),
+        'balance': pd.Series(dtype='float64'),
+        'is_fallback': pd.Series(dtype=bool),
+        'is_inactive': pd.Series(dtype=bool),
+    })
+
+
+# a handful of snapshots can be live at once (the full mapping plus one per fund shard, see nav_shards.py)
+MAX_COMPILED_ENGINES = 64
+
+_compiled = {}  # id(snapshot) -> (snapshot, engine), oldest first
+_compiled_lock = threading.Lock()
+
+
+def get_engine(mapping):
+    """
+    RollupEngine for a pm_mapping snapshot, compiled once per snapshot
+    """
+    with _compiled_lock:
+        snapshot, engine = _compiled.get(id(mapping), (None, None))
+        if snapshot is mapping:
+            return engine
+    engine = RollupEngine(mapping.frame)
+    with _compiled_lock:
+        _compiled.pop(id(mapping), None)
+        _compiled[id(mapping)] = (mapping, engine)
+        while len(_compiled) > MAX_COMPILED_ENGINES:
+            del _compiled[next(iter(_compiled))]
+    return engine
@@ -0,0 +1,138 @@
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import storage
+
+
+# shares_table only grows, so instead of `select * from shares_table` every minute
+# we keep the shares history in memory, sorted by timestamp, and only fetch rows past the watermark.
+# NAV rows look up the shares in effect at their own timestamp (as-of join), not the latest ever.
+
+TS_DTYPE = 'datetime64[ns, UTC]'
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+SHARES_COLUMNS = ['timestamp', 'pm', 'shares']
+
+
+def build_history(rows, history=None):
+    """
+    Sorted as-of index of shares rows, optionally merged into an existing one
+
+    Returns:
+        DataFrame with timestamp, pm, shares sorted by timestamp - one row per (timestamp, pm),
+        the most recently fetched row wins
+    """
+    rows = rows[SHARES_COLUMNS].assign(timestamp=pd.to_datetime(rows['timestamp'], utc=True).astype(TS_DTYPE))
+    if history is not None:
+        rows = pd.concat([history, rows], ignore_index=True)
+    # stable sort so for equal timestamps the most recently fetched row stays last
+    rows = rows.sort_values(by='timestamp', kind='stable').drop_duplicates(subset=['timestamp', 'pm'], keep='last')
+    return rows.reset_index(drop=True)
+
+
+def append_history(history, rows):
+    """
+    Merge rows fetched at or after the history's last timestamp (shares_since(watermark)) into it
+
+    Only the rows at the last timestamp are re-indexed - refetched ones replace them in place and
+    newer ones go after them, the rest of the history is never sorted again.
+
+    Returns:
+        the same history object if nothing changed, else the extended history
+    """
+    last = history['timestamp'].iloc[-1]
+    rows = rows[pd.to_datetime(rows['timestamp'], utc=True) >= last]
+    if rows.empty:
+        return history
+    boundary = int(history['timestamp'].searchsorted(last, side='left'))
+    tail = history.iloc[boundary:].reset_index(drop=True)
+    merged = build_history(rows, tail)
+    if len(merged) == len(tail) and merged.sort_values('pm').reset_index(drop=True).equals(
+            tail.sort_values('pm').reset_index(drop=True)):
+        # only the boundary rows came back, unchanged - the usual warm refresh
+        return history
+    return pd.concat([history.iloc[:boundary], merged], ignore_index=True)
+
+
+def shares_as_of(keys, history):
+    """
+    Shares in effect at each (timestamp, pm) of keys: the pm's last history row at or before the timestamp
+
+    Args:
+        keys: DataFrame with timestamp, pm - any number of rows, any order
+        history: output of build_history()
+
+    Returns:
+        float ndarray aligned with keys, NaN where the pm had no shares yet
+    """
+    out = np.full(len(keys), np.nan)
+    if keys.empty or history.empty:
+        return out
+    left = pd.DataFrame({
+        'timestamp': pd.to_datetime(keys['timestamp'], utc=True).astype(TS_DTYPE).to_numpy(),
+        'pm': keys['pm'].to_numpy(),
+        'position': np.arange(len(keys)),
+    }).sort_values('timestamp', kind='stable')
+    matched = pd.merge_asof(left, history, on='timestamp', by='pm', direction='backward')
+    out[matched['position'].to_numpy()] = matched['shares'].to_numpy(dtype='float64', na_value=np.nan)
+    return out
+
+
+class SharesCache:
+    """
+    Shares history index kept up to date with a timestamp watermark
+
+    The first refresh loads the whole table (backfill looks up shares as of past minutes),
+    later refreshes only fetch rows with timestamp >= watermark and merge them into the tail.
+    The boundary rows are re-read on purpose so rows inserted with the same timestamp after
+    the last refresh are not missed.
+    """
+
+    def __init__(self):
+        self.history = None  # output of build_history()
+        self.watermark = None
+
+    def refresh(self):
+        rows = storage.get_store().shares_since(EPOCH if self.history is None else self.watermark)
+        if rows.empty:
+            # cold: nothing to index yet, the next refresh retries the full load
+            return
+        if self.history is None:
+            self.history = build_history(rows)
+        else:
+            self.history = append_history(self.history, rows)
+        self.watermark = self.history['timestamp'].iloc[-1]
+
+    def get_history(self):
+        self.refresh()
+        if self.history is None:
+            return build_history(pd.DataFrame(columns=SHARES_COLUMNS))
+        return self.history
+
+    def get_latest_shares(self):
+        """
+        Returns:
+            DataFrame with columns pm, timestamp, shares - one row per pm
+        """
+        latest = self.get_history().drop_duplicates(subset='pm', keep='last')
+        return latest[['pm', 'timestamp', 'shares']].reset_index(drop=True)
+
+    def invalidate(self):
+        self.history = None
+        self.watermark = None
+
+
+_cache = SharesCache()
+
+
+def get_shares_history():
+    """
+    Sorted shares history from the process-wide cache, for shares_as_of()
+    """
+    return _cache.get_history()
+
+
+def get_latest_shares():
+    """
+    Latest shares per pm from the process-wide cache
+    """
+    return _cache.get_latest_shares()
@@ -0,0 +1,650 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+import db_utils
+import metrics
+
+
+# Storage backends for the NAV pipeline. Every read / write the tick, backfill and
+# daemon do goes through one of these, picked with NAV_STORE:
+#   NAV_STORE unset / 'postgres'   -> PostgresStore (db_utils, the production database)
+#   NAV_STORE='sqlite:<path>'      -> SQLiteStore, an embedded single-file copy for offline
+#                                     runs (profiling, backfill dry runs, tests)
+#
+# A local copy of production can be taken with
+#   python storage.py --to local.db --start 2026-10-17T00:00 --end 2026-10-17T23:59
+
+NAV_KEY_COLUMNS = ['timestamp', 'pm']
+NAV_VALUE_COLUMNS = ['balance', 'shares', 'nav', 'is_fallback']
+
+
+class StoreReadError(Exception):
+    """
+    A read that failed, for callers that must not mistake a failure for "no rows" (see balance_range)
+    """
+
+
+class NavStore(ABC):
+    """
+    Data access used by the NAV pipeline
+
+    Reads return DataFrames with tz-aware UTC timestamps, writes return True if committed.
+    A backend must implement every method, it cannot be instantiated otherwise.
+    """
+
+    @abstractmethod
+    def balances_at(self, curr, curr_hour, pms=None):
+        """balance_all_consolidated rows stamped exactly curr or curr_hour (only for pms if given): timestamp, pm, balance"""
+
+    @abstractmethod
+    def latest_balances(self):
+        """Latest balance row per pm: pm, timestamp, balance (empty if not available)"""
+
+    @abstractmethod
+    def fallback_balances(self, pms, curr_timestamp, max_lookback_hours=2):
+        """Latest non-null balance per pm within the lookback: timestamp, pm, balance (pms without data absent)"""
+
+    @abstractmethod
+    def balance_range(self, start, end):
+        """
+        Every balance row with start <= timestamp <= end: timestamp, pm, balance.
+        Raises StoreReadError if the read failed (an empty frame means no rows).
+        """
+
+    @abstractmethod
+    def nav_rollup(self, curr, curr_hour):
+        """
+        Fresh balances of the tick rolled up by the database: level, node, timestamp, balance, is_inactive.
+        Level 'pm' rows are the PMs with fresh data (presence), pm_group / group rows are keyed by
+        (timestamp, node), fund rows by node with the max timestamp. No fallback, no aliases.
+        """
+
+    @abstractmethod
+    def shares_since(self, since):
+        """shares_table rows with timestamp >= since, oldest first"""
+
+    @abstractmethod
+    def pm_mapping(self):
+        """pm_mapping: pm, pm_group, group, fund, active, if_btc, update_frequency"""
+
+    @abstractmethod
+    def pm_mapping_fingerprint(self):
+        """(row count, digest) of pm_mapping, None if unavailable"""
+
+    @abstractmethod
+    def publish_rules(self):
+        """
+        publish_rules: node, cadence, enabled.
+        Raises StoreReadError if the read failed (an empty frame means no rules).
+        """
+
+    @abstractmethod
+    def last_nav_timestamp(self):
+        """Latest timestamp in nav_table, None if empty"""
+
+    @abstractmethod
+    def upsert_nav(self, df, update=True, fallback_only=False):
+        """
+        Insert nav rows, on (timestamp, pm) conflict overwrite (update=True) or keep the stored row.
+        fallback_only: only overwrite stored rows computed from fallback balances, with rows that were not
+        """
+
+    @abstractmethod
+    def append_nav(self, df):
+        """Plain insert of nav rows"""
+
+    @abstractmethod
+    def replace_nav_range(self, df, start, end):
+        """Replace the stored rows of df's nodes in [start, end] with df, in one transaction"""
+
+
+# ── Postgres ───────────────────────────────────────────────────────────────────
+
+BALANCE_AT_QUERY = '''
+    SELECT
+        timestamp,
+        pm,
+        balance AS balance
+    FROM
+        balance_all_consolidated
+    WHERE
+        timestamp = %(curr_hour)s OR timestamp = %(curr)s
+    ORDER BY
+        timestamp;
+'''
+
+BALANCE_AT_PMS_QUERY = '''
+    SELECT
+        timestamp,
+        pm,
+        balance
+    FROM
+        balance_all_consolidated
+    WHERE
+        (timestamp = %(curr_hour)s OR timestamp = %(curr)s)
+        AND pm = ANY(%(pms)s)
+    ORDER BY
+        timestamp;
+'''
+
+FALLBACK_BATCH_QUERY = '''
+    SELECT DISTINCT ON (pm)
+        timestamp,
+        pm,
+        balance
+    FROM
+        balance_all_consolidated
+    WHERE
+        pm = ANY(%(pms)s)
+        AND timestamp >= %(lookback_start)s
+        AND timestamp <= %(curr_timestamp)s
+        AND balance IS NOT NULL
+    ORDER BY
+        pm, timestamp DESC;
+'''
+
+BALANCE_RANGE_QUERY = '''
+    SELECT
+        timestamp,
+        pm,
+        balance
+    FROM
+        balance_all_consolidated
+    WHERE
+        timestamp >= %(start)s
+        AND timestamp <= %(end)s;
+'''
+
+SHARES_SINCE_QUERY = '''
+    SELECT
+        timestamp,
+        pm,
+        shares
+    FROM
+        shares_table
+    WHERE
+        timestamp >= %(since)s
+    ORDER BY
+        timestamp;
+'''
+
+# freshness rule + pm_group / group / fund sums in one statement, (pm, timestamp) gives back which PMs were present
+NAV_ROLLUP_QUERY = '''
+    WITH mapping AS (
+        SELECT DISTINCT pm, pm_group, "group", fund, active, update_frequency FROM pm_mapping
+    ),
+    latest AS (
+        SELECT DISTINCT ON (pm)
+            timestamp,
+            pm,
+            balance
+        FROM
+            balance_all_consolidated
+        WHERE
+            timestamp = %(curr_hour)s OR timestamp = %(curr)s
+        ORDER BY
+            pm, timestamp DESC
+    ),
+    fresh AS (
+        SELECT l.timestamp, l.pm, l.balance, m.pm_group, m."group", m.fund, m.active
+        FROM latest l
+        LEFT JOIN mapping m ON m.pm = l.pm
+        WHERE CASE m.update_frequency
+            WHEN 'minute' THEN l.timestamp = %(curr)s
+            WHEN 'hour' THEN l.timestamp = %(curr_hour)s
+            ELSE true
+        END
+    ),
+    rolled AS (
+        SELECT
+            CASE
+                WHEN GROUPING(pm) = 0 THEN 'pm'
+                WHEN GROUPING(pm_group) = 0 THEN 'pm_group'
+                WHEN GROUPING("group") = 0 THEN 'group'
+                ELSE 'fund'
+            END AS level,
+            CASE
+                WHEN GROUPING(pm) = 0 THEN pm
+                WHEN GROUPING(pm_group) = 0 THEN pm_group
+                WHEN GROUPING("group") = 0 THEN "group"
+                ELSE fund
+            END AS node,
+            max(timestamp) AS timestamp,
+            sum(coalesce(balance, 0))::double precision AS balance,
+            coalesce(bool_or(active IS FALSE), false) AS is_inactive
+        FROM
+            fresh
+        GROUP BY
+            GROUPING SETS ((pm, timestamp), (pm_group, timestamp), ("group", timestamp), (fund))
+    )
+    SELECT level, node, timestamp, balance, is_inactive FROM rolled WHERE node IS NOT NULL;
+'''
+
+PM_MAPPING_QUERY = 'SELECT pm, pm_group, "group", fund, active, if_btc, update_frequency FROM pm_mapping;'
+
+# row count plus a server-side hash of every row - one tiny row back instead of the whole table
+PM_MAPPING_FINGERPRINT_QUERY = '''
+    SELECT
+        count(*) AS row_count,
+        md5(coalesce(string_agg(m::text, '|' ORDER BY m::text), '')) AS digest
+    FROM
+        pm_mapping m;
+'''
+
+PUBLISH_RULES_QUERY = 'SELECT node, cadence, enabled FROM publish_rules;'
+
+LAST_NAV_QUERY = 'SELECT max(timestamp) AS last_written FROM nav_table;'
+
+# statements run on every tick, prepared once per pooled connection (see db_utils.register_statement)
+db_utils.register_statement('nav_balance_at', BALANCE_AT_QUERY, {'curr': 'timestamptz', 'curr_hour': 'timestamptz'})
+db_utils.register_statement('nav_balance_at_pms', BALANCE_AT_PMS_QUERY,
+                            {'curr': 'timestamptz', 'curr_hour': 'timestamptz', 'pms': 'text[]'})
+db_utils.register_statement('nav_fallback_batch', FALLBACK_BATCH_QUERY,
+                            {'pms': 'text[]', 'lookback_start': 'timestamptz', 'curr_timestamp': 'timestamptz'})
+db_utils.register_statement('nav_rollup', NAV_ROLLUP_QUERY, {'curr': 'timestamptz', 'curr_hour': 'timestamptz'})
+db_utils.register_statement('nav_shares_since', SHARES_SINCE_QUERY, {'since': 'timestamptz'})
+db_utils.register_statement('nav_pm_mapping_fingerprint', PM_MAPPING_FINGERPRINT_QUERY)
+db_utils.register_statement('nav_last_written', LAST_NAV_QUERY)
+
+
+def utc_timestamp(value):
+    """
+    pd.Timestamp in UTC, naive values are taken as UTC
+    """
+    ts = pd.Timestamp(value)
+    return ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+
+
+def _with_timestamps(df, column='timestamp'):
+    if not df.empty:
+        df[column] = pd.to_datetime(df[column], utc=True)
+    return df
+
+
+class PostgresStore(NavStore):
+    """
+    The production database, through the pooled helpers in db_utils
+    """
+
+    def balances_at(self, curr, curr_hour, pms=None):
+        if pms is None:
+            return db_utils.get_prepared('nav_balance_at', {'curr': curr, 'curr_hour': curr_hour})
+        params = {'curr': curr, 'curr_hour': curr_hour, 'pms': sorted(pms)}
+        return db_utils.get_prepared('nav_balance_at_pms', params)
+
+    def latest_balances(self):
+        return db_utils.get_latest_balances()
+
+    def fallback_balances(self, pms, curr_timestamp, max_lookback_hours=2):
+        params = {'pms': sorted(pms), 'lookback_start': curr_timestamp - timedelta(hours=max_lookback_hours),
+                  'curr_timestamp': curr_timestamp}
+        return _with_timestamps(db_utils.get_prepared('nav_fallback_batch', params))
+
+    def balance_range(self, start, end):
+        try:
+            chunks = list(db_utils.iter_db_table(BALANCE_RANGE_QUERY, params={'start': start, 'end': end},
+                                                 raise_errors=True))
+        except Exception as e:
+            raise StoreReadError(f'balance_range {start} -> {end} failed: {e}') from e
+        if not chunks:
+            return pd.DataFrame(columns=['timestamp', 'pm', 'balance'])
+        return pd.concat(chunks, ignore_index=True)
+
+    def nav_rollup(self, curr, curr_hour):
+        return _with_timestamps(db_utils.get_prepared('nav_rollup', {'curr': curr, 'curr_hour': curr_hour}))
+
+    def shares_since(self, since):
+        return _with_timestamps(db_utils.get_prepared('nav_shares_since', {'since': since}))
+
+    def pm_mapping(self):
+        return db_utils.get_db_table(PM_MAPPING_QUERY)
+
+    def pm_mapping_fingerprint(self):
+        fp = db_utils.get_prepared('nav_pm_mapping_fingerprint')
+        if fp.empty:
+            return None
+        return (int(fp.iloc[0]['row_count']), fp.iloc[0]['digest'])
+
+    def publish_rules(self):
+        try:
+            return db_utils.get_db_table(PUBLISH_RULES_QUERY, raise_errors=True)
+        except Exception as e:
+            raise StoreReadError(f'publish_rules failed: {e}') from e
+
+    def last_nav_timestamp(self):
+        last = db_utils.get_prepared('nav_last_written')
+        if last.empty or pd.isna(last.iloc[0]['last_written']):
+            return None
+        return utc_timestamp(last.iloc[0]['last_written'])
+
+    def upsert_nav(self, df, update=True, fallback_only=False):
+        return db_utils.upsert_df('nav_table', df, NAV_KEY_COLUMNS, update=update,
+                                  update_flag='is_fallback' if fallback_only else None)
+
+    def append_nav(self, df):
+        return db_utils.df_copy_to_table('nav_table', df)
+
+    def replace_nav_range(self, df, start, end):
+        delete_query = 'DELETE FROM nav_table WHERE timestamp >= %(start)s AND timestamp <= %(end)s AND pm = ANY(%(pms)s);'
+        delete_params = {'start': start, 'end': end, 'pms': sorted(df['pm'].unique())}
+        # delete + COPY in one transaction so a failed write never leaves a hole
+        return db_utils.df_copy_to_table('nav_table', df, delete_query=delete_query, delete_params=delete_params)
+
+
+# ── SQLite ─────────────────────────────────────────────────────────────────────
+
+# timestamps are stored as fixed-width UTC text, so equality and range filters work on the raw column
+SQLITE_TS_FORMAT = '%Y-%m-%d %H:%M:%S.%f+00:00'
+
+SQLITE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS balance_all_consolidated (timestamp TEXT NOT NULL, pm TEXT NOT NULL, balance REAL);
+    CREATE INDEX IF NOT EXISTS balance_all_consolidated_timestamp_idx ON balance_all_consolidated (timestamp);
+    CREATE INDEX IF NOT EXISTS balance_all_consolidated_pm_timestamp_idx ON balance_all_consolidated (pm, timestamp);
+    CREATE TABLE IF NOT EXISTS shares_table (timestamp TEXT NOT NULL, pm TEXT NOT NULL, shares REAL);
+    CREATE INDEX IF NOT EXISTS shares_table_timestamp_idx ON shares_table (timestamp);
+    CREATE INDEX IF NOT EXISTS shares_table_pm_timestamp_idx ON shares_table (pm, timestamp);
+    CREATE TABLE IF NOT EXISTS pm_mapping (
+        pm TEXT, pm_group TEXT, "group" TEXT, fund TEXT, active INTEGER, if_btc INTEGER, update_frequency TEXT
+    );
+    CREATE TABLE IF NOT EXISTS publish_rules (
+        node TEXT PRIMARY KEY, cadence TEXT NOT NULL DEFAULT 'minute', enabled INTEGER NOT NULL DEFAULT 1
+    );
+    CREATE TABLE IF NOT EXISTS nav_table (
+        timestamp TEXT NOT NULL, pm TEXT NOT NULL, balance REAL, shares REAL, nav REAL, is_fallback INTEGER,
+        UNIQUE (timestamp, pm)
+    );
+'''
+
+SQLITE_BALANCE_AT_QUERY = '''
+    SELECT timestamp, pm, balance FROM balance_all_consolidated
+    WHERE timestamp = :curr_hour OR timestamp = :curr
+    ORDER BY timestamp;
+'''
+
+SQLITE_BALANCE_AT_PMS_QUERY = '''
+    SELECT timestamp, pm, balance FROM balance_all_consolidated
+    WHERE (timestamp = :curr_hour OR timestamp = :curr) AND pm IN (SELECT value FROM json_each(:pms))
+    ORDER BY timestamp;
+'''
+
+# the (pm, timestamp) index answers this without a separate state table
+SQLITE_LATEST_BALANCES_QUERY = 'SELECT pm, MAX(timestamp) AS timestamp, balance FROM balance_all_consolidated GROUP BY pm;'
+
+# SQLite returns the row holding the MAX() for the other bare columns
+SQLITE_FALLBACK_BATCH_QUERY = '''
+    SELECT MAX(timestamp) AS timestamp, pm, balance FROM balance_all_consolidated
+    WHERE pm IN (SELECT value FROM json_each(:pms))
+        AND timestamp >= :lookback_start
+        AND timestamp <= :curr_timestamp
+        AND balance IS NOT NULL
+    GROUP BY pm;
+'''
+
+SQLITE_BALANCE_RANGE_QUERY = '''
+    SELECT timestamp, pm, balance FROM balance_all_consolidated
+    WHERE timestamp >= :start AND timestamp <= :end;
+'''
+
+# no GROUPING SETS in SQLite - one GROUP BY per level glued together with UNION ALL
+SQLITE_NAV_ROLLUP_QUERY = '''
+    WITH mapping AS (
+        SELECT DISTINCT pm, pm_group, "group", fund, active, update_frequency FROM pm_mapping
+    ),
+    latest AS (
+        SELECT MAX(timestamp) AS timestamp, pm, balance FROM balance_all_consolidated
+        WHERE timestamp = :curr_hour OR timestamp = :curr
+        GROUP BY pm
+    ),
+    fresh AS (
+        SELECT l.timestamp, l.pm, COALESCE(l.balance, 0) AS balance, m.pm_group, m."group", m.fund,
+            COALESCE(m.active = 0, 0) AS inactive
+        FROM latest l
+        LEFT JOIN mapping m ON m.pm = l.pm
+        WHERE CASE m.update_frequency
+            WHEN 'minute' THEN l.timestamp = :curr
+            WHEN 'hour' THEN l.timestamp = :curr_hour
+            ELSE 1
+        END
+    )
+    SELECT 'pm' AS level, pm AS node, timestamp, SUM(balance) AS balance, MAX(inactive) AS is_inactive
+    FROM fresh GROUP BY pm, timestamp
+    UNION ALL
+    SELECT 'pm_group', pm_group, timestamp, SUM(balance), MAX(inactive)
+    FROM fresh WHERE pm_group IS NOT NULL GROUP BY pm_group, timestamp
+    UNION ALL
+    SELECT 'group', "group", timestamp, SUM(balance), MAX(inactive)
+    FROM fresh WHERE "group" IS NOT NULL GROUP BY "group", timestamp
+    UNION ALL
+    SELECT 'fund', fund, MAX(timestamp), SUM(balance), MAX(inactive)
+    FROM fresh WHERE fund IS NOT NULL GROUP BY fund;
+'''
+
+SQLITE_SHARES_SINCE_QUERY = 'SELECT timestamp, pm, shares FROM shares_table WHERE timestamp >= :since ORDER BY timestamp;'
+
+
+def sqlite_ts(value):
+    """
+    Timestamp in the text form SQLiteStore stores (naive values are taken as UTC)
+    """
+    return utc_timestamp(value).strftime(SQLITE_TS_FORMAT)
+
+
+class SQLiteStore(NavStore):
+    """
+    Embedded single-file store with the same tables as production
+
+    One connection shared by every thread, serialized with a lock.
+    Use ':memory:' for a throwaway store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SQLITE_SCHEMA)
+
+    def _read(self, query, params=None, timestamp_columns=('timestamp',), raise_errors=False):
+        try:
+            with metrics.db_call('sqlite_read') as m, self.lock:
+                df = pd.read_sql_query(query, self.conn, params=params)
+                m['rows'], m['bytes'] = len(df), metrics.frame_bytes(df)
+        except Exception as e:
+            # same contract as db_utils.get_db_table - errors come back as an empty frame
+            print(f'Error encountered reading {self.path} with this query {query}: ', e)
+            if raise_errors:
+                raise StoreReadError(str(e)) from e
+            return pd.DataFrame()
+        for column in timestamp_columns:
+            df[column] = pd.to_datetime(df[column], utc=True, format='ISO8601')
+        return df
+
+    def _rows(self, df, columns):
+        """
+        DataFrame -> list of tuples in the stored representation
+        """
+        out = df[columns].astype(object)
+        for col in columns:
+            source = df[col]
+            if pd.api.types.is_datetime64_any_dtype(source):
+                utc = source.dt.tz_convert('UTC') if source.dt.tz is not None else source.dt.tz_localize('UTC')
+                out[col] = utc.dt.strftime(SQLITE_TS_FORMAT)
+            elif pd.api.types.is_bool_dtype(source):
+                out[col] = source.astype(int)
+        out = out.where(pd.notna(df[columns]), None)
+        return list(out.itertuples(index=False, name=None))
+
+    def _write(self, statements):
+        """
+        Run (sql, rows) pairs in one transaction
+        """
+        with metrics.db_call('sqlite_write') as m, self.lock:
+            try:
+                with self.conn:
+                    for query, rows in statements:
+                        if isinstance(rows, list):
+                            self.conn.executemany(query, rows)
+                            m['rows'] = m.get('rows', 0) + len(rows)
+                        else:
+                            self.conn.execute(query, rows)
+                return True
+            except sqlite3.Error as e:
+                print(f'Error encountered when writing to {self.path}', e)
+                return False
+
+    def load_frame(self, table_name, df, replace=False):
+        """
+        Bulk insert df (columns named as in the table) - used to seed a local copy
+        """
+        columns = list(df.columns)
+        insert = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            table_name, ', '.join(f'"{c}"' for c in columns), ', '.join('?' * len(columns))
+        )
+        statements = [(f'DELETE FROM {table_name}', ())] if replace else []
+        statements.append((insert, self._rows(df, columns)))
+        return self._write(statements)
+
+    def balances_at(self, curr, curr_hour, pms=None):
+        params = {'curr': sqlite_ts(curr), 'curr_hour': sqlite_ts(curr_hour)}
+        if pms is None:
+            return self._read(SQLITE_BALANCE_AT_QUERY, params)
+        return self._read(SQLITE_BALANCE_AT_PMS_QUERY, dict(params, pms=json.dumps(sorted(pms))))
+
+    def latest_balances(self):
+        return self._read(SQLITE_LATEST_BALANCES_QUERY)
+
+    def fallback_balances(self, pms, curr_timestamp, max_lookback_hours=2):
+        params = {'pms': json.dumps(sorted(pms)),
+                  'lookback_start': sqlite_ts(curr_timestamp - timedelta(hours=max_lookback_hours)),
+                  'curr_timestamp': sqlite_ts(curr_timestamp)}
+        return self._read(SQLITE_FALLBACK_BATCH_QUERY, params)
+
+    def balance_range(self, start, end):
+        return self._read(SQLITE_BALANCE_RANGE_QUERY, {'start': sqlite_ts(start), 'end': sqlite_ts(end)},
+                          raise_errors=True)
+
+    def nav_rollup(self, curr, curr_hour):
+        rows = self._read(SQLITE_NAV_ROLLUP_QUERY, {'curr': sqlite_ts(curr), 'curr_hour': sqlite_ts(curr_hour)})
+        if not rows.empty:
+            rows['is_inactive'] = rows['is_inactive'].astype(bool)
+        return rows
+
+    def shares_since(self, since):
+        return self._read(SQLITE_SHARES_SINCE_QUERY, {'since': sqlite_ts(since)})
+
+    def pm_mapping(self):
+        frame = self._read('SELECT pm, pm_group, "group", fund, active, if_btc, update_frequency FROM pm_mapping;',
+                           timestamp_columns=())
+        for col in ('active', 'if_btc'):
+            frame[col] = frame[col].map({1: True, 0: False})
+        return frame
+
+    def pm_mapping_fingerprint(self):
+        # no server-side md5 in SQLite - the table is small and local, hash it here
+        with self.lock:
+            rows = self.conn.execute('SELECT * FROM pm_mapping ORDER BY 1, 2, 3, 4').fetchall()
+        return (len(rows), hashlib.md5(repr(rows).encode()).hexdigest())
+
+    def publish_rules(self):
+        return self._read('SELECT node, cadence, enabled FROM publish_rules;', timestamp_columns=(), raise_errors=True)
+
+    def last_nav_timestamp(self):
+        with self.lock:
+            (last,) = self.conn.execute('SELECT max(timestamp) FROM nav_table;').fetchone()
+        return None if last is None else utc_timestamp(last)
+
+    def _nav_insert(self, on_conflict=''):
+        columns = NAV_KEY_COLUMNS + NAV_VALUE_COLUMNS
+        return 'INSERT INTO nav_table ({}) VALUES ({}) {}'.format(
+            ', '.join(columns), ', '.join('?' * len(columns)), on_conflict
+        )
+
+    def upsert_nav(self, df, update=True, fallback_only=False):
+        if df.empty:
+            return True
+        if update:
+            action = 'DO UPDATE SET ' + ', '.join(f'{c} = excluded.{c}' for c in NAV_VALUE_COLUMNS)
+            if fallback_only:
+                action += ' WHERE nav_table.is_fallback AND NOT excluded.is_fallback'
+        else:
+            action = 'DO NOTHING'
+        df = df.drop_duplicates(subset=NAV_KEY_COLUMNS, keep='last')
+        query = self._nav_insert(f'ON CONFLICT ({", ".join(NAV_KEY_COLUMNS)}) {action}')
+        return self._write([(query, self._rows(df, NAV_KEY_COLUMNS + NAV_VALUE_COLUMNS))])
+
+    def append_nav(self, df):
+        if df.empty:
+            return True
+        return self._write([(self._nav_insert(), self._rows(df, NAV_KEY_COLUMNS + NAV_VALUE_COLUMNS))])
+
+    def replace_nav_range(self, df, start, end):
+        delete = ('DELETE FROM nav_table WHERE timestamp >= ? AND timestamp <= ? '
+                  'AND pm IN (SELECT value FROM json_each(?));')
+        params = (sqlite_ts(start), sqlite_ts(end), json.dumps(sorted(df['pm'].unique())))
+        return self._write([(delete, params), (self._nav_insert(), self._rows(df, NAV_KEY_COLUMNS + NAV_VALUE_COLUMNS))])
+
+
+def snapshot_to_sqlite(path, start, end, source=None):
+    """
+    Copy what the pipeline needs for [start, end] from source (default: Postgres) into a local SQLite file:
+    pm_mapping, publish_rules, all of shares_table and the balances of the range
+    """
+    source = source or PostgresStore()
+    local = SQLiteStore(path)
+    local.load_frame('pm_mapping', source.pm_mapping(), replace=True)
+    local.load_frame('publish_rules', source.publish_rules(), replace=True)
+    local.load_frame('shares_table', source.shares_since(datetime(1970, 1, 1, tzinfo=timezone.utc)), replace=True)
+    balances = source.balance_range(start, end)
+    local.load_frame('balance_all_consolidated', balances, replace=True)
+    print(f'copied {len(balances)} balance rows for {start} -> {end} into {path}')
+    return local
+
+
+_store = None
+
+
+def store_from_url(url):
+    """
+    'postgres' or 'sqlite:<path>'
+    """
+    if url in (None, '', 'postgres'):
+        return PostgresStore()
+    if url.startswith('sqlite:'):
+        return SQLiteStore(url[len('sqlite:'):])
+    raise ValueError(f'unknown NAV_STORE {url!r}')
+
+
+def get_store():
+    """
+    Process-wide store, chosen by NAV_STORE on first use
+    """
+    global _store
+    if _store is None:
+        _store = store_from_url(os.environ.get('NAV_STORE'))
+    return _store
+
+
+def set_store(store):
+    """
+    Replace the process-wide store (offline runs, benchmarks, tests)
+    """
+    global _store
+    _store = store
+
+
+if __name__ == '__main__':
+    import backfill
+
+    parser = argparse.ArgumentParser(description='Copy the NAV inputs for a range into a local SQLite file')
+    parser.add_argument('--to', required=True, help='SQLite file to write')
+    parser.add_argument('--start', required=True, type=backfill.parse_utc, help='first minute, ISO format (UTC if no offset)')
+    parser.add_argument('--end', required=True, type=backfill.parse_utc, help='last minute, ISO format (UTC if no offset)')
+    parser.add_argument('--lookback-hours', type=float, default=2, help='extra history before start for fallback')
+    args = parser.parse_args()
+
+    snapshot_to_sqlite(args.to, args.start - timedelta(hours=args.lookback_hours), args.end)
@@ -1,15 +1,17 @@
 import credentials
 import requests
 
-def send_notif(message, chat_id='-5039629904'):
+def send_notif(message, chat_id='-5039629904', timeout=10):
     # chat_id = '6774030856' # Ann chat
     # chat_id = '-5039629904' # data pipeline alerts
     bot_key =  credentials.TELEGRAM_BOT_TOKEN # '7184236096:AAHlBC4MeqckU4x2B5R6U7Aie96eyMdCnpk'
     
-    send_message_url = f'https://api.telegram.org/bot{bot_key}/sendMessage?chat_id={chat_id}&text={message}'
-    res = requests.post(send_message_url)
+    send_message_url = f'https://api.telegram.org/bot{bot_key}/sendMessage'
+    # params are url-encoded by requests, so messages with &, # or + arrive intact
+    res = requests.post(send_message_url, params={'chat_id': chat_id, 'text': message}, timeout=timeout)
 
     if res.ok:
         print('Message sent successfully!')
     else:
-        print('message not sent')
\ No newline at end of file
+        print('message not sent')
+    return res.ok
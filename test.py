@@ -2,9 +2,11 @@ import json
 from datetime import datetime, timedelta, timezone
 import db_utils
 import pandas as pd
+import publish_rules
 import credentials
 import time
 import sheet_utils
+import storage
 import telegram
 
 
@@ -20,27 +22,8 @@ def get_fallback_balance_data(pm, curr_timestamp, max_lookback_hours=2):
     """
     Get the most recent valid balance data for a PM within the lookback period
     """
-    lookback_start = curr_timestamp - timedelta(hours=max_lookback_hours)
-    
-    query = f'''
-        SELECT 
-            timestamp, 
-            pm, 
-            balance 
-        FROM 
-            balance_all_consolidated
-        WHERE 
-            pm = '{pm}' 
-            AND timestamp >= '{lookback_start}'
-            AND timestamp <= '{curr_timestamp}'
-            AND balance IS NOT NULL
-        ORDER BY 
-            timestamp DESC
-        LIMIT 1;
-    '''
-    
-    fallback_data = db_utils.get_db_table(query=query)
-    return fallback_data
+    # the batched fallback statement registered by storage, for one pm
+    return storage.get_store().fallback_balances([pm], curr_timestamp, max_lookback_hours)
 
 
 def validate_and_enhance_balance_data(balance_df, curr_timestamp, curr_hour):
@@ -154,18 +137,18 @@ def main():
         pm_mapping_query = 'SELECT pm, pm_group, "group", fund, active, if_btc, update_frequency FROM pm_mapping;'
         grouping_df = db_utils.get_db_table(pm_mapping_query)
 
-        query = f'''SELECT 
+        query = '''SELECT 
             timestamp, 
             pm, 
             balance AS balance 
         FROM 
             balance_all_consolidated
         WHERE 
-            timestamp = '{curr_hour}' OR timestamp = '{curr}'
+            timestamp = %(curr_hour)s OR timestamp = %(curr)s
         ORDER BY 
             timestamp;'''
 
-        balance = db_utils.get_db_table(query=query)
+        balance = db_utils.get_db_table(query=query, params={'curr': curr, 'curr_hour': curr_hour})
         balance['timestamp'] = pd.to_datetime(balance['timestamp'])
         balance = balance.loc[balance.groupby('pm')['timestamp'].idxmax()]
 
@@ -242,12 +225,11 @@ def main():
         
         pm_result_df.dropna(inplace=True)
         
-        if curr.minute != 0:
-            print('not including herm, fof if not hour 00')
-            pm_result_df = pm_result_df[~pm_result_df['pm'].isin(['sp1-fof-tangoecho', 'sp1-fof-hermeneutic', 'sp1-fof', 'sp1-cash-cash', 'sp1-cash', 'sp1-fof-northrock', 'sp1-fof-defiance', 'sp2-cash-cash', 'sp2-cash', 'sp3-cash-cash', 'sp3-cash', 'sp2-classb-cash-cash', 'sp2-classb-cash'])]
-        
-        pm_result_df = pm_result_df[pm_result_df['pm'] != 'sp1-sma-robinfunding']
-        pm_result_df = pm_result_df[~pm_result_df['pm'].isin(['sp2', 'sp2-gross', 'sp2-sma', 'sp2-sma-romeo'])]
+        # publish / exclusion rules come from the publish_rules table
+        excluded = publish_rules.get_rules().excluded_nodes(curr)
+        if excluded:
+            print(f'not published this minute (publish_rules): {sorted(excluded)}')
+        pm_result_df = pm_result_df[~pm_result_df['pm'].isin(excluded)]
 
         print('Final pm_result_df with fallback and inactive indicators:')
         with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
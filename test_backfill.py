@@ -0,0 +1,67 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+
+from backfill import select_balances
+from pm_mapping import build_snapshot
+from test_nav_agg import PM_MAPPING
+
+
+START = datetime(2026, 3, 11, 10, 0, 0, tzinfo=timezone.utc)
+
+
+def _balances(rows):
+    df = pd.DataFrame(rows, columns=['timestamp', 'pm', 'balance'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True).astype('datetime64[ns, UTC]')
+    return df
+
+
+class TestSelectBalances(unittest.TestCase):
+
+    def setUp(self):
+        self.mapping = build_snapshot(PM_MAPPING.copy())
+        self.ticks = pd.date_range(START, START + timedelta(minutes=2), freq='min')
+
+    def _rows(self, enhanced, pm):
+        return enhanced[enhanced['pm'] == pm].sort_values('tick').reset_index(drop=True)
+
+    def test_minute_pm_missing_a_tick_falls_back_to_previous_minute(self):
+        balances = _balances([
+            (START, 'pm_alpha', 100.0),
+            (START + timedelta(minutes=2), 'pm_alpha', 102.0),
+        ])
+        enhanced, report = select_balances(balances, self.mapping, self.ticks)
+
+        alpha = self._rows(enhanced, 'pm_alpha')
+        self.assertEqual(list(alpha['balance']), [100.0, 100.0, 102.0])
+        self.assertEqual(list(alpha['is_fallback']), [False, True, False])
+        # fallback rows 的 timestamp 應更新為該 tick
+        self.assertEqual(alpha.loc[1, 'timestamp'], START + timedelta(minutes=1))
+
+    def test_hour_pm_uses_hour_row_for_every_tick(self):
+        balances = _balances([(START, 'pm_charlie', 500.0)])
+        enhanced, _ = select_balances(balances, self.mapping, self.ticks)
+
+        charlie = self._rows(enhanced, 'pm_charlie')
+        self.assertEqual(len(charlie), 3)
+        self.assertTrue((charlie['timestamp'] == START).all())
+        self.assertFalse(charlie['is_fallback'].any())
+
+    def test_inactive_pm_never_falls_back(self):
+        balances = _balances([(START, 'pm_delta', 10.0)])
+        enhanced, report = select_balances(balances, self.mapping, self.ticks)
+
+        delta = self._rows(enhanced, 'pm_delta')
+        self.assertEqual(len(delta), 1)
+        self.assertTrue(delta.loc[0, 'is_inactive'])
+
+    def test_report_counts_completely_missing_active_pms(self):
+        enhanced, report = select_balances(_balances([]), self.mapping, self.ticks)
+
+        self.assertTrue(enhanced.empty)
+        # pm_alpha, pm_bravo, pm_charlie 是 active
+        self.assertEqual(list(report['completely_missing']), [3, 3, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+import pandas as pd
+
+import balance_buffer
+import storage
+from storage import SQLiteStore
+
+
+CURR = datetime(2026, 3, 11, 10, 35, 0, tzinfo=timezone.utc)
+MINUTE = timedelta(minutes=1)
+
+
+def _balances(rows):
+    df = pd.DataFrame(rows, columns=['timestamp', 'pm', 'balance'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+    return df
+
+
+BALANCES = _balances([
+    (CURR - 3 * MINUTE, 'sp1', 100.0),
+    (CURR - 2 * MINUTE, 'sp1', 101.0),
+    (CURR - 2 * MINUTE, 'sp2', None),  # NULL balances are never a fallback
+    (CURR - 90 * MINUTE, 'sp2', 50.0),
+    (CURR - 150 * MINUTE, 'sp3', 70.0),  # outside the 2 hour lookback
+])
+
+
+def _sorted(df):
+    return df[['timestamp', 'pm', 'balance']].sort_values('pm').reset_index(drop=True)
+
+
+class TestBalanceBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.store = SQLiteStore(':memory:')
+        self.store.load_frame('balance_all_consolidated', BALANCES)
+        storage.set_store(self.store)
+
+    def tearDown(self):
+        storage.set_store(None)
+
+    def test_fallback_matches_the_query(self):
+        buffer = balance_buffer.BalanceBuffer()
+        buffer.load(CURR)
+        pms = {'sp1', 'sp2', 'sp3', 'sp4'}
+        with mock.patch.object(self.store, 'fallback_balances', wraps=self.store.fallback_balances) as query:
+            found = buffer.fallback_balances(pms, CURR)
+            query.assert_not_called()
+        pd.testing.assert_frame_equal(_sorted(found), _sorted(self.store.fallback_balances(pms, CURR)), check_dtype=False)
+        # as of an earlier minute, the sample before it
+        self.assertEqual(buffer.fallback_balances({'sp1'}, CURR - 3 * MINUTE)['balance'].tolist(), [100.0])
+
+    def test_fed_ticks_need_no_query_and_gaps_are_filled(self):
+        buffer = balance_buffer.BalanceBuffer()
+        buffer.load(CURR)
+        buffer.observe(_balances([(CURR + MINUTE, 'sp1', 102.0)]), CURR + MINUTE)
+        with mock.patch.object(self.store, 'balance_range', wraps=self.store.balance_range) as query:
+            self.assertEqual(buffer.fallback_balances({'sp1'}, CURR + MINUTE)['balance'].tolist(), [102.0])
+            query.assert_not_called()
+
+            # a minute written but not fed - read once with a range query, then served from memory
+            self.store.load_frame('balance_all_consolidated', _balances([(CURR + 3 * MINUTE, 'sp1', 103.0)]))
+            self.assertEqual(buffer.fallback_balances({'sp1'}, CURR + 5 * MINUTE)['balance'].tolist(), [103.0])
+            self.assertEqual(buffer.fallback_balances({'sp1'}, CURR + 2 * MINUTE)['balance'].tolist(), [102.0])
+            self.assertEqual(query.call_count, 1)
+
+    def test_ring_overwrites_oldest(self):
+        buffer = balance_buffer.BalanceBuffer(samples_per_hour=2)  # 6 samples per pm
+        buffer.load(CURR)
+        for i in range(1, 7):
+            buffer.observe(_balances([(CURR + i * MINUTE, 'sp1', 200.0 + i)]), CURR + i * MINUTE)
+        row = buffer.rows['sp1']
+        self.assertEqual(buffer.size[row], 6)
+        self.assertEqual(buffer.fallback_balances({'sp1'}, CURR + 4 * MINUTE)['balance'].tolist(), [204.0])
+        # the samples before CURR were overwritten - asked from the database
+        with mock.patch.object(self.store, 'fallback_balances', return_value=_balances([])) as query:
+            buffer.fallback_balances({'sp1'}, CURR - MINUTE)
+            query.assert_called_once()
+
+    def test_failed_read_is_not_covered(self):
+        buffer = balance_buffer.BalanceBuffer()
+        failure = storage.StoreReadError('database unreachable')
+        with mock.patch.object(self.store, 'balance_range', side_effect=failure):
+            self.assertFalse(buffer.load(CURR))
+            self.assertIsNone(buffer.covered_to)
+            # nothing was loaded - answered by the query instead of an empty buffer
+            self.assertEqual(buffer.fallback_balances({'sp1'}, CURR)['balance'].tolist(), [101.0])
+
+        self.assertTrue(buffer.load(CURR))
+        self.store.load_frame('balance_all_consolidated', _balances([(CURR + 3 * MINUTE, 'sp1', 103.0)]))
+        with mock.patch.object(self.store, 'balance_range', side_effect=failure):
+            # the gap could not be read - still covered up to CURR only
+            self.assertEqual(buffer.fallback_balances({'sp1'}, CURR + 5 * MINUTE)['balance'].tolist(), [103.0])
+            self.assertEqual(buffer.covered_to, CURR)
+        self.assertEqual(buffer.fallback_balances({'sp1'}, CURR + 5 * MINUTE)['balance'].tolist(), [103.0])
+        self.assertEqual(buffer.covered_to, CURR + 5 * MINUTE)
+
+
+if __name__ == '__main__':
+    unittest.main()
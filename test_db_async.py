@@ -0,0 +1,47 @@
+import unittest
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+try:
+    import db_async
+except ImportError:  # asyncpg is optional
+    db_async = None
+
+
+def _attributes(**types):
+    return [SimpleNamespace(name=name, type=SimpleNamespace(name=kind)) for name, kind in types.items()]
+
+
+@unittest.skipIf(db_async is None, 'asyncpg not installed')
+class DbAsyncTest(unittest.TestCase):
+
+    def test_named_params_become_positional(self):
+        query, args = db_async.to_positional(
+            'SELECT * FROM t WHERE (timestamp = %(curr_hour)s OR timestamp = %(curr)s) AND ts <= %(curr)s;',
+            {'curr': 2, 'curr_hour': 1, 'unused': 3})
+        self.assertEqual(query, 'SELECT * FROM t WHERE (timestamp = $1 OR timestamp = $2) AND ts <= $2')
+        self.assertEqual(args, [1, 2])
+
+    def test_frame_from_records_types(self):
+        attributes = _attributes(timestamp='timestamptz', pm='text', balance='numeric', is_fallback='bool')
+        records = [(datetime(2026, 3, 11, 10, 35, tzinfo=timezone.utc), 'sp1', 1.5, True),
+                   (datetime(2026, 3, 11, 10, 0, tzinfo=timezone.utc), '', None, False)]
+        df = db_async._frame_from_records(records, attributes)
+
+        self.assertEqual(str(df['timestamp'].dt.tz), 'UTC')
+        self.assertEqual(df['pm'].tolist(), ['sp1', ''])
+        self.assertEqual(df['balance'].dtype, 'float64')
+        self.assertTrue(df['balance'].isna().iloc[1])
+        self.assertEqual(df['is_fallback'].dtype, 'bool')
+
+    def test_empty_result_keeps_types(self):
+        df = db_async._frame_from_records([], _attributes(timestamp='timestamptz', balance='float8', is_fallback='bool'))
+        self.assertTrue(df.empty)
+        self.assertEqual(list(df.columns), ['timestamp', 'balance', 'is_fallback'])
+        self.assertEqual(str(df['timestamp'].dt.tz), 'UTC')
+        self.assertEqual(df['balance'].dtype, 'float64')
+        self.assertEqual(df['is_fallback'].dtype, 'bool')
+
+
+if __name__ == '__main__':
+    unittest.main()
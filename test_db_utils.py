@@ -0,0 +1,66 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import db_utils
+
+
+class RegisterStatementTest(unittest.TestCase):
+
+    def tearDown(self):
+        db_utils._statements.pop('test_statement', None)
+
+    def test_named_params_become_positional(self):
+        query = '''
+            SELECT * FROM balance_all_consolidated
+            WHERE (timestamp = %(curr_hour)s OR timestamp = %(curr)s) AND pm = ANY(%(pms)s) AND timestamp <= %(curr)s;
+        '''
+        db_utils.register_statement('test_statement', query,
+                                    {'curr': 'timestamptz', 'curr_hour': 'timestamptz', 'pms': 'text[]'})
+        original, prepare_stmt, names = db_utils._statements['test_statement']
+
+        self.assertEqual(original, query)
+        self.assertEqual(names, ['curr_hour', 'curr', 'pms'])
+        self.assertTrue(prepare_stmt.startswith('PREPARE test_statement (timestamptz, timestamptz, text[]) AS SELECT'))
+        self.assertIn('(timestamp = $1 OR timestamp = $2) AND pm = ANY($3) AND timestamp <= $2', prepare_stmt)
+        self.assertFalse(prepare_stmt.endswith(';'))
+
+    def test_statement_without_params(self):
+        db_utils.register_statement('test_statement', 'SELECT max(timestamp) FROM nav_table;')
+        self.assertEqual(db_utils._statements['test_statement'][1:],
+                         ('PREPARE test_statement AS SELECT max(timestamp) FROM nav_table', []))
+
+    def test_every_param_needs_a_type(self):
+        with self.assertRaises(ValueError):
+            db_utils.register_statement('test_statement', 'SELECT 1 WHERE %(a)s = %(b)s', {'a': 'text'})
+
+
+class GetEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved, db_utils._engine = db_utils._engine, None
+
+    def tearDown(self):
+        db_utils._engine = self.saved
+
+    def test_concurrent_first_calls_create_one_engine(self):
+        created = []
+
+        def create_engine(*args, **kwargs):
+            time.sleep(0.05)  # wide window for the other threads to race
+            created.append(object())
+            return created[-1]
+
+        with mock.patch.object(db_utils, 'create_engine', create_engine):
+            threads = [threading.Thread(target=db_utils.get_engine) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(created), 1)
+        self.assertIs(db_utils._engine, created[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timezone
+
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        fd, self.path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        self._orig_path = metrics.METRICS_PATH
+        metrics.METRICS_PATH = self.path
+
+    def tearDown(self):
+        metrics.METRICS_PATH = self._orig_path
+        os.remove(self.path)
+        metrics.reset()
+
+    def read_lines(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_tick_writes_one_json_line_with_nested_spans(self):
+        curr = datetime(2026, 10, 17, 21, 56, tzinfo=timezone.utc)
+        with metrics.tick('nav_tick', curr) as run:
+            with metrics.span('balance_query') as m:
+                with metrics.db_call('get_db_table') as db:
+                    db['rows'], db['bytes'] = 12, 340
+                m['rows'] = 12
+            with metrics.span('rollup'):
+                pass
+            run['ok'] = True
+
+        lines = self.read_lines()
+        self.assertEqual(len(lines), 1)
+        line = lines[0]
+        self.assertTrue(line['ok'])
+        self.assertEqual(line['curr'], curr.isoformat())
+
+        spans = {(s['kind'], s['name']): s for s in line['spans']}
+        self.assertEqual(spans[('db', 'get_db_table')]['parent'], 'balance_query')
+        self.assertEqual(spans[('db', 'get_db_table')]['bytes'], 340)
+        self.assertIsNone(spans[('stage', 'balance_query')]['parent'])
+        self.assertIn(('stage', 'rollup'), spans)
+
+    def test_failed_stage_is_recorded_and_reraised(self):
+        with self.assertRaises(ValueError):
+            with metrics.tick('nav_tick') as run:
+                with metrics.span('write'):
+                    raise ValueError('boom')
+
+        line = self.read_lines()[0]
+        self.assertFalse(line['ok'])
+        self.assertEqual(line['spans'][0]['error'], 'ValueError')
+
+    def test_nested_tick_is_a_span_of_the_outer_one(self):
+        with metrics.tick('catch_up') as outer:
+            with metrics.tick('nav_tick') as inner:
+                inner['ok'] = True
+            outer['ok'] = True
+
+        lines = self.read_lines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0]['tick'], 'catch_up')
+        self.assertEqual(lines[0]['spans'][0]['name'], 'nav_tick')
+
+    def test_spans_on_other_threads_only_belong_to_a_bound_tick(self):
+        def stage(name):
+            with metrics.span(name):
+                pass
+
+        def on_thread(target, *args):
+            thread = threading.Thread(target=target, args=args)
+            thread.start()
+            thread.join()
+
+        late = threading.Event()
+        with metrics.tick('nav_tick') as run:
+            on_thread(stage, 'background')  # e.g. the alert worker
+            on_thread(metrics.bind(stage), 'shard')
+            # a worker still running once its tick is over
+            worker = threading.Thread(target=metrics.bind(lambda: late.wait(5) and stage('late_shard')))
+            worker.start()
+            run['ok'] = True
+        with metrics.tick('nav_tick') as run:
+            late.set()
+            worker.join()
+            run['ok'] = True
+
+        first, second = self.read_lines()
+        self.assertEqual([s['name'] for s in first['spans']], ['shard'])
+        self.assertEqual(second['spans'], [])
+        self.assertIn('nav_stage_calls_total{stage="late_shard"} 1', metrics.render_prometheus())
+
+    def test_prometheus_totals(self):
+        for _ in range(2):
+            with metrics.tick('nav_tick') as run:
+                with metrics.span('balance_query'):
+                    with metrics.db_call('get_db_table') as db:
+                        db['rows'] = 5
+                run['ok'] = True
+
+        text = metrics.render_prometheus()
+        self.assertIn('nav_ticks_total{tick="nav_tick",ok="true"} 2', text)
+        self.assertIn('nav_stage_calls_total{stage="balance_query"} 2', text)
+        self.assertIn('nav_db_rows_total{op="get_db_table",stage="balance_query"} 10', text)
+        self.assertIn('# TYPE nav_db_seconds_total counter', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
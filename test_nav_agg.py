@@ -3,7 +3,10 @@ from unittest.mock import patch, MagicMock
 from datetime import datetime, timedelta, timezone
 import pandas as pd
 
+import nav_test
+from pm_mapping import build_snapshot
 from test import validate_and_enhance_balance_data, is_valid_timestamp
+from nav_test import is_valid_timestamp_vectorized, compute_nav, split_latest_balances
 
 
 # ── Shared fixtures ────────────────────────────────────────────────────────────
@@ -51,6 +54,54 @@ class TestIsValidTimestamp(unittest.TestCase):
         self.assertTrue(is_valid_timestamp(row, CURR, CURR_HOUR))
 
 
+# ── vectorized freshness filter / nav division ────────────────────────────────
+
+class TestVectorizedHelpers(unittest.TestCase):
+
+    def test_vectorized_matches_scalar_is_valid_timestamp(self):
+        rows = pd.DataFrame([
+            ('minute',  CURR),
+            ('minute',  CURR_HOUR),
+            ('hour',    CURR_HOUR),
+            ('hour',    CURR),
+            ('unknown', PREV_HOUR),
+            (None,      PREV_HOUR),   # pm 不在 mapping 裡 (left merge 後為 NaN)
+        ], columns=['update_frequency', 'timestamp'])
+
+        expected = [is_valid_timestamp(row, CURR, CURR_HOUR) for _, row in rows.iterrows()]
+        result = is_valid_timestamp_vectorized(rows['update_frequency'], rows['timestamp'], CURR, CURR_HOUR)
+
+        self.assertEqual(list(result), expected)
+
+    def test_compute_nav_zero_when_shares_missing_or_zero(self):
+        nav = compute_nav(pd.Series([100.0, 100.0, 100.0]), pd.Series([50.0, 0.0, None]))
+        self.assertEqual(list(nav), [2.0, 0.0, 0.0])
+
+    def test_split_latest_balances(self):
+        mapping = pd.DataFrame([
+            ('pm_min_now',   'minute'),
+            ('pm_min_stale', 'minute'),
+            ('pm_hour_now',  'hour'),
+            ('pm_hour_mid',  'hour'),
+            ('pm_hour_old',  'hour'),
+            ('pm_ahead',     'minute'),
+        ], columns=['pm', 'update_frequency'])
+        latest = pd.DataFrame([
+            ('pm_min_now',   CURR),
+            ('pm_min_stale', CURR - timedelta(minutes=5)),
+            ('pm_hour_now',  CURR_HOUR),
+            ('pm_hour_mid',  CURR - timedelta(minutes=5)),   # curr_hour 的 row 可能存在，要查
+            ('pm_hour_old',  PREV_HOUR),
+            ('pm_ahead',     CURR + timedelta(minutes=1)),   # 表已超過 tick，要查
+        ], columns=['pm', 'timestamp'])
+        latest['balance'] = 1.0
+
+        rows, lookup = split_latest_balances(latest, mapping, CURR, CURR_HOUR)
+
+        self.assertEqual(sorted(rows['pm']), ['pm_hour_now', 'pm_min_now'])
+        self.assertEqual(lookup, {'pm_hour_mid', 'pm_ahead'})
+
+
 # ── validate_and_enhance_balance_data integration tests ───────────────────────
 
 @patch('test.db_utils.get_db_table')
@@ -171,5 +222,59 @@ class TestValidateAndEnhance(unittest.TestCase):
         self.assertTrue((result[result['pm'].isin(['pm_alpha', 'pm_bravo', 'pm_charlie'])]['is_fallback'] == False).all())
 
 
+# ── batched fallback (nav_test) vs the per PM lookup (test.py) ─────────────────
+
+class TestBatchedFallback(unittest.TestCase):
+    """pm_alpha has a fallback row, pm_bravo has none - one batch lookup for both"""
+
+    BALANCE = pd.concat([_make_balance('pm_charlie', CURR_HOUR), _make_balance('pm_delta', CURR)], ignore_index=True)
+    FALLBACK = {'pm_alpha': _make_balance('pm_alpha', CURR - timedelta(minutes=2), 990_000.0)}
+
+    def _per_pm(self):
+        with patch('test.db_utils.get_db_table', return_value=PM_MAPPING.copy()), \
+                patch('test.get_fallback_balance_data',
+                      side_effect=lambda pm, curr: self.FALLBACK.get(pm, pd.DataFrame()).copy()):
+            return validate_and_enhance_balance_data(self.BALANCE, CURR, CURR_HOUR)
+
+    def _batch(self):
+        return pd.concat(self.FALLBACK.values(), ignore_index=True)
+
+    def _assert_same(self, expected, actual):
+        (expected_rows, expected_log), (rows, log) = expected, actual
+        columns = ['timestamp', 'pm', 'balance', 'is_fallback', 'is_inactive']
+        pd.testing.assert_frame_equal(rows[columns].sort_values('pm').reset_index(drop=True),
+                                      expected_rows[columns].sort_values('pm').reset_index(drop=True),
+                                      check_dtype=False)
+        for section in ('active_pms', 'inactive_pms'):
+            for key, value in expected_log[section].items():
+                if key == 'using_fallback_data':
+                    self.assertEqual(sorted(log[section][key], key=lambda info: info['pm']),
+                                     sorted(value, key=lambda info: info['pm']))
+                elif isinstance(value, list):
+                    self.assertEqual(sorted(log[section][key]), sorted(value), key)
+                else:
+                    self.assertEqual(log[section][key], value, key)
+        self.assertEqual(log['summary'], expected_log['summary'])
+
+    def test_batch_lookup_matches_per_pm_lookup(self):
+        with patch('nav_test.get_fallback_balance_data_batch', return_value=self._batch()) as lookup:
+            actual = nav_test.validate_and_enhance_balance_data(self.BALANCE, CURR, CURR_HOUR,
+                                                                mapping=build_snapshot(PM_MAPPING))
+        lookup.assert_called_once()
+        self.assertEqual(set(lookup.call_args.args[0]), {'pm_alpha', 'pm_bravo'})
+
+        expected = self._per_pm()
+        self._assert_same(expected, actual)
+        self.assertEqual(actual[1]['active_pms']['completely_missing'], ['pm_bravo'])
+
+    def test_batch_already_read_is_not_queried_again(self):
+        with patch('nav_test.get_fallback_balance_data_batch') as lookup:
+            actual = nav_test.validate_and_enhance_balance_data(self.BALANCE, CURR, CURR_HOUR,
+                                                                mapping=build_snapshot(PM_MAPPING),
+                                                                fallback_batch=self._batch())
+        lookup.assert_not_called()
+        self._assert_same(self._per_pm(), actual)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,97 @@
+import threading
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+import pandas as pd
+
+import nav_shards
+from pm_mapping import build_snapshot
+
+
+CURR = datetime(2026, 3, 11, 10, 35, 0, tzinfo=timezone.utc)
+
+MAPPING = pd.DataFrame([
+    # pm,     pm_group,       group,            fund
+    ('pm_a', 'sp1-a',        'sp1-cta',        'sp1'),
+    ('pm_b', 'sp1-b',        'sp1-cta',        'sp1'),
+    ('pm_c', 'sp2-c',        'sp2-cta',        'sp2'),
+    ('pm_d', 'sp2-classa-d', 'sp2-classa-cta', 'sp2-classa'),
+    ('pm_e', 'sp3-e',        'shared-cta',     'sp3'),
+    ('pm_f', 'sp3b-f',       'shared-cta',     'sp3b'),     # shares a group with sp3
+], columns=['pm', 'pm_group', 'group', 'fund'])
+
+
+def _log(active, fallback, missing):
+    return {
+        'timestamp': CURR,
+        'active_pms': {'expected_count': len(active) + len(fallback) + len(missing), 'with_current_data': active,
+                       'using_fallback_data': fallback, 'completely_missing': missing},
+        'inactive_pms': {'expected_count': 0, 'with_current_data': [], 'missing_data': []},
+        'summary': {'total_expected_pms': len(active) + len(fallback) + len(missing), 'total_with_data': len(active)},
+    }
+
+
+class TestFundShards(unittest.TestCase):
+
+    def test_one_shard_per_fund_unless_they_share_nodes(self):
+        shards = dict(nav_shards.fund_shards(MAPPING))
+        self.assertEqual(set(shards), {'sp1', 'sp2', 'sp2-classa', 'sp3+sp3b'})
+        self.assertEqual(sorted(shards['sp1']['pm']), ['pm_a', 'pm_b'])
+        self.assertEqual(sorted(shards['sp3+sp3b']['pm']), ['pm_e', 'pm_f'])
+
+    def test_merge_validation_logs(self):
+        merged = nav_shards.merge_validation_logs(
+            [_log(['pm_a'], [{'pm': 'pm_b'}], []), _log(['pm_c'], [], ['pm_d'])], CURR)
+        self.assertEqual(merged['active_pms']['expected_count'], 4)
+        self.assertEqual(merged['active_pms']['with_current_data'], ['pm_a', 'pm_c'])
+        self.assertEqual(merged['active_pms']['completely_missing'], ['pm_d'])
+        self.assertEqual(merged['summary']['total_with_data'], 2)
+
+
+class TestShardBalances(unittest.TestCase):
+
+    def test_shards_reuse_the_tick_read(self):
+        latest = pd.DataFrame({'pm': ['pm_a', 'pm_c'], 'timestamp': [CURR, CURR], 'balance': [1.0, 2.0]})
+        frame = MAPPING.assign(active=True, if_btc=False, update_frequency='minute')
+        store = mock.MagicMock()
+        with mock.patch.object(nav_shards.storage, 'get_store', return_value=store):
+            for name, rows in nav_shards.fund_shards(frame):
+                shard = build_snapshot(rows)
+                balance = nav_shards.shard_balances(CURR, CURR.replace(minute=0), shard, latest)
+                self.assertTrue(set(balance['pm']) <= shard.all_pms)
+            store.latest_balances.assert_not_called()
+            store.balances_at.assert_not_called()
+
+
+class TestRunShards(unittest.TestCase):
+
+    def test_slow_shard_times_out_without_holding_the_others(self):
+        release = threading.Event()
+
+        def process_shard(curr, shard, shares_history, rules, tick_balances=None):
+            if shard == 'slow':
+                release.wait(5)
+            return pd.DataFrame({'pm': [shard]}), _log([shard], [], []), True
+
+        shards = [('slow', 'slow'), ('fast-1', 'fast-1'), ('fast-2', 'fast-2')]
+        with mock.patch.object(nav_shards, 'process_shard', process_shard):
+            rows, logs, report = nav_shards.run_shards(CURR, shards, None, None, workers=3, deadline_seconds=0.2)
+        release.set()
+
+        self.assertEqual(report['slow']['status'], 'timed_out')
+        self.assertEqual(report['fast-1']['status'], 'ok')
+        self.assertEqual(sorted(rows['pm']), ['fast-1', 'fast-2'])
+        self.assertEqual(len(logs), 2)
+
+    def test_failing_shard_is_reported(self):
+        def process_shard(curr, shard, shares_history, rules, tick_balances=None):
+            raise RuntimeError('boom')
+
+        with mock.patch.object(nav_shards, 'process_shard', process_shard):
+            rows, logs, report = nav_shards.run_shards(CURR, [('sp1', 'sp1')], None, None, workers=1)
+        self.assertEqual(report['sp1']['status'], 'error')
+        self.assertTrue(rows.empty)
+
+
+if __name__ == '__main__':
+    unittest.main()
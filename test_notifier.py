@@ -0,0 +1,103 @@
+import threading
+import time
+import unittest
+
+from notifier import AlertDispatcher
+
+
+class StubTransport:
+    """本地 stub，取代 Telegram API"""
+
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, message, chat_id):
+        self.release.wait()
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError('telegram down')
+        self.sent.append((message, chat_id))
+
+
+class TestAlertDispatcher(unittest.TestCase):
+
+    def test_submit_does_not_block_on_slow_transport(self):
+        transport = StubTransport(delay=0.5)
+        dispatcher = AlertDispatcher(transport=transport, min_interval_seconds=0)
+
+        start = time.monotonic()
+        self.assertTrue(dispatcher.submit('hello'))
+        self.assertLess(time.monotonic() - start, 0.1)
+
+        self.assertTrue(dispatcher.flush(timeout=5))
+        self.assertEqual(transport.sent, [('hello', None)])
+
+    def test_repeat_within_window_is_suppressed(self):
+        transport = StubTransport()
+        dispatcher = AlertDispatcher(transport=transport, min_interval_seconds=0, dedup_window_seconds=60)
+
+        key = ('nav-data-alert', frozenset({'pm_alpha'}), frozenset())
+        self.assertTrue(dispatcher.submit('fallback pm_alpha', dedup_key=key))
+        self.assertFalse(dispatcher.submit('fallback pm_alpha again', dedup_key=key))
+        # 不同 PM set 仍然要送
+        self.assertTrue(dispatcher.submit('fallback pm_bravo', dedup_key=('nav-data-alert', frozenset({'pm_bravo'}), frozenset())))
+
+        dispatcher.flush(timeout=5)
+        self.assertEqual([m for m, _ in transport.sent], ['fallback pm_alpha', 'fallback pm_bravo'])
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        transport = StubTransport()
+        transport.release.clear()  # worker 卡在第一則
+        dispatcher = AlertDispatcher(transport=transport, maxsize=1, min_interval_seconds=0)
+
+        dispatcher.submit('first')
+        time.sleep(0.1)  # 讓 worker 取走第一則
+        self.assertTrue(dispatcher.submit('second'))
+        self.assertFalse(dispatcher.submit('third'))
+
+        transport.release.set()
+        dispatcher.flush(timeout=5)
+        self.assertEqual([m for m, _ in transport.sent], ['first', 'second'])
+
+    def test_transport_errors_do_not_kill_the_worker(self):
+        transport = StubTransport(fail=True)
+        dispatcher = AlertDispatcher(transport=transport, min_interval_seconds=0)
+
+        dispatcher.submit('one')
+        self.assertTrue(dispatcher.flush(timeout=5))
+        transport.fail = False
+        dispatcher.submit('two')
+        self.assertTrue(dispatcher.flush(timeout=5))
+        self.assertEqual([m for m, _ in transport.sent], ['two'])
+
+    def test_failed_send_does_not_suppress_the_retry(self):
+        transport = StubTransport(fail=True)
+        dispatcher = AlertDispatcher(transport=transport, min_interval_seconds=0, dedup_window_seconds=60)
+
+        self.assertTrue(dispatcher.submit('fallback pm_alpha', dedup_key='k'))
+        self.assertTrue(dispatcher.flush(timeout=5))
+        transport.fail = False
+        self.assertTrue(dispatcher.submit('fallback pm_alpha', dedup_key='k'))
+        self.assertTrue(dispatcher.flush(timeout=5))
+        self.assertEqual([m for m, _ in transport.sent], ['fallback pm_alpha'])
+        # sent now - the next repeat is suppressed
+        self.assertFalse(dispatcher.submit('fallback pm_alpha', dedup_key='k'))
+
+    def test_send_reported_as_failed_does_not_suppress_the_retry(self):
+        results = [False, True]
+        dispatcher = AlertDispatcher(transport=lambda message, chat_id: results.pop(0), min_interval_seconds=0,
+                                     dedup_window_seconds=60)
+
+        dispatcher.submit('missing pm_bravo', dedup_key='k')
+        self.assertTrue(dispatcher.flush(timeout=5))
+        self.assertTrue(dispatcher.submit('missing pm_bravo', dedup_key='k'))
+        self.assertTrue(dispatcher.flush(timeout=5))
+        self.assertEqual(results, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+from unittest import mock
+import pandas as pd
+
+import publish_rules
+import storage
+from pm_mapping import build_snapshot
+from storage import SQLiteStore
+from test_nav_agg import PM_MAPPING
+
+
+class TestRulesProvider(unittest.TestCase):
+
+    def setUp(self):
+        self.store = SQLiteStore(':memory:')
+        storage.set_store(self.store)
+
+    def tearDown(self):
+        storage.set_store(None)
+
+    def test_empty_table_means_no_rules(self):
+        rules = publish_rules.RulesProvider().get_rules()
+        self.assertEqual(rules.disabled, frozenset())
+        self.assertEqual(rules.hourly_only, frozenset())
+
+    def test_failed_read_uses_defaults_then_keeps_the_last_rules(self):
+        failure = storage.StoreReadError('database unreachable')
+        provider = publish_rules.RulesProvider(revalidate_seconds=0)
+        with mock.patch.object(self.store, 'publish_rules', side_effect=failure):
+            self.assertIn('sp2', provider.get_rules().disabled)
+
+        self.store.load_frame('publish_rules', pd.DataFrame([('sp1', 'hour', True)], columns=['node', 'cadence', 'enabled']))
+        self.assertEqual(provider.get_rules().hourly_only, frozenset({'sp1'}))
+        with mock.patch.object(self.store, 'publish_rules', side_effect=failure):
+            self.assertEqual(provider.get_rules().hourly_only, frozenset({'sp1'}))
+
+
+class TestNodeMask(unittest.TestCase):
+
+    def test_masks_are_bounded(self):
+        rules = publish_rules.default_rules()
+        with mock.patch.object(publish_rules, 'MAX_MASKS', 2):
+            for fingerprint in range(3):
+                rules.node_mask(build_snapshot(PM_MAPPING.copy(), fingerprint=(1, str(fingerprint))), on_hour=False)
+        self.assertEqual([key[0] for key in rules._masks], [(1, '1'), (1, '2')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+
+from rollup import IncrementalRollup, RollupEngine, add_aliases, combine_node_rows
+
+
+CURR = datetime(2026, 3, 11, 10, 35, 0, tzinfo=timezone.utc)
+CURR_HOUR = CURR.replace(minute=0)
+
+MAPPING = pd.DataFrame([
+    # pm,       pm_group,       group,     fund
+    ('pm_a',   'sp1-a',        'sp1-cta', 'sp1'),
+    ('pm_b',   'sp1-b',        'sp1-cta', 'sp1'),
+    ('pm_c',   'sp1-fof-c',    'sp1-fof', 'sp1'),
+    ('pm_d',   'sp2-classa-d', 'sp2-classa-cta', 'sp2-classa'),
+    ('pm_e',   'sp2-classa-d', 'sp2-classa-cta', 'sp2-classa'),
+], columns=['pm', 'pm_group', 'group', 'fund'])
+
+
+def _reference_rollup(balance, mapping):
+    """舊版 pandas groupby 寫法，作為對照"""
+    merged = pd.merge(balance, mapping, on='pm', how='left')
+    agg = {'balance': 'sum', 'is_fallback': 'any', 'is_inactive': 'any'}
+    pm_grouped = merged.groupby(['tick', 'timestamp', 'pm_group']).agg(agg).reset_index().rename(columns={'pm_group': 'pm'})
+    group_grouped = merged.groupby(['tick', 'timestamp', 'group']).agg(agg).reset_index().rename(columns={'group': 'pm'})
+    fund_grouped = merged.groupby(['tick', 'fund']).agg({**agg, 'timestamp': 'max'}).reset_index().rename(columns={'fund': 'pm'})
+    aliases = []
+    for alias, source in [('sp1-gross', 'sp1'), ('sp2-classa-gross', 'sp2-classa')]:
+        rows = fund_grouped[fund_grouped['pm'] == source].copy()
+        rows['pm'] = alias
+        aliases.append(rows)
+    return pd.concat([pm_grouped, group_grouped, fund_grouped] + aliases)
+
+
+def _sorted(df):
+    return df[['tick', 'timestamp', 'pm', 'balance', 'is_fallback', 'is_inactive']].sort_values(
+        ['tick', 'timestamp', 'pm']).reset_index(drop=True)
+
+
+class TestRollupEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = RollupEngine(MAPPING)
+        self.balance = pd.DataFrame([
+            (CURR, CURR,      'pm_a', 100.0,  False, False),
+            (CURR, CURR,      'pm_b', 200.0,  True,  False),
+            (CURR, CURR_HOUR, 'pm_c', 300.0,  False, False),   # hour PM 帶 curr_hour timestamp
+            (CURR, CURR,      'pm_d', np.nan, False, True),
+            (CURR, CURR,      'pm_e', 50.0,   False, False),
+            (CURR, CURR,      'pm_unmapped', 999.0, False, False),
+        ], columns=['tick', 'timestamp', 'pm', 'balance', 'is_fallback', 'is_inactive'])
+
+    def test_matches_groupby_reference(self):
+        result = self.engine.rollup(self.balance)
+        expected = _reference_rollup(self.balance, MAPPING)
+        pd.testing.assert_frame_equal(_sorted(result), _sorted(expected), check_dtype=False)
+
+    def test_matches_reference_across_many_ticks(self):
+        frames = []
+        for i in range(3):
+            frame = self.balance.copy()
+            frame['tick'] = CURR + timedelta(minutes=i)
+            frame['timestamp'] = frame['tick'].where(frame['pm'] != 'pm_c', CURR_HOUR)
+            frame['balance'] = frame['balance'] + i
+            frames.append(frame)
+        balance = pd.concat(frames, ignore_index=True)
+
+        result = self.engine.rollup(balance)
+        expected = _reference_rollup(balance, MAPPING)
+        pd.testing.assert_frame_equal(_sorted(result), _sorted(expected), check_dtype=False)
+
+    def test_gross_alias_equals_its_fund(self):
+        result = self.engine.rollup(self.balance).set_index('pm')
+        self.assertEqual(result.loc['sp1-gross', 'balance'], result.loc['sp1', 'balance'])
+        self.assertEqual(result.loc['sp1-gross', 'timestamp'], CURR)
+        self.assertTrue(result.loc['sp1-gross', 'is_fallback'])
+
+    def test_node_mask_skips_nodes(self):
+        mask = ~self.engine.nodes['pm'].isin(['sp1', 'sp1-fof']).to_numpy()
+        result = self.engine.rollup(self.balance, node_mask=mask)
+        self.assertNotIn('sp1', set(result['pm']))
+        self.assertNotIn('sp1-fof', set(result['pm']))
+        self.assertIn('sp1-gross', set(result['pm']))
+
+
+    def test_combined_partial_rollups_match_full_rollup(self):
+        # 例如 DB 算好的 fresh 部分 + client 端補上的 fallback 部分
+        fallback = self.balance['is_fallback']
+        fresh = self.engine.rollup(self.balance[~fallback], with_level=True)
+        patch = self.engine.rollup(self.balance[fallback], with_level=True)
+
+        result = combine_node_rows([fresh, patch])
+        pd.testing.assert_frame_equal(_sorted(result), _sorted(self.engine.rollup(self.balance)), check_dtype=False)
+
+    def test_add_aliases_copies_fund_rows(self):
+        nodes = self.engine.rollup(self.balance, with_level=True)
+        without_alias = nodes[nodes['level'] != 'alias']
+
+        result = add_aliases(without_alias)
+        pd.testing.assert_frame_equal(_sorted(result), _sorted(nodes), check_dtype=False)
+
+
+class TestIncrementalRollup(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = RollupEngine(MAPPING)
+        self.balance = pd.DataFrame([
+            (CURR,      'pm_a', 100.0, False, False),
+            (CURR,      'pm_b', 200.0, False, False),
+            (CURR_HOUR, 'pm_c', 300.0, False, False),
+            (CURR,      'pm_d', 40.0,  False, False),
+            (CURR,      'pm_e', 50.0,  False, False),
+        ], columns=['timestamp', 'pm', 'balance', 'is_fallback', 'is_inactive'])
+
+    def _full(self, balance, tick):
+        return self.engine.rollup(balance.assign(tick=tick))
+
+    def test_first_tick_is_full_rollup(self):
+        result = IncrementalRollup().update(self.balance, CURR, self.engine)
+        pd.testing.assert_frame_equal(_sorted(result), _sorted(self._full(self.balance, CURR)), check_dtype=False)
+
+    def test_next_tick_emits_only_changed_paths(self):
+        incremental = IncrementalRollup()
+        incremental.update(self.balance, CURR, self.engine)
+
+        tick = CURR + timedelta(minutes=1)
+        balance = self.balance.copy()
+        balance.loc[balance['pm'] == 'pm_e', ['timestamp', 'balance']] = [tick, 55.0]  # only pm_e moved
+        result = incremental.update(balance, tick, self.engine)
+
+        self.assertFalse(incremental.last_full)
+        self.assertEqual(incremental.last_changed, 1)
+        # pm_e's pm_group / group at the new timestamp, its fund and the fund's gross alias - nothing of sp1
+        self.assertEqual(set(result['pm']), {'sp2-classa-d', 'sp2-classa-cta', 'sp2-classa', 'sp2-classa-gross'})
+        full = self._full(balance, tick).set_index(['timestamp', 'pm'])
+        emitted = result.set_index(['timestamp', 'pm'])
+        pd.testing.assert_frame_equal(emitted, full.loc[emitted.index], check_dtype=False, check_index_type=False)
+
+    def test_gap_or_new_engine_rebuilds(self):
+        incremental = IncrementalRollup()
+        incremental.update(self.balance, CURR, self.engine)
+        incremental.update(self.balance, CURR + timedelta(minutes=2), self.engine)
+        self.assertTrue(incremental.last_full)
+        incremental.update(self.balance, CURR + timedelta(minutes=3), RollupEngine(MAPPING))
+        self.assertTrue(incremental.last_full)
+
+
+if __name__ == '__main__':
+    unittest.main()
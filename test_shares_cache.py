@@ -0,0 +1,88 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+
+import shares_cache
+import storage
+from storage import SQLiteStore
+
+
+CURR = datetime(2026, 3, 11, 10, 35, 0, tzinfo=timezone.utc)
+DAY = timedelta(days=1)
+
+
+def _shares(rows):
+    df = pd.DataFrame(rows, columns=['timestamp', 'pm', 'shares'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+    return df
+
+
+HISTORY = _shares([
+    (CURR - 2 * DAY, 'sp1', 100.0),
+    (CURR - DAY, 'sp1', 200.0),
+    (CURR + DAY, 'sp1', 300.0),  # not in effect yet at CURR
+    (CURR - DAY, 'sp2', 50.0),
+])
+
+
+class TestSharesAsOf(unittest.TestCase):
+
+    def test_shares_in_effect_at_each_timestamp(self):
+        history = shares_cache.build_history(HISTORY)
+        keys = pd.DataFrame({
+            'timestamp': [CURR, CURR - 2 * DAY, CURR - 3 * DAY, CURR + 2 * DAY, CURR, CURR],
+            'pm': ['sp1', 'sp1', 'sp1', 'sp1', 'sp2', 'sp3'],
+        })
+        np.testing.assert_array_equal(shares_cache.shares_as_of(keys, history),
+                                      [200.0, 100.0, np.nan, 300.0, 50.0, np.nan])
+
+    def test_refetched_rows_replace_same_timestamp(self):
+        history = shares_cache.build_history(HISTORY)
+        history = shares_cache.build_history(_shares([(CURR - DAY, 'sp1', 250.0)]), history)
+        self.assertEqual(len(history), len(HISTORY))
+        keys = pd.DataFrame({'timestamp': [CURR], 'pm': ['sp1']})
+        self.assertEqual(shares_cache.shares_as_of(keys, history)[0], 250.0)
+
+    def test_append_only_touches_the_tail(self):
+        history = shares_cache.build_history(HISTORY)
+        # refetch of the boundary rows only - nothing to do
+        boundary = HISTORY[HISTORY['timestamp'] == CURR + DAY]
+        self.assertIs(shares_cache.append_history(history, boundary), history)
+
+        rows = _shares([(CURR + DAY, 'sp1', 310.0), (CURR + DAY, 'sp2', 55.0), (CURR + 2 * DAY, 'sp1', 400.0)])
+        appended = shares_cache.append_history(history, rows)
+        pd.testing.assert_frame_equal(appended, shares_cache.build_history(rows, history))
+        pd.testing.assert_frame_equal(appended.iloc[:3], history.iloc[:3])
+
+
+class TestSharesCache(unittest.TestCase):
+
+    def setUp(self):
+        self.store = SQLiteStore(':memory:')
+        storage.set_store(self.store)
+
+    def tearDown(self):
+        storage.set_store(None)
+
+    def test_cold_start_then_incremental(self):
+        cache = shares_cache.SharesCache()
+        self.assertTrue(cache.get_history().empty)
+
+        self.store.load_frame('shares_table', HISTORY)
+        self.assertEqual(len(cache.get_history()), 4)
+        self.store.load_frame('shares_table', _shares([(CURR + 2 * DAY, 'sp2', 60.0)]))
+        history = cache.get_history()
+
+        self.assertEqual(len(history), 5)
+        self.assertTrue(history['timestamp'].is_monotonic_increasing)
+        latest = cache.get_latest_shares().set_index('pm')
+        self.assertEqual(latest.loc['sp1', 'shares'], 300.0)
+        self.assertEqual(latest.loc['sp2', 'shares'], 60.0)
+
+        # warm refresh with nothing new keeps the same index
+        self.assertIs(cache.get_history(), history)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+import pandas as pd
+
+import storage
+from storage import NavStore, PostgresStore, SQLiteStore
+from test_nav_agg import PM_MAPPING
+
+
+CURR = datetime(2026, 3, 11, 10, 35, 0, tzinfo=timezone.utc)
+CURR_HOUR = CURR.replace(minute=0)
+
+
+def _nav_rows(rows):
+    df = pd.DataFrame(rows, columns=['timestamp', 'pm', 'balance', 'shares', 'nav', 'is_fallback'])
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+    return df
+
+
+class TestSQLiteStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = SQLiteStore(':memory:')
+        self.store.load_frame('pm_mapping', PM_MAPPING)
+        balances = pd.DataFrame([
+            (CURR, 'pm_alpha', 100.0),
+            (CURR_HOUR, 'pm_charlie', 300.0),
+            (CURR - timedelta(minutes=1), 'pm_bravo', 200.0),
+            (CURR - timedelta(minutes=2), 'pm_bravo', 190.0),
+            (CURR - timedelta(minutes=1), 'pm_delta', None),   # null balance never used for fallback
+            (CURR - timedelta(minutes=30), 'pm_delta', 400.0),
+            (CURR - timedelta(hours=3), 'pm_echo', 500.0),     # outside the 2h lookback
+        ], columns=['timestamp', 'pm', 'balance'])
+        balances['timestamp'] = pd.to_datetime(balances['timestamp'], utc=True)
+        self.store.load_frame('balance_all_consolidated', balances)
+
+    def test_balances_at(self):
+        rows = self.store.balances_at(CURR, CURR_HOUR)
+        self.assertEqual(sorted(rows['pm']), ['pm_alpha', 'pm_charlie'])
+        self.assertEqual(str(rows['timestamp'].dt.tz), 'UTC')
+
+    def test_nav_rollup(self):
+        rows = self.store.nav_rollup(CURR, CURR_HOUR)
+        by_node = rows[rows['level'] != 'group'].set_index(['level', 'node'])
+
+        # presence: only PMs with a fresh row for their update_frequency
+        self.assertEqual(sorted(rows.loc[rows['level'] == 'pm', 'node']), ['pm_alpha', 'pm_charlie'])
+        # hour PM keeps its curr_hour timestamp, the fund takes the max timestamp
+        self.assertEqual(by_node.loc[('pm_group', 'grp-charlie'), 'timestamp'], pd.Timestamp(CURR_HOUR))
+        self.assertEqual(by_node.loc[('fund', 'sp1'), 'timestamp'], pd.Timestamp(CURR))
+        self.assertEqual(by_node.loc[('fund', 'sp1'), 'balance'], 400.0)
+        self.assertEqual(sorted(rows.loc[rows['level'] == 'group', 'timestamp']), [pd.Timestamp(CURR_HOUR), pd.Timestamp(CURR)])
+        self.assertFalse(rows['is_inactive'].any())
+
+    def test_fallback_balances_latest_non_null_within_lookback(self):
+        rows = self.store.fallback_balances({'pm_bravo', 'pm_delta', 'pm_echo'}, CURR).set_index('pm')
+        self.assertEqual(sorted(rows.index), ['pm_bravo', 'pm_delta'])
+        self.assertEqual(rows.loc['pm_bravo', 'balance'], 200.0)
+        self.assertEqual(rows.loc['pm_delta', 'balance'], 400.0)
+        self.assertEqual(rows.loc['pm_delta', 'timestamp'], pd.Timestamp(CURR - timedelta(minutes=30)))
+
+    def test_pm_mapping_round_trip(self):
+        frame = self.store.pm_mapping()
+        self.assertEqual(len(frame), len(PM_MAPPING))
+        self.assertEqual(set(frame.loc[frame['active'] == True, 'pm']), {'pm_alpha', 'pm_bravo', 'pm_charlie'})
+
+        before = self.store.pm_mapping_fingerprint()
+        self.assertEqual(before, self.store.pm_mapping_fingerprint())
+        self.store.load_frame('pm_mapping', PM_MAPPING.iloc[:2], replace=True)
+        self.assertNotEqual(before, self.store.pm_mapping_fingerprint())
+
+    def test_shares_since(self):
+        shares = pd.DataFrame([
+            (CURR - timedelta(days=2), 'grp', 10.0),
+            (CURR - timedelta(days=1), 'grp', 11.0),
+            (CURR - timedelta(days=1), 'sp1', 5.0),
+        ], columns=['timestamp', 'pm', 'shares'])
+        self.store.load_frame('shares_table', shares)
+
+        since = self.store.shares_since(CURR - timedelta(days=1))
+        self.assertEqual(sorted(since['pm']), ['grp', 'sp1'])
+        self.assertTrue(self.store.shares_since(CURR - timedelta(days=2))['timestamp'].is_monotonic_increasing)
+
+    def test_upsert_nav(self):
+        self.assertIsNone(self.store.last_nav_timestamp())
+        self.assertTrue(self.store.upsert_nav(_nav_rows([(CURR, 'grp', 1.0, 1.0, 1.0, False)])))
+        self.store.upsert_nav(_nav_rows([(CURR, 'grp', 2.0, 1.0, 2.0, True)]), update=False)
+        self.store.upsert_nav(_nav_rows([(CURR, 'sp1', 3.0, 1.0, 3.0, False)]))
+
+        stored = pd.read_sql_query('SELECT * FROM nav_table ORDER BY pm', self.store.conn)
+        self.assertEqual(stored['balance'].tolist(), [1.0, 3.0])  # DO NOTHING kept the first grp row
+
+        self.store.upsert_nav(_nav_rows([(CURR, 'grp', 2.0, 1.0, 2.0, True)]))
+        stored = pd.read_sql_query('SELECT * FROM nav_table ORDER BY pm', self.store.conn)
+        self.assertEqual(stored['balance'].tolist(), [2.0, 3.0])
+        self.assertEqual(self.store.last_nav_timestamp(), pd.Timestamp(CURR))
+
+    def test_upsert_nav_fallback_only(self):
+        self.store.upsert_nav(_nav_rows([(CURR, 'grp', 1.0, 1.0, 1.0, True), (CURR, 'sp1', 1.0, 1.0, 1.0, False)]))
+        # late real data replaces the fallback row, and nothing else
+        self.store.upsert_nav(_nav_rows([(CURR, 'grp', 2.0, 1.0, 2.0, False), (CURR, 'sp1', 2.0, 1.0, 2.0, False)]),
+                              fallback_only=True)
+        self.store.upsert_nav(_nav_rows([(CURR, 'grp', 3.0, 1.0, 3.0, True)]), fallback_only=True)
+
+        stored = pd.read_sql_query('SELECT pm, balance, is_fallback FROM nav_table ORDER BY pm', self.store.conn)
+        self.assertEqual(list(stored.itertuples(index=False, name=None)), [('grp', 2.0, 0), ('sp1', 1.0, 0)])
+
+    def test_replace_nav_range_only_touches_written_nodes(self):
+        earlier = CURR - timedelta(minutes=1)
+        self.store.append_nav(_nav_rows([
+            (earlier, 'grp', 1.0, 1.0, 1.0, False),
+            (CURR, 'grp', 1.0, 1.0, 1.0, False),
+            (CURR, 'sp1', 1.0, 1.0, 1.0, False),
+        ]))
+        self.assertTrue(self.store.replace_nav_range(_nav_rows([(CURR, 'grp', 9.0, 1.0, 9.0, False)]), earlier, CURR))
+
+        stored = pd.read_sql_query('SELECT pm, balance FROM nav_table ORDER BY pm', self.store.conn)
+        self.assertEqual(list(stored.itertuples(index=False, name=None)), [('grp', 9.0), ('sp1', 1.0)])
+
+
+class TestNavStore(unittest.TestCase):
+
+    def test_incomplete_backend_cannot_be_created(self):
+        class BalancesOnly(NavStore):
+            def latest_balances(self):
+                return pd.DataFrame()
+
+        with self.assertRaises(TypeError):
+            BalancesOnly()
+
+    def test_last_nav_timestamp_naive_or_aware(self):
+        for last in (datetime(2026, 3, 11, 10, 35), pd.Timestamp(CURR).tz_convert('Europe/Paris')):
+            written = pd.DataFrame({'last_written': [last]})
+            with mock.patch.object(storage.db_utils, 'get_prepared', return_value=written):
+                self.assertEqual(PostgresStore().last_nav_timestamp(), pd.Timestamp(CURR))
+
+
+if __name__ == '__main__':
+    unittest.main()